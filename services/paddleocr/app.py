@@ -4,10 +4,19 @@ import logging
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from paddleocr import PaddleOCR
-from PIL import Image
-import numpy as np
-import cv2
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from memory_governor import MemoryPressureError, RequestTooLargeError
+from config import get_setting
+from ocr_backends import cascade_stats, padding_stats
+from prefilter import prefilter_stats
+from pipeline import OCRPipeline
+from profiles import available_profiles, default_profile, get_profile, profile_metrics
+from scheduler import BULK, INTERACTIVE, OCRScheduler
+from templates import TemplateError, TemplateRegistry
+from tiling import Tiler
+from uploads import UploadError, decode_image_bytes, iter_uploaded_files, upload_limits
+from worker_layout import plan_layout
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,34 +25,74 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Initialize PaddleOCR
-ocr_engine = None
+# Reject oversized bodies up front; per-file limits are enforced while streaming
+app.config['MAX_CONTENT_LENGTH'] = upload_limits()['max_request_size']
+
+# In-process OCR pipeline; engines are created per profile on first use
+pipeline = None
+
+# Inference threads per process: single-image requests go ahead of batch images,
+# and request threads keep reading upload bodies while OCR runs
+ocr_scheduler = OCRScheduler.from_config()
+
+# Very large images are OCR'd as overlapping tiles on a process pool
+tiler = Tiler.from_config()
 
-def initialize_ocr():
-    global ocr_engine
+# Form templates are shared with the other workers through templates.directory
+form_templates = TemplateRegistry.from_config()
+
+def initialize_ocr(layout=None):
+    global pipeline
     try:
-        # Initialize PaddleOCR with English language support
-        ocr_engine = PaddleOCR(
-            use_angle_cls=True,
-            lang='en',
-            use_gpu=False,  # Set to True if GPU is available
-            show_log=False
-        )
-        logger.info("PaddleOCR initialized successfully")
+        # A standalone process is a single worker that may use every usable CPU;
+        # each worker process gets an equal share of the memory budget
+        pipeline = OCRPipeline(layout or plan_layout(workers=1), tiler=tiler)
+
+        # Load the default profile's engine up front
+        engine = pipeline.engine()
+        if ocr_scheduler.reserved and not engine.thread_safe and pipeline.interactive_engines:
+            # Reserved interactive workers get their own copy so bulk jobs never hold them up
+            pipeline.engine(lane=INTERACTIVE)
+        # Fail the worker now if its share of the budget cannot fit a request beside the engine
+        pipeline.memory_governor.set_baseline()
+        logger.info(f"OCR engine initialized successfully ({engine.name} backend)")
     except Exception as e:
         logger.error(f"Failed to initialize PaddleOCR: {e}")
         raise
 
+def uploaded_files(fields, form):
+    """Stream the multipart body's file parts; a body over MAX_CONTENT_LENGTH is a 413 UploadError"""
+    try:
+        # Werkzeug checks a declared Content-Length when the stream is opened
+        stream = request.stream
+    except RequestEntityTooLarge:
+        raise UploadError(f"Request body exceeds {app.config['MAX_CONTENT_LENGTH']} bytes", 413)
+    return iter_uploaded_files(stream, request.content_type, fields, form=form, **upload_limits())
+
+def requested_profile(form=None):
+    """Profile from the 'profile' query parameter or form field (sent before the files)"""
+    return get_profile(request.args.get('profile') or (form or {}).get('profile'), pipeline.backend)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
-        status = 'healthy' if ocr_engine else 'unhealthy'
+        status = 'healthy' if pipeline else 'unhealthy'
         return jsonify({
             'status': status,
             'timestamp': datetime.now().isoformat(),
             'service': 'paddleocr',
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'memory': pipeline.memory_governor.status() if pipeline else None,
+            'scheduler': ocr_scheduler.metrics(),
+            'batching': padding_stats.snapshot(),
+            'cascade': cascade_stats.snapshot(),
+            'prefilter': prefilter_stats.snapshot(),
+            'profiles': {
+                'default': default_profile(),
+                'loaded': sorted({engine.profile for engine in pipeline.engines.values()}) if pipeline else [],
+                'requests': profile_metrics.snapshot()
+            }
         })
     except Exception as e:
         return jsonify({
@@ -51,98 +100,95 @@ def health_check():
             'message': str(e)
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint: not ready while the engine is down or memory headroom is low"""
+    memory = pipeline.memory_governor.status() if pipeline else None
+    ready = bool(pipeline) and bool(memory and memory['ready'])
+    return jsonify({
+        'ready': ready,
+        'memory': memory,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+def memory_error_response(error):
+    """Map governor rejections to 413 (never fits) or 503 (retry later)"""
+    if isinstance(error, RequestTooLargeError):
+        return jsonify({
+            'success': False,
+            'error': 'Image too large to process',
+            'details': str(error)
+        }), 413
+    response = jsonify({
+        'success': False,
+        'error': 'Server is low on memory, retry later',
+        'details': str(error)
+    })
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
 @app.route('/ocr/extract', methods=['POST'])
 def extract_text():
     """Extract text from image using PaddleOCR"""
     try:
-        if not ocr_engine:
+        if not pipeline:
             return jsonify({
                 'success': False,
                 'error': 'OCR engine not initialized'
             }), 500
 
-        # Check if file is present
-        if 'file' not in request.files:
+        # Stream the body; only the first 'file' part is read
+        form = {}
+        try:
+            upload = next(uploaded_files(['file'], form), None)
+        except UploadError as e:
             return jsonify({
                 'success': False,
-                'error': 'No file provided'
-            }), 400
+                'error': str(e)
+            }), e.status
 
-        file = request.files['file']
-        if file.filename == '':
+        if upload is None:
             return jsonify({
                 'success': False,
-                'error': 'No file selected'
+                'error': 'No file provided'
             }), 400
 
-        # Validate file type
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        if file_extension not in allowed_extensions:
+        if upload.error:
             return jsonify({
                 'success': False,
-                'error': 'Invalid file type. Supported: PNG, JPG, JPEG, GIF, BMP, TIFF'
-            }), 400
+                'error': upload.error
+            }), upload.status
 
-        # Save uploaded file temporarily
         upload_id = str(uuid.uuid4())
-        temp_path = f'/app/uploads/{upload_id}.{file_extension}'
-        file.save(temp_path)
 
         try:
-            # Load and process image
-            image = cv2.imread(temp_path)
-            if image is None:
+            try:
+                profile = requested_profile(form)
+                result = ocr_scheduler.submit(
+                    pipeline.run, upload.data, profile, request.args.get('tiling', 'auto'), priority=INTERACTIVE
+                ).result()
+            except MemoryPressureError as e:
+                return memory_error_response(e)
+            except ValueError as e:
                 return jsonify({
                     'success': False,
-                    'error': 'Could not read image file'
+                    'error': str(e)
                 }), 400
-
-            # Perform OCR
-            result = ocr_engine.ocr(temp_path, cls=True)
-            
-            # Process results
-            extracted_text = []
-            bounding_boxes = []
-            confidence_scores = []
             
-            if result and result[0]:
-                for line in result[0]:
-                    if len(line) >= 2:
-                        bbox = line[0]  # Bounding box coordinates
-                        text_info = line[1]  # Text and confidence
-                        
-                        if len(text_info) >= 2:
-                            text = text_info[0]
-                            confidence = float(text_info[1])
-                            
-                            extracted_text.append(text)
-                            confidence_scores.append(confidence)
-                            bounding_boxes.append({
-                                'text': text,
-                                'confidence': confidence,
-                                'position': {
-                                    'x': float(bbox[0][0]),
-                                    'y': float(bbox[0][1]),
-                                    'width': float(bbox[2][0] - bbox[0][0]),
-                                    'height': float(bbox[2][1] - bbox[0][1])
-                                }
-                            })
-
-            # Calculate overall confidence
-            overall_confidence = sum(confidence_scores) / len(confidence_scores) if confidence_scores else 0
-
-            # Combine all text
-            full_text = ' '.join(extracted_text)
-
             return jsonify({
                 'success': True,
                 'data': {
                     'id': upload_id,
-                    'text': full_text,
-                    'confidence': overall_confidence,
-                    'boundingBoxes': bounding_boxes,
+                    'text': result.text,
+                    'confidence': result.confidence,
+                    'boundingBoxes': [{
+                        'text': line.text,
+                        'confidence': line.confidence,
+                        'position': line.position()
+                    } for line in result],
                     'language': 'en',
+                    'profile': profile.name,
+                    'skipped': result.skipped,
                     'processedAt': datetime.now().isoformat(),
                     'engine': 'PaddleOCR',
                     'version': '2.7.0'
@@ -150,11 +196,8 @@ def extract_text():
             })
 
         finally:
-            # Clean up temporary file
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
+            # Release the uploaded bytes before the response is serialized
+            upload.data = b''
 
     except Exception as e:
         logger.error(f"OCR extraction error: {e}")
@@ -168,55 +211,79 @@ def extract_text():
 def batch_extract_text():
     """Extract text from multiple images"""
     try:
-        if not ocr_engine:
+        if not pipeline:
             return jsonify({
                 'success': False,
                 'error': 'OCR engine not initialized'
             }), 500
 
-        files = request.files.getlist('files')
-        if not files:
+        # Each file is queued for OCR the moment its part has arrived; the scheduler
+        # runs files queued together (up to max_images) as one shape-aware batch
+        batch_images = int(get_setting('performance.batching.max_images', 8))
+        pending = []
+        form = {}
+        selected = {}
+
+        def submit(upload):
+            # A 'profile' form field precedes the files, so it has been read by now
+            if not selected:
+                selected['profile'] = requested_profile(form)
+            profile = selected['profile']
+            return ocr_scheduler.submit_batched(lambda images: pipeline.run_batch(images, profile)[0], upload.data,
+                                                key=('rest-batch', profile.name), max_batch=batch_images,
+                                                priority=BULK)
+
+        try:
+            for upload in uploaded_files(['files'], form):
+                if not upload.filename:
+                    continue
+                pending.append((upload, None if upload.error else submit(upload)))
+            # The whole body has been read: a 'profile' field after the files came too late
+            if selected and requested_profile(form).name != selected['profile'].name:
+                raise ValueError("The 'profile' form field must come before the files (or use ?profile=)")
+        except (UploadError, ValueError) as e:
+            for _, future in pending:
+                if future:
+                    future.cancel()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), getattr(e, 'status', 400)
+
+        if not pending:
             return jsonify({
                 'success': False,
                 'error': 'No files provided'
             }), 400
 
         results = []
-        for file in files:
-            if file.filename == '':
+        for upload, future in pending:
+            if upload.error:
+                results.append({
+                    'filename': upload.filename,
+                    'success': False,
+                    'error': upload.error
+                })
                 continue
 
-            # Process each file (simplified version)
             try:
                 upload_id = str(uuid.uuid4())
-                file_extension = file.filename.rsplit('.', 1)[1].lower()
-                temp_path = f'/app/uploads/{upload_id}.{file_extension}'
-                file.save(temp_path)
-
-                result = ocr_engine.ocr(temp_path, cls=True)
-                
-                extracted_text = []
-                if result and result[0]:
-                    for line in result[0]:
-                        if len(line) >= 2 and len(line[1]) >= 2:
-                            extracted_text.append(line[1][0])
+                result = future.result()
+                if isinstance(result, Exception):
+                    raise result
 
                 results.append({
-                    'filename': file.filename,
+                    'filename': upload.filename,
                     'id': upload_id,
-                    'text': ' '.join(extracted_text),
+                    'text': result.text,
+                    'profile': selected['profile'].name,
+                    'skipped': result.skipped,
                     'success': True
                 })
 
-                # Clean up
-                try:
-                    os.remove(temp_path)
-                except OSError:
-                    pass
-
             except Exception as e:
                 results.append({
-                    'filename': file.filename,
+                    'filename': upload.filename,
                     'success': False,
                     'error': str(e)
                 })
@@ -234,6 +301,148 @@ def batch_extract_text():
             'details': str(e)
         }), 500
 
+@app.route('/ocr/form', methods=['POST'])
+def extract_form():
+    """Read the variable fields of a form page using its registered template"""
+    try:
+        if not pipeline:
+            return jsonify({
+                'success': False,
+                'error': 'OCR engine not initialized'
+            }), 500
+
+        form = {}
+        try:
+            upload = next(uploaded_files(['file'], form), None)
+        except UploadError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), e.status
+
+        if upload is None:
+            return jsonify({
+                'success': False,
+                'error': 'No file provided'
+            }), 400
+
+        if upload.error:
+            return jsonify({
+                'success': False,
+                'error': upload.error
+            }), upload.status
+
+        template = request.args.get('template') or form.get('template') or None
+        try:
+            profile = requested_profile(form)
+            result = ocr_scheduler.submit(pipeline.read_form, upload.data, form_templates, template, profile,
+                                          priority=INTERACTIVE).result()
+        except MemoryPressureError as e:
+            return memory_error_response(e)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        finally:
+            upload.data = b''
+
+        if not result['matched']:
+            page = result.pop('result')
+            result.update({'text': page.text, 'confidence': page.confidence, 'line_count': len(page)})
+        result.update({'id': str(uuid.uuid4()), 'profile': profile.name, 'processedAt': datetime.now().isoformat()})
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+
+    except Exception as e:
+        logger.error(f"Form OCR error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Form OCR processing failed',
+            'details': str(e)
+        }), 500
+
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """List registered form templates"""
+    return jsonify({
+        'success': True,
+        'data': form_templates.list_templates()
+    })
+
+@app.route('/templates', methods=['POST'])
+def register_template():
+    """Register a form template: reference image ('file'), 'name' and 'fields' (JSON list of named boxes)"""
+    form = {}
+    try:
+        upload = None
+        for part in uploaded_files(['file'], form):
+            upload = upload or part
+    except UploadError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
+
+    if upload is None or upload.error:
+        return jsonify({
+            'success': False,
+            'error': upload.error if upload else 'No reference image provided'
+        }), upload.status if upload else 400
+
+    image = decode_image_bytes(upload.data)
+    if image is None:
+        return jsonify({
+            'success': False,
+            'error': 'Could not read image file'
+        }), 400
+
+    try:
+        template = form_templates.register(form.get('name', ''), image, form.get('fields', ''))
+    except TemplateError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Template registration error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Template registration failed',
+            'details': str(e)
+        }), 500
+
+    return jsonify({
+        'success': True,
+        'data': template.describe()
+    }), 201
+
+@app.route('/templates/<name>', methods=['DELETE'])
+def delete_template(name):
+    """Remove a form template"""
+    if not form_templates.remove(name):
+        return jsonify({
+            'success': False,
+            'error': f'Unknown form template: {name}'
+        }), 404
+    return jsonify({
+        'success': True
+    })
+
+@app.route('/ocr/profiles', methods=['GET'])
+def get_profiles():
+    """List speed/accuracy profiles selectable with the 'profile' parameter"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'profiles': [profile.describe(pipeline.backend if pipeline else None)
+                         for profile in available_profiles().values()],
+            'default': default_profile()
+        }
+    })
+
 @app.route('/ocr/languages', methods=['GET'])
 def get_supported_languages():
     """Get list of supported languages"""
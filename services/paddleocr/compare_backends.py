@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Accuracy/latency comparison of OCR backends over a local labeled corpus.
+
+The corpus is a directory of images with ground truth either in a
+``labels.tsv`` file (``relative/path.png<TAB>expected text``) or in sidecar
+``<image stem>.txt`` files. Each backend runs in its own process so that
+memory figures are not polluted by the other runtime.
+
+Usage:
+    python compare_backends.py --corpus ./corpus --backends paddle onnxruntime
+    python compare_backends.py --corpus ./corpus --backends paddle onnxruntime --output report.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.gif', '.webp'}
+
+
+def load_corpus(corpus_dir: str, limit: int = 0) -> List[Tuple[str, str]]:
+    """Return ``(image_path, expected_text)`` pairs."""
+    root = Path(corpus_dir)
+    items = []
+    manifest = root / 'labels.tsv'
+    if manifest.exists():
+        with open(manifest, 'r', encoding='utf-8') as handle:
+            for line in handle:
+                if '\t' not in line:
+                    continue
+                path, text = line.rstrip('\n').split('\t', 1)
+                items.append((str(root / path), text.replace('\\n', '\n')))
+    else:
+        for path in sorted(root.rglob('*')):
+            label = path.with_suffix('.txt')
+            if path.suffix.lower() in IMAGE_SUFFIXES and label.exists():
+                items.append((str(path), label.read_text(encoding='utf-8')))
+    if not items:
+        raise ValueError(f"No labeled images found in {corpus_dir}")
+    return items[:limit] if limit else items
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def edit_distance(a: Sequence[Any], b: Sequence[Any]) -> int:
+    """Levenshtein distance with a NumPy row recurrence."""
+    if not a:
+        return len(b)
+    if not b:
+        return len(a)
+    lookup = {token: i for i, token in enumerate(set(a) | set(b))}
+    b_ids = np.array([lookup[token] for token in b])
+    offsets = np.arange(len(b) + 1)
+    row = offsets.copy()
+    for i, token in enumerate(a, 1):
+        substitute = row[:-1] + (b_ids != lookup[token])
+        delete = row[1:] + 1
+        best = np.concatenate(([i], np.minimum(substitute, delete)))
+        # Insertions: row[j] = min_k(best[k] + j - k)
+        row = np.minimum.accumulate(best - offsets) + offsets
+    return int(row[-1])
+
+
+def _run_backend(backend: str, items: List[Tuple[str, str]], options: Dict[str, Any], results) -> None:
+    """Child process body: report the backend's run, or why it failed (missing runtime, bad model path)."""
+    try:
+        results.put(_measure_backend(backend, items, options))
+    except Exception as e:
+        results.put({'backend': backend, 'error': f"{type(e).__name__}: {e}"})
+
+
+def _measure_backend(backend: str, items: List[Tuple[str, str]], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the engine, OCR the corpus and return per-image results."""
+    import cv2
+
+    from layout import reading_order
+    from ocr_backends import create_backend
+    from worker_layout import engine_options, plan_layout
+
+    try:
+        import psutil
+        process = psutil.Process()
+    except ImportError:
+        process = None
+
+    rss_before = process.memory_info().rss if process else 0
+    started = time.perf_counter()
+    engine = create_backend(backend, options={**engine_options(plan_layout(workers=1)), **options})
+    load_seconds = time.perf_counter() - started
+
+    images = [cv2.imread(path) for path, _ in items]
+    if all(image is None for image in images):
+        raise ValueError('No readable images in the corpus')
+    engine.ocr(next(image for image in images if image is not None), cls=True)  # warm-up
+
+    records = []
+    for (path, expected), image in zip(items, images):
+        if image is None:
+            records.append({'path': path, 'error': 'unreadable'})
+            continue
+        started = time.perf_counter()
+        result = engine.ocr(image, cls=True)
+        latency = time.perf_counter() - started
+        lines = [line for line in (result[0] or []) if len(line) >= 2]
+        order = reading_order([line[0] for line in lines])
+        text = ' '.join(lines[i][1][0] for i in order)
+        records.append({'path': path, 'expected': expected, 'text': text, 'latency': latency})
+
+    return {
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'rss_mb': (process.memory_info().rss - rss_before) / (1 << 20) if process else None,
+        'records': records,
+    }
+
+
+def _wait_for_run(proc, results, backend: str) -> Dict[str, Any]:
+    """The child's report; an error record if it dies without one (crash, OOM kill)."""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not proc.is_alive():
+                try:
+                    return results.get(timeout=1.0)
+                except queue.Empty:
+                    return {'backend': backend, 'error': f"Worker exited with code {proc.exitcode}"}
+
+
+def summarize(run: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregate CER/WER and latency percentiles for one backend run."""
+    char_errors = char_total = word_errors = word_total = exact = 0
+    latencies = []
+    failures = 0
+    for record in run['records']:
+        if 'error' in record:
+            failures += 1
+            continue
+        expected = normalize_text(record['expected'])
+        actual = normalize_text(record['text'])
+        char_errors += edit_distance(actual, expected)
+        char_total += len(expected)
+        word_errors += edit_distance(actual.split(), expected.split())
+        word_total += len(expected.split())
+        exact += int(actual == expected)
+        latencies.append(record['latency'])
+
+    lat = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'backend': run['backend'],
+        'images': len(latencies),
+        'failures': failures,
+        'cer': round(char_errors / max(char_total, 1), 4),
+        'wer': round(word_errors / max(word_total, 1), 4),
+        'exact_match': round(exact / max(len(latencies), 1), 4),
+        'latency_ms': {
+            'mean': round(float(lat.mean()), 1),
+            'p50': round(float(np.percentile(lat, 50)), 1),
+            'p95': round(float(np.percentile(lat, 95)), 1),
+        },
+        'throughput': round(len(latencies) / max(sum(latencies), 1e-9), 2),
+        'load_seconds': round(run['load_seconds'], 2),
+        'rss_mb': round(run['rss_mb'], 1) if run['rss_mb'] is not None else None,
+    }
+
+
+def compare(corpus_dir: str, backends: Sequence[str], limit: int = 0,
+            options: Dict[str, Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run every backend over the corpus and return summaries plus deltas
+    against the first one that ran; a backend that failed is reported with
+    its ``error``.
+    """
+    items = load_corpus(corpus_dir, limit)
+    context = multiprocessing.get_context('spawn')
+    summaries = []
+    for backend in backends:
+        results = context.Queue()
+        proc = context.Process(target=_run_backend, args=(backend, items, (options or {}).get(backend, {}), results))
+        proc.start()
+        run = _wait_for_run(proc, results, backend)
+        proc.join()
+        if 'error' in run:
+            logger.error(f"{backend}: {run['error']}")
+            summaries.append(run)
+            continue
+        summary = summarize(run)
+        logger.info(f"{backend}: CER {summary['cer']}, p50 {summary['latency_ms']['p50']} ms")
+        summaries.append(summary)
+
+    completed = [summary for summary in summaries if 'error' not in summary]
+    if not completed:
+        return {'corpus': corpus_dir, 'images': len(items), 'backends': summaries}
+    baseline = completed[0]
+    for summary in completed[1:]:
+        summary['vs_' + baseline['backend']] = {
+            'cer_delta': round(summary['cer'] - baseline['cer'], 4),
+            'p50_speedup': round(baseline['latency_ms']['p50'] / max(summary['latency_ms']['p50'], 1e-9), 2),
+            'rss_delta_mb': (round(summary['rss_mb'] - baseline['rss_mb'], 1)
+                             if summary['rss_mb'] is not None and baseline['rss_mb'] is not None else None),
+        }
+    return {'corpus': corpus_dir, 'images': len(items), 'backends': summaries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR backends on a labeled corpus")
+    parser.add_argument('--corpus', required=True, help='Directory with images and labels')
+    parser.add_argument('--backends', nargs='+', default=['paddle', 'onnxruntime'])
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = compare(args.corpus, args.backends, args.limit)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+    if any('error' in summary for summary in report['backends']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
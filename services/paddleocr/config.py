@@ -0,0 +1,52 @@
+"""
+Configuration loading for the PaddleOCR services.
+
+Settings come from ``config.yaml`` (or the file named by ``PADDLEOCR_CONFIG``)
+and are looked up with dotted paths, e.g. ``get_setting('performance.max_workers')``.
+"""
+
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = Path(__file__).with_name('config.yaml')
+
+
+@lru_cache(maxsize=None)
+def load_config(path: str = '') -> Dict[str, Any]:
+    """Load and cache the YAML configuration; a missing file yields an empty config."""
+    config_path = Path(path or os.getenv('PADDLEOCR_CONFIG', '') or DEFAULT_CONFIG_PATH)
+    try:
+        with open(config_path, 'r') as config_file:
+            return yaml.safe_load(config_file) or {}
+    except FileNotFoundError:
+        logger.warning(f"Config file not found: {config_path}, using defaults")
+        return {}
+
+
+def get_setting(key: str, default: Any = None, config: Dict[str, Any] = None) -> Any:
+    """Look up a dotted ``key`` in the configuration, returning ``default`` when absent."""
+    node: Any = load_config() if config is None else config
+    for part in key.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return default
+        node = node[part]
+    return default if node is None else node
+
+
+def parse_size(value: Any) -> int:
+    """Parse sizes such as ``"2GB"``, ``"512MB"`` or plain byte counts."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().upper()
+    units = (('TB', 1 << 40), ('GB', 1 << 30), ('MB', 1 << 20), ('KB', 1 << 10), ('B', 1))
+    for suffix, factor in units:
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)].strip()) * factor)
+    return int(float(text))
@@ -0,0 +1,73 @@
+"""
+Per-request deadlines with cooperative cancellation.
+
+A :class:`Deadline` is created for each tool call and passed down to the
+per-image work. OCR of a single image cannot be interrupted, so work checks
+the deadline between images: once it has expired or the caller cancelled the
+request, no new image is started and whatever finished is returned.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time or was cancelled by the caller."""
+
+
+class Deadline:
+    """Expiry time plus a cancellation flag shared by all work of one request."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.expires = self.started + timeout if timeout else None
+        self.cancel_reason: Optional[str] = None
+        self._cancelled: Optional[asyncio.Event] = None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, ``None`` without a time limit, ``0`` once stopped."""
+        if self.cancel_reason:
+            return 0.0
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def stopped(self) -> Optional[str]:
+        """Why work must stop (``'cancelled: ...'`` or ``'deadline exceeded'``), else ``None``."""
+        if self.cancel_reason:
+            return f"cancelled: {self.cancel_reason}"
+        if self.expires is not None and time.monotonic() >= self.expires:
+            return 'deadline exceeded'
+        return None
+
+    def cancel(self, reason: str = 'cancelled by client') -> None:
+        self.cancel_reason = reason
+        if self._cancelled is not None:
+            self._cancelled.set()
+
+    def check(self) -> None:
+        """Raise :class:`DeadlineExceeded` if work must stop."""
+        reason = self.stopped
+        if reason:
+            raise DeadlineExceeded(reason)
+
+    def wait_timeout(self, cap: Optional[float] = None) -> Optional[float]:
+        """Timeout for a wait that must end by the deadline, optionally capped."""
+        remaining = self.remaining()
+        if cap is None:
+            return remaining
+        return cap if remaining is None else min(cap, remaining)
+
+    async def cancelled(self) -> None:
+        """Return once :meth:`cancel` is called (for racing against work)."""
+        if self._cancelled is None:
+            self._cancelled = asyncio.Event()
+            if self.cancel_reason:
+                self._cancelled.set()
+        await self._cancelled.wait()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
@@ -0,0 +1,47 @@
+"""
+Gunicorn settings for the PaddleOCR REST API.
+
+Workers and their inference threads follow the CPU layout from
+``worker_layout.plan_layout`` so that ``workers x threads`` matches the CPUs
+available to the container instead of oversubscribing them. Each worker
+accepts several requests at once (gthread) so its scheduler can run
+single-image requests ahead of queued batch images; inference itself stays
+on the scheduler's threads.
+"""
+
+from config import get_setting
+from worker_layout import apply_worker_placement, plan_layout
+
+worker_layout = plan_layout()
+
+bind = '0.0.0.0:8888'
+workers = worker_layout.workers
+threads = int(get_setting('performance.scheduler.request_threads', 4))
+timeout = 120
+wsgi_app = 'app:app'
+
+
+# Live workers per placement slot; only the master touches this
+slot_workers = [0] * worker_layout.workers
+
+
+def pre_fork(server, worker):
+    # A replacement worker takes the slot its predecessor freed, not one still in use.
+    # While old and new workers overlap during a reload, slots are shared evenly.
+    worker.slot = min(range(worker_layout.workers), key=slot_workers.__getitem__)
+    slot_workers[worker.slot] += 1
+
+
+def post_fork(server, worker):
+    # Runs before the app (and Paddle) is imported in the worker
+    apply_worker_placement(worker_layout, worker.slot)
+
+
+def child_exit(server, worker):
+    if hasattr(worker, 'slot'):
+        slot_workers[worker.slot] -= 1
+
+
+def post_worker_init(worker):
+    import app
+    app.initialize_ocr(worker_layout)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Offline bulk ingest: OCR a directory tree or manifest into sharded JSONL.
+
+Nightly backfills of millions of files gain nothing from HTTP or MCP: this
+runs the engines in-process in worker processes laid out like the service
+(``worker_layout``). The parent walks the inputs and hands out paths through
+a bounded queue; in each worker a background thread reads and decodes the
+next files while the engine runs shape-aware ``ocr_batch`` over the ones
+already decoded. Each worker appends one JSON record per file to its own
+shards, flushed line by line.
+
+The shards are the checkpoint: a re-run over the same output directory reads
+the paths already recorded and skips them, so an interrupted run resumes
+where it stopped. A line cut short by the interruption is truncated first.
+Failed files are recorded with an ``error`` and skipped too, unless
+``--retry-errors`` is given.
+
+Usage:
+    python ingest.py --input /data/scans --output /data/ocr
+    python ingest.py --manifest files.txt --output /data/ocr --workers 4 --profile fast
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+SHARD_PATTERN = 'part-*.jsonl'
+
+
+def image_suffixes() -> Set[str]:
+    """File suffixes picked up when walking directories (``security.allowed_extensions``)."""
+    extensions = get_setting('security.allowed_extensions',
+                             ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'])
+    suffixes = {ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in extensions}
+    return suffixes | ({'.tif'} if '.tiff' in suffixes else set())
+
+
+def iter_inputs(inputs: Iterable[str] = (), manifest: Optional[str] = None) -> Iterator[str]:
+    """Image paths under ``inputs`` (walked in sorted order) and listed one per line in ``manifest``."""
+    suffixes = image_suffixes()
+    for root in inputs:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for directory, subdirs, files in os.walk(root):
+            subdirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in suffixes:
+                    yield os.path.join(directory, name)
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as handle:
+            for line in handle:
+                path = line.strip()
+                if path and not path.startswith('#'):
+                    yield path
+
+
+def load_checkpoint(output_dir: Path, retry_errors: bool = False) -> Set[str]:
+    """
+    Paths already recorded in the shards of ``output_dir``. A trailing
+    partial line left by an interrupted run is truncated away.
+    """
+    done: Set[str] = set()
+    for shard in sorted(output_dir.glob(SHARD_PATTERN)):
+        with open(shard, 'rb+') as handle:
+            data = handle.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                handle.truncate(end)
+                logger.warning(f"Truncated a partial record at the end of {shard.name}")
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if retry_errors and record.get('error'):
+                continue
+            done.add(record['path'])
+    return done
+
+
+class ShardWriter:
+    """JSONL shards of one worker, rolled over every ``shard_size`` records."""
+
+    def __init__(self, output_dir: Path, prefix: str, shard_size: int):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = max(1, shard_size)
+        self.index = 0
+        self.count = 0
+        self._handle = None
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self._handle is None or self.count >= self.shard_size:
+            self.close()
+            self.index += 1
+            self.count = 0
+            path = self.output_dir / f'part-{self.prefix}-{self.index:05d}.jsonl'
+            self._handle = open(path, 'a', encoding='utf-8')
+        # One flushed line per file: a crash loses at most the line being written
+        self._handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._handle.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def page_record(path: str, result) -> Dict[str, Any]:
+    """
+    JSONL record of one page's :class:`~pipeline.OCRResult`: text and lines
+    in reading order, and the pre-filter's reason for pages it skipped.
+    """
+    return {
+        'path': path,
+        'width': int(result.width),
+        'height': int(result.height),
+        'text': result.text,
+        'confidence': result.confidence,
+        'skipped': result.skipped,
+        'lines': [{'text': result.texts[i], 'confidence': float(result.confidences[i]),
+                   'box': result.boxes[i].tolist()} for i in result.order],
+        'processed_at': datetime.now().isoformat(),
+    }
+
+
+def _prefetch(paths, decoded: queue.Queue) -> None:
+    """Worker thread: read and decode queued paths ahead of inference."""
+    from uploads import decode_image_bytes
+
+    while True:
+        path = paths.get()
+        if path is None:
+            decoded.put(None)
+            return
+        try:
+            with open(path, 'rb') as handle:
+                image = decode_image_bytes(handle.read())
+            decoded.put((path, image, None if image is not None else 'Could not decode image'))
+        except OSError as e:
+            decoded.put((path, None, str(e)))
+
+
+def _ingest_worker(index: int, layout: Dict[str, Any], settings: Dict[str, Any], paths, progress) -> None:
+    """Worker process body: build the engine, then OCR decoded files in shape-aware batches."""
+    writer = None
+    finished = False
+    # The parent counts workers by their final None, so post it even if engine setup fails
+    try:
+        from worker_layout import WorkerLayout, apply_worker_placement
+
+        plan = WorkerLayout(**layout)
+        apply_worker_placement(plan, index)
+
+        from pipeline import OCRPipeline
+
+        pipeline = OCRPipeline(plan, language=settings['language'], backend=settings['backend'])
+        engine = pipeline.engine(settings['profile'])
+        pipeline.memory_governor.set_baseline()
+
+        decoded: queue.Queue = queue.Queue(maxsize=settings['prefetch'])
+        threading.Thread(target=_prefetch, args=(paths, decoded), daemon=True).start()
+        writer = ShardWriter(Path(settings['output']), f"{settings['run']}-w{index:02d}", settings['shard_size'])
+        while not finished:
+            # Block for one file, then take whatever else is already decoded
+            batch = [decoded.get()]
+            while len(batch) < settings['batch'] and batch[-1] is not None:
+                try:
+                    batch.append(decoded.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+
+            ok = [item for item in batch if item[2] is None]
+            failed = [{'path': path, 'error': error, 'processed_at': datetime.now().isoformat()}
+                      for path, _, error in batch if error is not None]
+            if ok:
+                try:
+                    results, _ = pipeline.run_batch([image for _, image, _ in ok], engine=engine)
+                    records = [page_record(path, result) for (path, _, _), result in zip(ok, results)]
+                except Exception as e:
+                    logger.error(f"Worker {index}: batch of {len(ok)} failed: {e}")
+                    records = [{'path': path, 'error': str(e), 'processed_at': datetime.now().isoformat()}
+                               for path, _, _ in ok]
+                failed.extend(record for record in records if 'error' in record)
+                for record in records:
+                    if 'error' not in record:
+                        writer.write(record)
+            for record in failed:
+                writer.write(record)
+            if batch:
+                progress.put((len(batch) - len(failed), len(failed)))
+    except Exception as e:
+        logger.error(f"Worker {index} stopped: {e}")
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        progress.put(None)
+
+
+def ingest(inputs: List[str], output: str, manifest: Optional[str] = None, workers: Optional[int] = None,
+           profile: Optional[str] = None, backend: Optional[str] = None, language: str = 'en',
+           batch: Optional[int] = None, prefetch: Optional[int] = None, shard_size: Optional[int] = None,
+           retry_errors: bool = False) -> Dict[str, Any]:
+    """
+    OCR every input file not yet recorded under ``output``; returns run
+    totals. ``unfinished`` counts queued files no worker recorded.
+    """
+    from worker_layout import plan_layout
+
+    output_dir = Path(output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    done = load_checkpoint(output_dir, retry_errors)
+    if done:
+        logger.info(f"Resuming: {len(done)} files already recorded in {output_dir}")
+
+    layout = plan_layout(workers=workers)
+    prefetch = int(prefetch or get_setting('ingest.prefetch', 16))
+    settings = {
+        'output': str(output_dir),
+        'run': datetime.now().strftime('%Y%m%dT%H%M%S'),
+        'profile': profile,
+        'backend': backend,
+        'language': language,
+        'batch': int(batch or get_setting('ingest.batch', get_setting('performance.batching.max_images', 8))),
+        'prefetch': prefetch,
+        'shard_size': int(shard_size or get_setting('ingest.shard_size', 10000)),
+    }
+    context = multiprocessing.get_context('spawn')
+    # Bounded: the walk stays only a little ahead of the workers
+    paths = context.Queue(maxsize=layout.workers * prefetch)
+    progress = context.Queue()
+    procs = [context.Process(target=_ingest_worker, args=(i, asdict(layout), settings, paths, progress))
+             for i in range(layout.workers)]
+    for proc in procs:
+        proc.start()
+    logger.info(f"Ingesting into {output_dir} with {layout.workers} workers x {layout.threads_per_worker} threads")
+
+    totals = {'queued': 0, 'skipped': 0, 'processed': 0, 'failed': 0}
+    started = time.monotonic()
+    running = len(procs)
+
+    def drain(block: bool) -> None:
+        nonlocal running
+        while running:
+            try:
+                update = progress.get(timeout=1.0) if block else progress.get_nowait()
+            except queue.Empty:
+                return
+            if update is None:
+                running -= 1
+            else:
+                totals['processed'] += update[0]
+                totals['failed'] += update[1]
+            block = False
+
+    def hand_out(item: Optional[str]) -> None:
+        while True:
+            try:
+                paths.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                drain(block=False)
+                if not any(proc.is_alive() for proc in procs):
+                    raise RuntimeError("All ingest workers exited")
+
+    last_report = started
+    for path in iter_inputs(inputs, manifest):
+        if path in done:
+            totals['skipped'] += 1
+            continue
+        hand_out(path)
+        totals['queued'] += 1
+        if time.monotonic() - last_report > 30:
+            drain(block=False)
+            last_report = time.monotonic()
+            logger.info(f"Progress: {totals['processed'] + totals['failed']}/{totals['queued']} files, "
+                        f"{totals['failed']} failed, {totals['skipped']} skipped")
+    for _ in procs:
+        hand_out(None)
+    while running:
+        drain(block=True)
+        if running and not any(proc.is_alive() for proc in procs):
+            break
+    for proc in procs:
+        proc.join()
+
+    # Files handed to workers that died before recording them; a re-run picks them up
+    totals['unfinished'] = totals['queued'] - totals['processed'] - totals['failed']
+    totals['failed_workers'] = sum(1 for proc in procs if proc.exitcode)
+    if totals['unfinished']:
+        logger.error(f"{totals['unfinished']} of {totals['queued']} files were not recorded; "
+                     f"{totals['failed_workers']} workers failed")
+
+    elapsed = time.monotonic() - started
+    totals['seconds'] = round(elapsed, 1)
+    totals['files_per_second'] = round((totals['processed'] + totals['failed']) / elapsed, 2) if elapsed else 0.0
+    logger.info(f"Ingest finished: {totals}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk OCR of local files into sharded JSONL")
+    parser.add_argument('--input', nargs='*', default=[], help='Image files or directories to walk')
+    parser.add_argument('--manifest', help='File listing one image path per line')
+    parser.add_argument('--output', required=True, help='Directory for JSONL shards (also the checkpoint)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: planned worker layout)')
+    parser.add_argument('--profile', help='Speed/accuracy profile')
+    parser.add_argument('--backend', help='Inference backend')
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--batch', type=int, help='Images per shape-aware batch')
+    parser.add_argument('--prefetch', type=int, help='Decoded images buffered per worker')
+    parser.add_argument('--shard-size', type=int, help='Records per JSONL shard')
+    parser.add_argument('--retry-errors', action='store_true', help='Re-run files recorded with an error')
+    args = parser.parse_args()
+    if not args.input and not args.manifest:
+        parser.error('give --input and/or --manifest')
+
+    logging.basicConfig(level=logging.INFO)
+    totals = ingest(args.input, args.output, args.manifest, args.workers, args.profile, args.backend,
+                    args.language, args.batch, args.prefetch, args.shard_size, args.retry_errors)
+    print(json.dumps(totals, indent=2))
+    if totals['unfinished']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
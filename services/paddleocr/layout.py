@@ -0,0 +1,415 @@
+"""
+Geometric layout reconstruction for PaddleOCR results.
+
+PaddleOCR returns text regions in detector order, which interleaves columns on
+multi-column pages. This module rebuilds the page structure purely from box
+geometry: tables, columns, lines and paragraphs, plus a reading order that
+the front ends use to join text.
+
+All grouping is done with vectorized NumPy over the whole page so that pages
+with thousands of regions cost a few milliseconds, well below inference time.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class LayoutParams:
+    """Tunable thresholds, expressed relative to the median text height."""
+    line_overlap: float = 0.5          # min vertical overlap ratio to share a line
+    column_gutter: float = 1.5         # min empty vertical strip width between columns
+    wide_box_ratio: float = 0.55       # boxes wider than this share of the page are ignored for gutters
+    paragraph_gap: float = 0.9         # max vertical gap between lines of one paragraph
+    paragraph_height_ratio: float = 1.4  # line height jump that starts a new paragraph
+    title_height_ratio: float = 1.3    # paragraphs this much taller than body text are titles
+    table_cell_gap: float = 1.0        # min horizontal gap between cells of a table row
+    table_cell_aspect: float = 12.0    # max mean width/height of cells in a table row
+    table_row_gap: float = 2.5         # max vertical gap between rows of one table
+    table_min_rows: int = 3
+
+
+DEFAULT_PARAMS = LayoutParams()
+
+_EPS = 1e-6
+
+
+def boxes_to_array(boxes: Any) -> np.ndarray:
+    """Normalize quads ``(N, 4, 2)`` or rectangles ``(N, 4)`` to ``(N, 4)`` x0, y0, x1, y1."""
+    arr = np.asarray(boxes, dtype=np.float64)
+    if arr.size == 0:
+        return np.zeros((0, 4), dtype=np.float64)
+    if arr.ndim == 3:
+        return np.stack([
+            arr[:, :, 0].min(axis=1),
+            arr[:, :, 1].min(axis=1),
+            arr[:, :, 0].max(axis=1),
+            arr[:, :, 1].max(axis=1),
+        ], axis=1)
+    if arr.ndim == 2 and arr.shape[1] == 8:
+        return boxes_to_array(arr.reshape(-1, 4, 2))
+    if arr.ndim == 2 and arr.shape[1] == 4:
+        return arr
+    raise ValueError(f"Unsupported box array shape: {arr.shape}")
+
+
+def _group_rows(rects: np.ndarray, container: np.ndarray, min_overlap: float) -> np.ndarray:
+    """Assign row ids so that rows are numbered top-to-bottom within each container."""
+    n = len(rects)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    y0, y1 = rects[:, 1], rects[:, 3]
+    order = np.lexsort(((y0 + y1) / 2, container))
+    sy0, sy1, sc = y0[order], y1[order], container[order]
+    heights = np.maximum(sy1 - sy0, _EPS)
+    overlap = np.minimum(sy1[1:], sy1[:-1]) - np.maximum(sy0[1:], sy0[:-1])
+    ratio = overlap / np.minimum(heights[1:], heights[:-1])
+    breaks = (ratio < min_overlap) | (sc[1:] != sc[:-1])
+    rows = np.empty(n, dtype=np.int64)
+    rows[order] = np.concatenate(([0], np.cumsum(breaks)))
+    return rows
+
+
+def _find_gutters(rects: np.ndarray, min_width: float, unit: float) -> np.ndarray:
+    """Return x positions of empty vertical strips at least ``min_width`` wide."""
+    if len(rects) < 2:
+        return np.zeros(0)
+    lo, hi = rects[:, 0].min(), rects[:, 2].max()
+    unit = max(unit, (hi - lo) / 4096, _EPS)
+    bins = int(np.ceil((hi - lo) / unit)) + 2
+    start = np.clip(np.floor((rects[:, 0] - lo) / unit).astype(np.int64), 0, bins)
+    stop = np.clip(np.ceil((rects[:, 2] - lo) / unit).astype(np.int64), 0, bins)
+    diff = np.zeros(bins + 1, dtype=np.int64)
+    np.add.at(diff, start, 1)
+    np.add.at(diff, stop, -1)
+    empty = np.cumsum(diff)[:bins] <= 0
+    edges = np.diff(np.concatenate(([False], empty, [False])).astype(np.int8))
+    run_start = np.flatnonzero(edges == 1)
+    run_stop = np.flatnonzero(edges == -1)
+    keep = (run_start > 0) & (run_stop < bins) & ((run_stop - run_start) * unit >= min_width)
+    return lo + (run_start[keep] + run_stop[keep]) * unit / 2.0
+
+
+def _segment_bounds(keys: np.ndarray) -> np.ndarray:
+    """Start offsets of runs of equal values in a sorted key array."""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def _reduce_rects(rects: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Union bounding rectangle of each run in an already grouped rect array."""
+    return np.stack([
+        np.minimum.reduceat(rects[:, 0], starts),
+        np.minimum.reduceat(rects[:, 1], starts),
+        np.maximum.reduceat(rects[:, 2], starts),
+        np.maximum.reduceat(rects[:, 3], starts),
+    ], axis=1)
+
+
+def _detect_tables(rects: np.ndarray, unit_h: float, params: LayoutParams) -> np.ndarray:
+    """Label each box with a table id, or -1 when it is not part of a table grid."""
+    n = len(rects)
+    table_of = np.full(n, -1, dtype=np.int64)
+    if n < params.table_min_rows * 2:
+        return table_of
+
+    rows = _group_rows(rects, np.zeros(n, dtype=np.int64), params.line_overlap)
+    order = np.lexsort((rects[:, 0], rows))
+    srows, srects = rows[order], rects[order]
+    starts = _segment_bounds(srows)
+    n_rows = len(starts)
+
+    counts = np.diff(np.append(starts, n))
+    widths = srects[:, 2] - srects[:, 0]
+    heights = np.maximum(srects[:, 3] - srects[:, 1], _EPS)
+    mean_aspect = np.add.reduceat(widths / heights, starts) / counts
+
+    gaps = srects[1:, 0] - srects[:-1, 2]
+    same_row = srows[1:] == srows[:-1]
+    gaps = np.where(same_row, gaps, np.inf)
+    min_gap = np.minimum.reduceat(np.append(gaps, np.inf), starts)
+
+    candidate = (
+        (counts >= 2)
+        & (min_gap >= params.table_cell_gap * unit_h)
+        & (mean_aspect <= params.table_cell_aspect)
+    )
+
+    row_rects = _reduce_rects(srects, starts)
+    row_gap = row_rects[1:, 1] - row_rects[:-1, 3]
+    run_break = np.concatenate((
+        [True],
+        (candidate[1:] != candidate[:-1]) | (row_gap > params.table_row_gap * unit_h),
+    ))
+    run_id = np.cumsum(run_break) - 1
+    run_len = np.bincount(run_id, minlength=run_id.max() + 1)
+    is_table_row = candidate & (run_len[run_id] >= params.table_min_rows)
+    if not is_table_row.any():
+        return table_of
+
+    row_table = np.where(is_table_row, run_id, -1)
+    box_run = np.repeat(row_table, counts)
+    table_of[order] = box_run
+
+    # Keep only runs that actually form a grid of two or more aligned columns
+    for tid in np.unique(row_table[row_table >= 0]):
+        members = table_of == tid
+        gutters = _find_gutters(rects[members], params.table_cell_gap * unit_h, unit_h / 4)
+        if len(gutters) == 0:
+            table_of[members] = -1
+
+    valid = np.unique(table_of[table_of >= 0])
+    remap = np.full(n_rows + 1, -1, dtype=np.int64)
+    remap[valid] = np.arange(len(valid))
+    return np.where(table_of >= 0, remap[table_of], -1)
+
+
+def reading_order(boxes: Any, params: Optional[LayoutParams] = None) -> np.ndarray:
+    """Return indices of ``boxes`` in reading order (columns, then lines, then x)."""
+    layout = _build_layout(boxes_to_array(boxes), params or DEFAULT_PARAMS, include_tables=True)
+    return layout['order']
+
+
+def _build_layout(rects: np.ndarray, params: LayoutParams, include_tables: bool) -> Dict[str, Any]:
+    """Core vectorized grouping shared by :func:`reading_order` and :func:`analyze_layout`."""
+    n = len(rects)
+    empty = np.zeros(0, dtype=np.int64)
+    if n == 0:
+        return {'order': empty, 'line': empty, 'paragraph': empty, 'column': empty,
+                'table': empty, 'gutters': np.zeros(0), 'unit_h': 0.0}
+
+    heights = np.maximum(rects[:, 3] - rects[:, 1], _EPS)
+    unit_h = float(np.median(heights))
+
+    table_of = _detect_tables(rects, unit_h, params) if include_tables else np.full(n, -1, dtype=np.int64)
+    n_tables = int(table_of.max()) + 1 if n else 0
+
+    # Layout units: free boxes plus one pseudo-box per table
+    free = np.flatnonzero(table_of < 0)
+    table_rects = np.zeros((n_tables, 4))
+    if n_tables:
+        tidx = np.flatnonzero(table_of >= 0)
+        torder = tidx[np.argsort(table_of[tidx], kind='stable')]
+        table_rects = _reduce_rects(rects[torder], _segment_bounds(table_of[torder]))
+    units = np.concatenate((rects[free], table_rects))
+    unit_is_table = np.concatenate((np.zeros(len(free), bool), np.ones(n_tables, bool)))
+
+    # Columns: gutters from boxes that are not page-wide, then spanning boxes cross a gutter
+    page_width = max(units[:, 2].max() - units[:, 0].min(), _EPS)
+    narrow = (units[:, 2] - units[:, 0]) <= params.wide_box_ratio * page_width
+    gutters = _find_gutters(units[narrow], params.column_gutter * unit_h, unit_h / 4)
+    col_lo = np.searchsorted(gutters, units[:, 0])
+    col_hi = np.searchsorted(gutters, units[:, 2])
+    spanning = col_lo != col_hi
+    centre_x = (units[:, 0] + units[:, 2]) / 2
+    column = np.where(spanning, -1, np.searchsorted(gutters, centre_x))
+
+    # Bands: spanning units cut the page vertically; consecutive spanning units share a band
+    centre_y = (units[:, 1] + units[:, 3]) / 2
+    span_idx = np.flatnonzero(spanning)
+    span_sorted = span_idx[np.argsort(centre_y[span_idx], kind='stable')]
+    span_y = centre_y[span_sorted]
+    n_span = len(span_sorted)
+    band = np.searchsorted(span_y, centre_y)  # number of spanning units above
+    occupied = np.bincount(band[~spanning], minlength=n_span + 1) > 0
+    rank = np.arange(n_span)
+    run_start = np.maximum.accumulate(np.where((rank == 0) | occupied[rank], rank, 0)) if n_span else rank
+    container_key = np.where(spanning, 0, 2 * band)
+    container_key[span_sorted] = 2 * run_start + 1
+    # column -1 (spanning) sorts first within its own band, which only holds spanning units
+    container = container_key * (len(gutters) + 2) + (column + 1)
+
+    # Lines within containers; tables are kept as single-line units
+    line_container = np.where(unit_is_table, -1 - np.arange(len(units)), container)
+    unit_line = _group_rows(units, line_container, params.line_overlap)
+
+    # Order lines by container then vertical position, words by x
+    line_order_key = np.lexsort((units[:, 0], unit_line, container))
+    sorted_lines = unit_line[line_order_key]
+    line_starts = _segment_bounds(sorted_lines)
+    line_rects = _reduce_rects(units[line_order_key], line_starts)
+    line_container_sorted = container[line_order_key][line_starts]
+    line_is_table = unit_is_table[line_order_key][line_starts]
+
+    # Renumber lines by (container, top) so line ids follow reading order
+    reorder = np.lexsort((line_rects[:, 1], line_container_sorted))
+    line_rank = np.empty(len(reorder), dtype=np.int64)
+    line_rank[reorder] = np.arange(len(reorder))
+    unit_line_rank = np.empty(len(units), dtype=np.int64)
+    unit_line_rank[line_order_key] = np.repeat(line_rank, np.diff(np.append(line_starts, len(units))))
+    line_rects = line_rects[reorder]
+    line_container_sorted = line_container_sorted[reorder]
+    line_is_table = line_is_table[reorder]
+
+    # Paragraphs: break on container change, large gap, height jump or table boundary
+    line_h = np.maximum(line_rects[:, 3] - line_rects[:, 1], _EPS)
+    gap = line_rects[1:, 1] - line_rects[:-1, 3]
+    height_ratio = np.maximum(line_h[1:], line_h[:-1]) / np.minimum(line_h[1:], line_h[:-1])
+    para_break = np.concatenate(([True], (
+        (line_container_sorted[1:] != line_container_sorted[:-1])
+        | (gap > params.paragraph_gap * unit_h)
+        | (height_ratio > params.paragraph_height_ratio)
+        | line_is_table[1:] | line_is_table[:-1]
+    )))
+    line_paragraph = np.cumsum(para_break) - 1
+
+    # Map unit-level results back to the original boxes
+    unit_of_box = np.empty(n, dtype=np.int64)
+    unit_of_box[free] = np.arange(len(free))
+    tbox = table_of >= 0
+    unit_of_box[tbox] = len(free) + table_of[tbox]
+
+    box_line = unit_line_rank[unit_of_box]
+    box_column = column[unit_of_box]
+    box_paragraph = line_paragraph[box_line]
+
+    # Within a table, order rows top-to-bottom then cells left-to-right
+    table_row = np.full(n, -1, dtype=np.int64)
+    if n_tables:
+        tmask = table_of >= 0
+        table_row[tmask] = _group_rows(rects[tmask], table_of[tmask], params.line_overlap)
+    order = np.lexsort((rects[:, 0], table_row, box_line))
+
+    return {
+        'order': order,
+        'line': box_line,
+        'paragraph': box_paragraph,
+        'column': box_column,
+        'table': table_of,
+        'table_row': table_row,
+        'line_rects': line_rects,
+        'line_paragraph': line_paragraph,
+        'line_is_table': line_is_table,
+        'gutters': gutters,
+        'unit_h': unit_h,
+    }
+
+
+def _rect_list(rect: np.ndarray) -> List[float]:
+    return [round(float(v), 2) for v in rect]
+
+
+def analyze_layout(boxes: Any, texts: Sequence[str], confidences: Optional[Sequence[float]] = None,
+                   include_tables: bool = True, params: Optional[LayoutParams] = None) -> Dict[str, Any]:
+    """
+    Reconstruct page layout from OCR regions.
+
+    Returns a dict with the ordered ``text``, the ``reading_order`` of the input
+    regions, detected ``columns`` and a list of ``blocks`` (title, paragraph or
+    table) each holding its lines or table cells.
+    """
+    params = params or DEFAULT_PARAMS
+    rects = boxes_to_array(boxes)
+    n = len(rects)
+    texts = list(texts)
+    conf = np.asarray(confidences if confidences is not None else np.ones(n), dtype=np.float64)
+    layout = _build_layout(rects, params, include_tables)
+    if n == 0:
+        return {'text': '', 'reading_order': [], 'columns': [], 'blocks': [],
+                'region_types': [], 'region_blocks': []}
+
+    order = layout['order']
+    box_line = layout['line']
+    box_para = layout['paragraph']
+    table_of = layout['table']
+    table_row = layout['table_row']
+    unit_h = layout['unit_h']
+
+    # Column extents from their member boxes
+    gutters = layout['gutters']
+    box_column = layout['column']
+    columns = []
+    for c in range(len(gutters) + 1):
+        members = box_column == c
+        if members.any():
+            r = rects[members]
+            columns.append({'index': c, 'bbox': _rect_list([r[:, 0].min(), r[:, 1].min(), r[:, 2].max(), r[:, 3].max()])})
+
+    # Per-paragraph statistics for title detection
+    line_rects = layout['line_rects']
+    line_h = line_rects[:, 3] - line_rects[:, 1]
+    body_h = float(np.median(line_h[~layout['line_is_table']])) if (~layout['line_is_table']).any() else unit_h
+    para_ids = layout['line_paragraph']
+    para_starts = _segment_bounds(para_ids)
+    para_line_count = np.diff(np.append(para_starts, len(para_ids)))
+    para_mean_h = np.add.reduceat(line_h, para_starts) / para_line_count if len(para_starts) else np.zeros(0)
+    para_rects = _reduce_rects(line_rects, para_starts) if len(para_starts) else np.zeros((0, 4))
+
+    blocks: List[Dict[str, Any]] = []
+    region_types = [''] * n
+    region_blocks = [-1] * n
+    ordered_sorted_para = box_para[order]
+    para_bounds = _segment_bounds(ordered_sorted_para)
+    para_bounds_end = np.append(para_bounds[1:], n)
+    text_parts = []
+
+    for start, stop in zip(para_bounds, para_bounds_end):
+        members = order[start:stop]
+        pid = int(box_para[members[0]])
+        tid = int(table_of[members[0]])
+        block_index = len(blocks)
+
+        if tid >= 0:
+            rows = table_row[members]
+            row_ids, row_index = np.unique(rows, return_inverse=True)
+            cell_gutters = _find_gutters(rects[members], params.table_cell_gap * unit_h, unit_h / 4)
+            centre_x = (rects[members, 0] + rects[members, 2]) / 2
+            col_index = np.searchsorted(cell_gutters, centre_x)
+            cells = [{
+                'row': int(r), 'col': int(c), 'text': texts[i],
+                'confidence': float(conf[i]), 'bbox': _rect_list(rects[i]), 'region': int(i),
+            } for i, r, c in zip(members, row_index, col_index)]
+            row_texts = []
+            for r in range(len(row_ids)):
+                row_texts.append('\t'.join(texts[i] for i in members[row_index == r]))
+            block_text = '\n'.join(row_texts)
+            blocks.append({
+                'type': 'table',
+                'column': int(box_column[members[0]]),
+                'bbox': _rect_list(para_rects[pid]),
+                'rows': len(row_ids),
+                'cols': len(cell_gutters) + 1,
+                'cells': cells,
+                'text': block_text,
+            })
+            block_type = 'table_cell'
+        else:
+            lines = []
+            line_ids = box_line[members]
+            line_bounds = _segment_bounds(line_ids)
+            for ls, le in zip(line_bounds, np.append(line_bounds[1:], len(members))):
+                words = members[ls:le]
+                lid = int(line_ids[ls])
+                lines.append({
+                    'text': ' '.join(texts[i] for i in words),
+                    'bbox': _rect_list(line_rects[lid]),
+                    'confidence': float(conf[words].mean()),
+                    'regions': [int(i) for i in words],
+                })
+            is_title = para_line_count[pid] <= 2 and para_mean_h[pid] >= params.title_height_ratio * body_h
+            block_type = 'title' if is_title else 'paragraph'
+            block_text = '\n'.join(line['text'] for line in lines)
+            blocks.append({
+                'type': block_type,
+                'column': int(box_column[members[0]]),
+                'bbox': _rect_list(para_rects[pid]),
+                'lines': lines,
+                'text': block_text,
+            })
+
+        for i in members:
+            region_types[i] = block_type
+            region_blocks[i] = block_index
+        text_parts.append(block_text)
+
+    return {
+        'text': '\n\n'.join(text_parts),
+        'reading_order': [int(i) for i in order],
+        'columns': columns,
+        'blocks': blocks,
+        'region_types': region_types,
+        'region_blocks': region_blocks,
+    }
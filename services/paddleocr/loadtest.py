@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+Load generator for the PaddleOCR REST API and MCP server with latency SLO reports.
+
+Closed-loop steps keep N clients busy back to back; open-loop steps send
+Poisson arrivals at a fixed rate and measure latency from each request's
+scheduled start, so a slow server cannot hide queueing by slowing the
+generator down. Every step records a latency histogram and percentiles,
+throughput, errors by kind and server-side memory/queue figures sampled from
+``/health`` (REST) or ``get_ocr_info`` (MCP). ``compare`` diffs two reports.
+
+``--stub`` starts the target itself with the model-free ``stub`` backend so
+that the serving layer (HTTP/MCP, uploads, scheduling, memory admission) is
+measured on its own.
+
+Usage:
+    python loadtest.py run --target rest-extract --images ./corpus --concurrency 10 50 200 --output a.json
+    python loadtest.py run --target mcp-extract --images ./corpus --rate 5 20 --stub --output b.json
+    python loadtest.py compare a.json b.json --tolerance 0.10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ('rest-extract', 'rest-batch', 'mcp-extract', 'mcp-batch')
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.gif', '.webp'}
+# Log-spaced histogram bucket edges in milliseconds
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000, 120000]
+HERE = Path(__file__).resolve().parent
+
+
+def load_images(images_dir: str, limit: int = 0) -> List[Tuple[str, bytes]]:
+    """Read the corpus into memory so disk reads do not skew latencies."""
+    paths = sorted(p for p in Path(images_dir).rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES)
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        raise ValueError(f"No images found in {images_dir}")
+    return [(p.name, p.read_bytes()) for p in paths]
+
+
+class Recorder:
+    """Per-request outcomes of one load step."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.images = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Optional[str], images: int) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.images += images
+
+    def drop(self) -> None:
+        """An open-loop arrival never sent: an error without a latency sample."""
+        with self._lock:
+            self.dropped += 1
+            self.errors['dropped'] = self.errors.get('dropped', 0) + 1
+
+
+class Target:
+    """One kind of request against the service under test."""
+
+    def __init__(self, kind: str, url: Optional[str], images: List[Tuple[str, bytes]], batch_size: int,
+                 timeout: float):
+        self.kind = kind
+        self.url = (url or '').rstrip('/')
+        self.images = images
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.images_per_request = batch_size if kind.endswith('batch') else 1
+        self._next = 0
+        self.client = None
+        self._payloads: List[str] = []
+        self._local = threading.local()
+
+    def pick(self) -> List[Tuple[str, Any]]:
+        """Next images round-robin; payloads are raw bytes (REST) or data URLs (MCP)."""
+        pool = self._payloads or [data for _, data in self.images]
+        chosen = []
+        for _ in range(self.images_per_request):
+            index = self._next % len(self.images)
+            self._next += 1
+            chosen.append((self.images[index][0], pool[index]))
+        return chosen
+
+    async def open(self, stub: bool) -> None:
+        if self.kind.startswith('mcp'):
+            from mcp_client import PaddleOCRMCPClient
+            env = {'OCR_BACKEND': 'stub'} if stub else None
+            self.client = PaddleOCRMCPClient(self.url or None, max_in_flight=1024, timeout=self.timeout, env=env)
+            await self.client.connect()
+            # Encode once up front so client-side encoding is not measured
+            self._payloads = [self.client.encode_image_data(data) for _, data in self.images]
+
+    async def close(self) -> None:
+        if self.client:
+            await self.client.disconnect()
+
+    async def call(self, executor: ThreadPoolExecutor) -> Tuple[Optional[str], int]:
+        """Issue one request; returns ``(error_kind or None, images)``."""
+        chosen = self.pick()
+        if self.kind == 'mcp-extract':
+            result = await self.client.call_tool('extract_text_from_image', {'image_data': chosen[0][1]})
+            return (None if result.get('success') else 'tool_error'), 1
+        if self.kind == 'mcp-batch':
+            images = [{'id': str(i), 'filename': name, 'image_data': data} for i, (name, data) in enumerate(chosen)]
+            result = await self.client.call_tool('batch_extract_text', {'images': images})
+            ok = sum(1 for item in result.get('results', []) if item.get('success'))
+            return (None if result.get('success') and ok == len(images) else 'tool_error'), ok
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._post, chosen)
+
+    def _post(self, chosen: List[Tuple[str, bytes]]) -> Tuple[Optional[str], int]:
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        if self.kind == 'rest-extract':
+            endpoint, files = '/ocr/extract', [('file', chosen[0])]
+        else:
+            endpoint, files = '/ocr/batch', [('files', item) for item in chosen]
+        response = session.post(self.url + endpoint, files=files, timeout=self.timeout)
+        if response.status_code != 200:
+            return f"http_{response.status_code}", 0
+        body = response.json()
+        if self.kind == 'rest-batch':
+            ok = sum(1 for item in body.get('data', []) if item.get('success'))
+            return (None if ok == len(chosen) else 'item_error'), ok
+        return (None if body.get('success') else 'app_error'), 1
+
+    async def server_status(self) -> Dict[str, Any]:
+        """Memory and scheduler figures reported by the server."""
+        if self.client:
+            info = await self.client.call_tool('get_ocr_info')
+            return {'memory': info.get('memory'), 'scheduler': info.get('scheduler')}
+        import requests
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, lambda: requests.get(self.url + '/health', timeout=5))
+        return response.json()
+
+
+async def _sample_server(target: Target, interval: float, samples: List[Dict[str, Any]],
+                         stop: asyncio.Event, pid: Optional[int]) -> None:
+    process = None
+    if pid:
+        try:
+            import psutil
+            process = psutil.Process(pid)
+            process.cpu_percent()
+        except Exception:
+            process = None
+    while not stop.is_set():
+        sample: Dict[str, Any] = {'t': time.monotonic()}
+        try:
+            status = await asyncio.wait_for(target.server_status(), interval * 5)
+            memory = status.get('memory') or {}
+            scheduler = status.get('scheduler') or {}
+            sample['rss_bytes'] = memory.get('rss_bytes')
+            sample['queued'] = {k: v.get('queued', 0) for k, v in scheduler.items() if isinstance(v, dict)}
+        except Exception as e:
+            sample['error'] = type(e).__name__
+        if process:
+            try:
+                children = process.children(recursive=True)
+                sample['cpu_percent'] = process.cpu_percent() + sum(c.cpu_percent() for c in children)
+            except Exception:
+                pass
+        samples.append(sample)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _timed(target: Target, executor: ThreadPoolExecutor, recorder: Recorder, started: float) -> None:
+    try:
+        error, images = await target.call(executor)
+    except Exception as e:
+        error, images = type(e).__name__, 0
+    recorder.record(time.perf_counter() - started, error, images)
+
+
+async def run_closed(target: Target, executor: ThreadPoolExecutor, concurrency: int, duration: float) -> Recorder:
+    """``concurrency`` clients, each sending its next request as soon as the last one returns."""
+    recorder = Recorder()
+    end = time.monotonic() + duration
+
+    async def client():
+        while time.monotonic() < end:
+            await _timed(target, executor, recorder, time.perf_counter())
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return recorder
+
+
+async def run_open(target: Target, executor: ThreadPoolExecutor, rate: float, duration: float,
+                   max_outstanding: int) -> Recorder:
+    """
+    Poisson arrivals at ``rate``/s; arrivals beyond ``max_outstanding`` count
+    as ``dropped`` errors and add no latency sample.
+    """
+    recorder = Recorder()
+    tasks = set()
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < duration:
+        scheduled += random.expovariate(rate)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_outstanding:
+            recorder.drop()
+            continue
+        # Latency counts from the scheduled arrival, not from when the loop got to it
+        task = asyncio.ensure_future(_timed(target, executor, recorder, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return recorder
+
+
+def summarize_step(recorder: Recorder, elapsed: float, samples: List[Dict[str, Any]],
+                   slo: Dict[str, float]) -> Dict[str, Any]:
+    lat = np.array(recorder.latencies) * 1000 if recorder.latencies else np.zeros(1)
+    requests_total = len(recorder.latencies) + recorder.dropped
+    errors = sum(recorder.errors.values())
+    counts, _ = np.histogram(lat, bins=[0] + HISTOGRAM_BOUNDS_MS + [np.inf])
+    rss = [s['rss_bytes'] for s in samples if s.get('rss_bytes')]
+    cpu = [s['cpu_percent'] for s in samples if 'cpu_percent' in s]
+    queued: Dict[str, int] = {}
+    for sample in samples:
+        for name, depth in sample.get('queued', {}).items():
+            queued[name] = max(queued.get(name, 0), depth)
+
+    summary = {
+        'requests': requests_total,
+        'errors': errors,
+        'error_rate': round(errors / max(requests_total, 1), 4),
+        'errors_by_kind': recorder.errors,
+        'throughput_rps': round((requests_total - errors) / max(elapsed, 1e-9), 2),
+        'images_per_second': round(recorder.images / max(elapsed, 1e-9), 2),
+        'latency_ms': {
+            'mean': round(float(lat.mean()), 1),
+            'p50': round(float(np.percentile(lat, 50)), 1),
+            'p95': round(float(np.percentile(lat, 95)), 1),
+            'p99': round(float(np.percentile(lat, 99)), 1),
+            'max': round(float(lat.max()), 1),
+            # Dropped arrivals have no latency; a 0 ms sample would flatter an overloaded step
+            'includes': 'sent requests, failed ones too; dropped arrivals excluded',
+        },
+        'histogram': {'bounds_ms': HISTOGRAM_BOUNDS_MS, 'counts': counts.tolist()},
+        'server': {
+            'rss_mb_max': round(max(rss) / (1 << 20), 1) if rss else None,
+            'rss_mb_mean': round(float(np.mean(rss)) / (1 << 20), 1) if rss else None,
+            'cpu_percent_mean': round(float(np.mean(cpu)), 1) if cpu else None,
+            'queue_depth_max': queued,
+            'samples': len(samples),
+        },
+    }
+    checks = {}
+    if slo.get('p99_ms'):
+        checks['p99_ms'] = summary['latency_ms']['p99'] <= slo['p99_ms']
+    if slo.get('error_rate') is not None:
+        checks['error_rate'] = summary['error_rate'] <= slo['error_rate']
+    summary['slo'] = {'targets': slo, 'checks': checks, 'met': all(checks.values())}
+    return summary
+
+
+def _launch_stub_rest(port: int) -> subprocess.Popen:
+    """Start gunicorn with the stub backend and wait until it is ready."""
+    import requests
+
+    env = {**os.environ, 'OCR_BACKEND': 'stub'}
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+                            cwd=str(HERE), env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Stub server exited with {proc.returncode}")
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/ready', timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("Stub server did not become ready")
+
+
+async def run_load(target_kind: str, url: Optional[str], images_dir: str, concurrency: List[int], rates: List[float],
+                   duration: float, warmup: float = 5.0, batch_size: int = 8, timeout: float = 120.0,
+                   stub: bool = False, server_pid: Optional[int] = None, slo: Optional[Dict[str, float]] = None,
+                   max_outstanding: int = 256, limit: int = 0, sample_interval: float = 1.0) -> Dict[str, Any]:
+    """Run every closed-loop concurrency and open-loop rate step and return the report."""
+    images = load_images(images_dir, limit)
+    if target_kind.startswith('rest'):
+        url = url or 'http://localhost:8888'
+    stub_server = None
+    if stub and target_kind.startswith('rest'):
+        port = int(url.rsplit(':', 1)[-1].strip('/')) if url.count(':') > 1 else 8888
+        stub_server = _launch_stub_rest(port)
+        server_pid = server_pid or stub_server.pid
+
+    target = Target(target_kind, url, images, batch_size, timeout)
+    steps = []
+    # REST requests block a thread each, so the pool covers the most requests ever in flight
+    executor = ThreadPoolExecutor(max_workers=max(concurrency + ([max_outstanding] if rates else []) + [1]))
+    try:
+        await target.open(stub)
+        if warmup:
+            await run_closed(target, executor, 1, warmup)
+
+        plan = [('closed', c) for c in concurrency] + [('open', r) for r in rates]
+        for mode, level in plan:
+            samples: List[Dict[str, Any]] = []
+            stop = asyncio.Event()
+            sampler = asyncio.ensure_future(_sample_server(target, sample_interval, samples, stop, server_pid))
+            started = time.perf_counter()
+            if mode == 'closed':
+                recorder = await run_closed(target, executor, int(level), duration)
+            else:
+                recorder = await run_open(target, executor, float(level), duration, max_outstanding)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+            step = {'mode': mode, 'level': level, 'duration': round(elapsed, 2),
+                    **summarize_step(recorder, elapsed, samples, slo or {})}
+            logger.info(f"{mode} {level}: {step['throughput_rps']} req/s, p50 {step['latency_ms']['p50']} ms, "
+                        f"p99 {step['latency_ms']['p99']} ms, errors {step['error_rate']:.2%}")
+            steps.append(step)
+    finally:
+        await target.close()
+        executor.shutdown(wait=False)
+        if stub_server:
+            stub_server.terminate()
+            stub_server.wait()
+
+    return {
+        'target': target_kind,
+        'url': url,
+        'stub': stub,
+        'images': len(images),
+        'batch_size': target.images_per_request,
+        'started_at': datetime.now().isoformat(),
+        'steps': steps,
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], candidate: Dict[str, Any], tolerance: float = 0.10) -> Dict[str, Any]:
+    """
+    Diff matching steps of two reports. A step regresses when candidate
+    p95/p99 or error rate is worse, or throughput lower, by more than ``tolerance``.
+    """
+    base_steps = {(s['mode'], s['level']): s for s in baseline['steps']}
+    rows = []
+    for step in candidate['steps']:
+        base = base_steps.get((step['mode'], step['level']))
+        if base is None:
+            continue
+
+        def ratio(new: float, old: float) -> float:
+            return round(new / old - 1, 4) if old else 0.0
+
+        row = {
+            'mode': step['mode'],
+            'level': step['level'],
+            'p50_change': ratio(step['latency_ms']['p50'], base['latency_ms']['p50']),
+            'p95_change': ratio(step['latency_ms']['p95'], base['latency_ms']['p95']),
+            'p99_change': ratio(step['latency_ms']['p99'], base['latency_ms']['p99']),
+            'throughput_change': ratio(step['throughput_rps'], base['throughput_rps']),
+            'error_rate_delta': round(step['error_rate'] - base['error_rate'], 4),
+        }
+        row['regression'] = (row['p95_change'] > tolerance or row['p99_change'] > tolerance or
+                             row['throughput_change'] < -tolerance or row['error_rate_delta'] > 0.01)
+        rows.append(row)
+    return {
+        'baseline': baseline.get('started_at'),
+        'candidate': candidate.get('started_at'),
+        'tolerance': tolerance,
+        'steps': rows,
+        'regressions': sum(1 for row in rows if row['regression']),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['target']} ({'stub' if report['stub'] else 'real'} engine), {report['images']} images")
+    print(f"{'step':>14} {'req/s':>8} {'img/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>7} {'rss MB':>8} {'SLO':>5}")
+    for s in report['steps']:
+        print(f"{s['mode'] + ' ' + str(s['level']):>14} {s['throughput_rps']:>8} {s['images_per_second']:>8} "
+              f"{s['latency_ms']['p50']:>8} {s['latency_ms']['p95']:>8} {s['latency_ms']['p99']:>8} "
+              f"{s['error_rate']:>7.2%} {str(s['server']['rss_mb_max']):>8} {'ok' if s['slo']['met'] else 'MISS':>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the PaddleOCR REST API or MCP server")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Run a load sweep')
+    run.add_argument('--target', choices=TARGETS, default='rest-extract')
+    run.add_argument('--url', help='REST base URL (default http://localhost:8888) or MCP server URL '
+                                   '(default: spawn mcp_server.py over stdio)')
+    run.add_argument('--images', required=True, help='Directory of corpus images')
+    run.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+    run.add_argument('--concurrency', type=int, nargs='*', default=[10, 50, 200], help='Closed-loop client counts')
+    run.add_argument('--rate', type=float, nargs='*', default=[], help='Open-loop arrival rates (requests/s)')
+    run.add_argument('--duration', type=float, default=30, help='Seconds per step')
+    run.add_argument('--warmup', type=float, default=5, help='Seconds of single-client warm-up')
+    run.add_argument('--batch-size', type=int, default=8, help='Images per batch request')
+    run.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    run.add_argument('--max-outstanding', type=int, default=256, help='Open-loop cap on in-flight requests')
+    run.add_argument('--stub', action='store_true', help='Start the target with the stub backend')
+    run.add_argument('--server-pid', type=int, help='Server PID for CPU sampling (needs psutil)')
+    run.add_argument('--slo-p99-ms', type=float, help='p99 latency objective')
+    run.add_argument('--slo-error-rate', type=float, help='Error rate objective, e.g. 0.01')
+    run.add_argument('--output', help='Write the JSON report to this file')
+
+    cmp = sub.add_parser('compare', help='Compare two reports')
+    cmp.add_argument('baseline')
+    cmp.add_argument('candidate')
+    cmp.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'run':
+        slo = {'p99_ms': args.slo_p99_ms, 'error_rate': args.slo_error_rate}
+        report = asyncio.run(run_load(
+            args.target, args.url, args.images, args.concurrency, args.rate, args.duration,
+            warmup=args.warmup, batch_size=args.batch_size, timeout=args.timeout, stub=args.stub,
+            server_pid=args.server_pid, slo=slo, max_outstanding=args.max_outstanding, limit=args.limit,
+        ))
+        if args.output:
+            Path(args.output).write_text(json.dumps(report, indent=2))
+        print_report(report)
+        sys.exit(0 if all(step['slo']['met'] for step in report['steps']) else 1)
+
+    result = compare_reports(json.loads(Path(args.baseline).read_text()),
+                             json.loads(Path(args.candidate).read_text()), args.tolerance)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result['regressions'] else 0)
+
+
+if __name__ == '__main__':
+    main()
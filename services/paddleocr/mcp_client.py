@@ -1,95 +1,315 @@
 #!/usr/bin/env python3
 """
-PaddleOCR MCP Client Example
-Demonstrates how to connect to and use the PaddleOCR MCP server.
+PaddleOCR MCP Client
+Connects to the PaddleOCR MCP server over one persistent session and
+pipelines tool calls over it.
+
+Requests are JSON-RPC messages matched to their responses by id, so many
+``call_tool`` requests can be in flight on the same stdio pipe (or SSE
+socket) at once. A semaphore bounds the number in flight, every call has a
+timeout, and :meth:`PaddleOCRMCPClient.map` streams results back as they
+finish for bulk runs.
+
+Images can be prepared before transmission: downscaled to the server's
+advertised ``max_image_side``, optionally converted to grayscale and
+re-encoded (PNG for scans and line art, high-quality JPEG for photos) so
+payloads stay under ``max_image_bytes``.
 """
 
 import asyncio
 import json
 import base64
+import io
 import logging
-from typing import Dict, Any, List
+import os
+import shlex
+import sys
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 
+import mcp.types as types
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SERVER_SCRIPT = Path(__file__).with_name('mcp_server.py')
+
+# Used until the server's get_ocr_info limits are known
+DEFAULT_LIMITS = {
+    'max_image_bytes': 10485760,
+    'max_image_side': 4096,
+    'image_formats': ['bmp', 'gif', 'jpeg', 'png', 'tiff', 'webp'],
+    'grayscale_input': True
+}
+LOSSLESS_FORMATS = {'PNG', 'TIFF', 'BMP', 'GIF'}
+
+# Tools that take a server-side 'timeout'; the client passes its remaining time
+TIMED_TOOLS = {'extract_text_from_image', 'batch_extract_text', 'analyze_document_structure', 'extract_form_fields'}
+
+
+class MCPToolError(RuntimeError):
+    """A tool call failed, timed out or the session is not usable."""
+
+
 class PaddleOCRMCPClient:
-    """Example client for PaddleOCR MCP Server."""
-    
-    def __init__(self, server_url: str = "stdio://paddleocr-mcp-server"):
-        self.server_url = server_url
-        self.client = None
-        
+    """Client for PaddleOCR MCP Server."""
+
+    def __init__(self, server_url: Optional[str] = None, max_in_flight: int = 8,
+                 timeout: float = 120.0, env: Optional[Dict[str, str]] = None,
+                 prepare_images: bool = True, grayscale: bool = False, jpeg_quality: int = 92):
+        """
+        ``server_url`` is ``stdio://<command line>`` to spawn the server,
+        ``http(s)://host/sse`` for a running SSE endpoint, or ``None`` to
+        spawn ``mcp_server.py`` next to this file with the current interpreter.
+
+        With ``prepare_images`` images over the server limits are downscaled
+        and re-encoded before sending; ``grayscale`` always converts them.
+        """
+        self.server_url = server_url or f"stdio://{shlex.quote(sys.executable)} {shlex.quote(str(SERVER_SCRIPT))}"
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.timeout = timeout
+        self.env = env
+        self.prepare_images = prepare_images
+        self.grayscale = grayscale
+        self.jpeg_quality = jpeg_quality
+        self.limits = dict(DEFAULT_LIMITS)
+        self.client: Optional[ClientSession] = None
+        self._stack: Optional[AsyncExitStack] = None
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+
     async def connect(self):
-        """Connect to the MCP server."""
+        """Open the session; it stays open until :meth:`disconnect`."""
+        if self.client:
+            return
+        stack = AsyncExitStack()
         try:
-            # In a real implementation, you would use the MCP client SDK
-            # For now, this is a placeholder for the connection logic
             logger.info(f"Connecting to MCP server at {self.server_url}")
-            # self.client = MCPClient(self.server_url)
-            # await self.client.connect()
-            logger.info("Connected to PaddleOCR MCP Server")
+            if self.server_url.startswith(('http://', 'https://')):
+                from mcp.client.sse import sse_client
+                read_stream, write_stream = await stack.enter_async_context(sse_client(self.server_url))
+            else:
+                command = shlex.split(self.server_url[len('stdio://'):] if self.server_url.startswith('stdio://')
+                                      else self.server_url)
+                params = StdioServerParameters(
+                    command=command[0],
+                    args=command[1:],
+                    env={**os.environ, **(self.env or {})},
+                )
+                read_stream, write_stream = await stack.enter_async_context(stdio_client(params))
+            session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
+            await asyncio.wait_for(session.initialize(), self.timeout)
         except Exception as e:
+            await stack.aclose()
             logger.error(f"Failed to connect to MCP server: {e}")
             raise
-    
+        self._stack, self.client = stack, session
+        logger.info("Connected to PaddleOCR MCP Server")
+
+        if self.prepare_images:
+            try:
+                info = await self.call_tool("get_ocr_info")
+                self.limits.update(info.get('limits', {}))
+            except MCPToolError as e:
+                logger.warning(f"Could not read server limits, using defaults: {e}")
+
     async def disconnect(self):
         """Disconnect from the MCP server."""
-        if self.client:
-            # await self.client.disconnect()
+        if self._stack:
+            stack, self._stack, self.client = self._stack, None, None
+            await stack.aclose()
             logger.info("Disconnected from MCP server")
-    
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """Encode an image file to base64."""
+
+    async def __aenter__(self) -> 'PaddleOCRMCPClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.disconnect()
+
+    def prepare_image(self, image_path: str) -> Tuple[bytes, str, float]:
+        """Read an image file and prepare it with :meth:`prepare_image_data`."""
+        with open(image_path, 'rb') as image_file:
+            return self.prepare_image_data(image_file.read())
+
+    def prepare_image_data(self, data: bytes) -> Tuple[bytes, str, float]:
+        """
+        Return ``(payload, mime_type, scale)`` for encoded image bytes. They
+        are sent as-is when they already fit the server limits; otherwise the
+        image is downscaled to ``max_image_side`` and re-encoded. ``scale``
+        maps original coordinates to those of the transmitted image.
+        """
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as img:
+            source_format = img.format or 'PNG'
+            mime_type = Image.MIME.get(source_format, 'application/octet-stream')
+            if not self.prepare_images:
+                return data, mime_type, 1.0
+
+            scale = min(1.0, self.limits['max_image_side'] / max(img.size))
+            accepted = source_format.lower() in set(self.limits['image_formats'])
+            if (scale == 1.0 and accepted and not self.grayscale and
+                    len(data) <= self.limits['max_image_bytes']):
+                return data, mime_type, 1.0
+
+            img.load()
+            gray = self.grayscale or img.mode in ('1', 'L', 'LA', 'I', 'I;16')
+            image = img.convert('L' if gray else 'RGB')
+            if scale < 1.0:
+                size = (max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale)))
+                image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        # Scans and line art compress best (and exactly) as PNG; photos as JPEG
+        buffer = io.BytesIO()
+        if gray or source_format in LOSSLESS_FORMATS:
+            image.save(buffer, format='PNG', optimize=True)
+            mime_type = 'image/png'
+        if not buffer.tell() or buffer.tell() > self.limits['max_image_bytes']:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
+            mime_type = 'image/jpeg'
+        logger.debug(f"Prepared image: {len(data)} -> {buffer.tell()} bytes, scale {scale:.3f}")
+        return buffer.getvalue(), mime_type, scale
+
+    def _encode_image(self, image_path: str) -> Tuple[str, float]:
         try:
-            with open(image_path, 'rb') as image_file:
-                encoded = base64.b64encode(image_file.read()).decode('utf-8')
-                return f"data:image/jpeg;base64,{encoded}"
+            payload, mime_type, scale = self.prepare_image(image_path)
+            encoded = base64.b64encode(payload).decode('utf-8')
+            return f"data:{mime_type};base64,{encoded}", scale
         except Exception as e:
             logger.error(f"Failed to encode image {image_path}: {e}")
             raise
-    
+
+    def encode_image_to_base64(self, image_path: str) -> str:
+        """Encode an image file as a data URL with its real MIME type."""
+        return self._encode_image(image_path)[0]
+
+    def encode_image_data(self, data: bytes) -> str:
+        """Encode in-memory image bytes as a data URL, prepared like files are."""
+        payload, mime_type, _ = self.prepare_image_data(data)
+        return f"data:{mime_type};base64,{base64.b64encode(payload).decode('utf-8')}"
+
+    @staticmethod
+    def _with_scale(result: Dict[str, Any], scale: float) -> Dict[str, Any]:
+        # Box coordinates refer to the transmitted image; divide by image_scale for the original
+        if scale != 1.0 and isinstance(result, dict):
+            result['image_scale'] = scale
+        return result
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None,
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Call a tool and return its decoded JSON payload. Waits for a free
+        in-flight slot first; ``timeout`` (default: the client's) covers the
+        wait and the call. The time left once the call is sent becomes the
+        tool's own ``timeout``, so the server stops too (a batch returns what
+        finished), and a call still running when it expires is cancelled on
+        the server. Raises :class:`MCPToolError` on failure.
+        """
+        if not self.client:
+            raise MCPToolError("Not connected to the MCP server")
+        timeout = self.timeout if timeout is None else timeout
+        expires = asyncio.get_running_loop().time() + timeout
+        try:
+            result = await asyncio.wait_for(self._call(name, arguments or {}, expires), timeout)
+        except asyncio.TimeoutError:
+            raise MCPToolError(f"{name} timed out after {timeout}s")
+
+        text = ''.join(getattr(item, 'text', '') for item in result.content)
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            # The server reports exceptions as plain text
+            raise MCPToolError(text or f"{name} returned no content")
+        if getattr(result, 'isError', False):
+            raise MCPToolError(payload.get('error', text) if isinstance(payload, dict) else text)
+        return payload
+
+    async def _call(self, name: str, arguments: Dict[str, Any], expires: float) -> Any:
+        async with self._slots:
+            if name in TIMED_TOOLS and 'timeout' not in arguments:
+                # A little short of the client's own limit, so partial results arrive before it
+                remaining = expires - asyncio.get_running_loop().time()
+                arguments = {**arguments, 'timeout': max(0.001, remaining * 0.9)}
+            # The id the session assigns to the request sent next (the SDK does not return it)
+            request_id = self.client._request_id
+            try:
+                return await self.client.call_tool(name, arguments)
+            except asyncio.CancelledError:
+                # The SDK only drops a timed-out call locally; stop the server's work as well
+                await self._cancel_request(request_id, 'client timeout')
+                raise
+
+    async def _cancel_request(self, request_id: int, reason: str) -> None:
+        try:
+            await self.client.send_notification(types.ClientNotification(types.CancelledNotification(
+                params=types.CancelledNotificationParams(requestId=request_id, reason=reason)
+            )))
+        except Exception as e:
+            logger.debug(f"Could not cancel request {request_id}: {e}")
+
+    async def map(self, name: str, arguments: Iterable[Dict[str, Any]],
+                  timeout: Optional[float] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Call ``name`` once per argument dict and yield ``(index, result)`` as
+        calls finish, not in input order. ``arguments`` is consumed lazily, so
+        at most ``max_in_flight`` payloads are held in memory. Failed calls
+        yield ``{'success': False, 'error': ...}`` instead of aborting the run.
+        """
+        source = enumerate(arguments)
+        pending: Dict[asyncio.Task, int] = {}
+        try:
+            while True:
+                while len(pending) < self.max_in_flight:
+                    item = next(source, None)
+                    if item is None:
+                        break
+                    index, args = item
+                    pending[asyncio.ensure_future(self.call_tool(name, args, timeout))] = index
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    try:
+                        yield index, task.result()
+                    except MCPToolError as e:
+                        yield index, {'success': False, 'error': str(e)}
+        finally:
+            for task in pending:
+                task.cancel()
+
     async def list_available_tools(self) -> List[Dict[str, Any]]:
         """List all available tools from the MCP server."""
         try:
-            # Mock response for demonstration
+            if not self.client:
+                raise MCPToolError("Not connected to the MCP server")
+            listing = await asyncio.wait_for(self.client.list_tools(), self.timeout)
             tools = [
                 {
-                    "name": "extract_text_from_image",
-                    "description": "Extract text from an image using PaddleOCR",
-                    "parameters": ["image_data", "language", "use_angle_cls", "use_gpu"]
-                },
-                {
-                    "name": "batch_extract_text", 
-                    "description": "Extract text from multiple images in batch",
-                    "parameters": ["images", "language", "parallel"]
-                },
-                {
-                    "name": "analyze_document_structure",
-                    "description": "Analyze document structure including layout, tables, and text regions",
-                    "parameters": ["image_data", "language", "include_tables", "include_layout"]
-                },
-                {
-                    "name": "get_ocr_info",
-                    "description": "Get information about PaddleOCR capabilities and configuration",
-                    "parameters": []
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": list((tool.inputSchema or {}).get("properties", {}))
                 }
+                for tool in listing.tools
             ]
             logger.info(f"Available tools: {[tool['name'] for tool in tools]}")
             return tools
         except Exception as e:
             logger.error(f"Failed to list tools: {e}")
             raise
-    
-    async def extract_text_from_image(self, image_path: str, language: str = "en", 
+
+    async def extract_text_from_image(self, image_path: str, language: str = "en",
                                     use_angle_cls: bool = True, use_gpu: bool = False) -> Dict[str, Any]:
         """Extract text from a single image."""
         try:
             # Encode image to base64
-            image_data = self.encode_image_to_base64(image_path)
-            
+            image_data, scale = self._encode_image(image_path)
+
             # Prepare arguments
             arguments = {
                 "image_data": image_data,
@@ -97,161 +317,109 @@ class PaddleOCRMCPClient:
                 "use_angle_cls": use_angle_cls,
                 "use_gpu": use_gpu
             }
-            
-            # Mock OCR result for demonstration
-            result = {
-                "success": True,
-                "text": "Sample extracted text from the image",
-                "confidence": 0.95,
-                "language": language,
-                "bounding_boxes": [
-                    {
-                        "text": "Sample text",
-                        "confidence": 0.95,
-                        "bbox": [[10, 10], [100, 10], [100, 30], [10, 30]]
-                    }
-                ],
-                "word_count": 2,
-                "processed_at": "2025-01-08T12:00:00",
-                "engine": "PaddleOCR-MCP",
-                "version": "3.1.0"
-            }
-            
+
+            result = self._with_scale(await self.call_tool("extract_text_from_image", arguments), scale)
+
             logger.info(f"OCR completed for {image_path}")
             return result
-            
+
         except Exception as e:
             logger.error(f"Failed to extract text from {image_path}: {e}")
             raise
-    
-    async def batch_extract_text(self, image_paths: List[str], language: str = "en", 
+
+    async def extract_text_from_images(self, image_paths: Iterable[str], language: str = "en",
+                                       use_angle_cls: bool = True,
+                                       timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Pipeline one ``extract_text_from_image`` call per path and yield
+        ``(path, result)`` as each finishes. Images are read and encoded only
+        when a slot frees up.
+        """
+        paths: List[str] = []
+        scales: List[float] = []
+
+        def arguments():
+            for path in image_paths:
+                image_data, scale = self._encode_image(path)
+                paths.append(path)
+                scales.append(scale)
+                yield {
+                    "image_data": image_data,
+                    "language": language,
+                    "use_angle_cls": use_angle_cls
+                }
+
+        async for index, result in self.map("extract_text_from_image", arguments(), timeout):
+            yield paths[index], self._with_scale(result, scales[index])
+
+    async def batch_extract_text(self, image_paths: List[str], language: str = "en",
                                 parallel: bool = True) -> Dict[str, Any]:
         """Extract text from multiple images."""
         try:
             # Prepare images data
             images = []
+            scales = {}
             for i, path in enumerate(image_paths):
-                image_data = self.encode_image_to_base64(path)
+                image_data, scales[f"img_{i}"] = self._encode_image(path)
                 images.append({
                     "id": f"img_{i}",
                     "image_data": image_data,
                     "filename": Path(path).name
                 })
-            
+
             arguments = {
                 "images": images,
                 "language": language,
                 "parallel": parallel
             }
-            
-            # Mock batch result
-            results = []
-            for img in images:
-                results.append({
-                    "id": img["id"],
-                    "filename": img["filename"],
-                    "success": True,
-                    "text": f"Sample text from {img['filename']}",
-                    "confidence": 0.92,
-                    "word_count": 3
-                })
-            
-            batch_result = {
-                "success": True,
-                "results": results,
-                "total_processed": len(image_paths),
-                "language": language,
-                "processed_at": "2025-01-08T12:00:00",
-                "parallel": parallel
-            }
-            
+
+            batch_result = await self.call_tool("batch_extract_text", arguments)
+            for item in batch_result.get("results", []):
+                self._with_scale(item, scales.get(item.get("id"), 1.0))
+
             logger.info(f"Batch OCR completed for {len(image_paths)} images")
             return batch_result
-            
+
         except Exception as e:
             logger.error(f"Failed to process batch OCR: {e}")
             raise
-    
+
     async def analyze_document_structure(self, image_path: str, language: str = "en",
                                        include_tables: bool = True, include_layout: bool = True) -> Dict[str, Any]:
         """Analyze document structure."""
         try:
-            image_data = self.encode_image_to_base64(image_path)
-            
+            image_data, scale = self._encode_image(image_path)
+
             arguments = {
                 "image_data": image_data,
                 "language": language,
                 "include_tables": include_tables,
                 "include_layout": include_layout
             }
-            
-            # Mock structure analysis result
-            structure_result = {
-                "success": True,
-                "document_structure": {
-                    "text_regions": [
-                        {
-                            "text": "Document Title",
-                            "confidence": 0.98,
-                            "bbox": [[50, 20], [200, 20], [200, 40], [50, 40]],
-                            "type": "title"
-                        },
-                        {
-                            "text": "This is a paragraph of text in the document.",
-                            "confidence": 0.93,
-                            "bbox": [[50, 60], [300, 60], [300, 80], [50, 80]], 
-                            "type": "paragraph"
-                        }
-                    ],
-                    "layout_analysis": include_layout,
-                    "table_recognition": include_tables,
-                    "total_regions": 2
-                },
-                "language": language,
-                "processed_at": "2025-01-08T12:00:00",
-                "engine": "PaddleOCR-Structure-MCP"
-            }
-            
+
+            structure_result = self._with_scale(
+                await self.call_tool("analyze_document_structure", arguments), scale
+            )
+
             logger.info(f"Document structure analysis completed for {image_path}")
             return structure_result
-            
+
         except Exception as e:
             logger.error(f"Failed to analyze document structure: {e}")
             raise
-    
+
+    async def query_ocr_result(self, result_id: str, query: str, **arguments: Any) -> Dict[str, Any]:
+        """Run a spatial query against a result retained by the server."""
+        return await self.call_tool("query_ocr_result", {"result_id": result_id, "query": query, **arguments})
+
     async def get_ocr_info(self) -> Dict[str, Any]:
         """Get OCR service information."""
         try:
-            info = {
-                "service": "PaddleOCR MCP Server",
-                "version": "3.1.0",
-                "supported_languages": ["en", "ch", "fr", "german", "korean", "japan", "ar", "es", "pt", "ru"],
-                "default_language": "en",
-                "active_engines": ["en_False", "ch_False"],
-                "capabilities": {
-                    "text_detection": True,
-                    "text_recognition": True,
-                    "angle_classification": True,
-                    "multilingual_support": True,
-                    "batch_processing": True,
-                    "document_structure_analysis": True,
-                    "gpu_acceleration": True
-                },
-                "models": {
-                    "detection": "PP-OCRv5 Detection",
-                    "recognition": "PP-OCRv5 Recognition",
-                    "classification": "PP-LCNet Text Direction"
-                },
-                "performance": {
-                    "accuracy": "High",
-                    "speed": "Fast",
-                    "model_size": "Lightweight (8.1MB)"
-                }
-            }
-            
+            info = await self.call_tool("get_ocr_info")
+
             logger.info("Retrieved OCR service information")
             return info
-            
+
         except Exception as e:
             logger.error(f"Failed to get OCR info: {e}")
             raise
@@ -259,37 +427,29 @@ class PaddleOCRMCPClient:
 async def demo_usage():
     """Demonstrate usage of the PaddleOCR MCP client."""
     client = PaddleOCRMCPClient()
-    
+
     try:
         # Connect to server
         await client.connect()
-        
+
         # List available tools
         tools = await client.list_available_tools()
         print("Available Tools:")
         for tool in tools:
             print(f"  - {tool['name']}: {tool['description']}")
-        
+
         # Get OCR info
         print("\n=== OCR Service Information ===")
         info = await client.get_ocr_info()
         print(json.dumps(info, indent=2))
-        
-        # Example image OCR (you would need actual image files)
-        # result = await client.extract_text_from_image("sample_image.jpg", language="en")
-        # print("\n=== OCR Result ===")
-        # print(json.dumps(result, indent=2))
-        
-        # Example batch OCR
-        # batch_result = await client.batch_extract_text(["image1.jpg", "image2.jpg"])
-        # print("\n=== Batch OCR Result ===")
-        # print(json.dumps(batch_result, indent=2))
-        
-        # Example document structure analysis
-        # structure = await client.analyze_document_structure("document.jpg")
-        # print("\n=== Document Structure ===")
-        # print(json.dumps(structure, indent=2))
-        
+
+        # OCR any images passed on the command line, pipelined over the one session
+        image_paths = sys.argv[1:]
+        if image_paths:
+            print("\n=== OCR Results ===")
+            async for path, result in client.extract_text_from_images(image_paths):
+                print(f"{path}: {result.get('text', result.get('error'))}")
+
     except Exception as e:
         logger.error(f"Demo failed: {e}")
     finally:
@@ -299,4 +459,4 @@ async def demo_usage():
 if __name__ == "__main__":
     print("PaddleOCR MCP Client Demo")
     print("=" * 40)
-    asyncio.run(demo_usage())
\ No newline at end of file
+    asyncio.run(demo_usage())
@@ -8,29 +8,39 @@ import asyncio
 import json
 import logging
 import os
-import sys
 import uuid
 from datetime import datetime
-from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Tuple, Union
 import base64
-import io
 
+import anyio
 import numpy as np
-import cv2
-from PIL import Image
-from paddleocr import PaddleOCR
+
+from deadlines import Deadline, DeadlineExceeded
+from layout import analyze_layout
+from memory_governor import MemoryGovernor
+from ocr_backends import (BACKENDS, OCRBackend, cascade_stats, default_backend, padding_efficiency,
+                          padding_stats, size_batches)
+from pipeline import ImageInput, OCRPipeline, OCRResult
+from prefilter import prefilter_stats
+from profiles import Profile, available_profiles, default_profile, get_profile, profile_metrics
+from scheduler import BULK, INTERACTIVE, OCRScheduler
+from spatial_index import IndexedResult, ResultStore, run_query
+from templates import TemplateRegistry
+from tiling import TILING_MODES, Tiler
+from uploads import allowed_image_types, decode_image_bytes, image_dimensions
+from config import get_setting
+from worker_layout import apply_worker_placement, plan_layout
 
 # MCP SDK imports
 from mcp.server.models import InitializationOptions
 from mcp.server import NotificationOptions, Server
+from mcp.server.lowlevel.server import request_ctx
+from mcp.server.stdio import stdio_server
 from mcp.types import (
     Resource,
     Tool,
     TextContent,
-    ImageContent,
-    EmbeddedResource,
-    LoggingLevel
 )
 
 # Configure logging
@@ -42,11 +52,51 @@ class PaddleOCRMCPServer:
     
     def __init__(self):
         self.server = Server("paddleocr-mcp")
-        self.ocr_engines = {}
         self.supported_languages = [
             "en", "ch", "fr", "german", "korean", "japan", "ar", "es", "pt", "ru"
         ]
         self.default_language = "en"
+        self.default_backend = default_backend()
+        
+        # Payload limits, advertised by get_ocr_info so clients can size images to fit
+        self.max_image_bytes = int(get_setting("ocr.max_image_size", 10485760))
+        self.max_image_side = int(get_setting("ocr.max_image_side", 4096))
+        
+        # The MCP server runs inference in one process, so it is a single worker
+        self.worker_layout = plan_layout(workers=1)
+        apply_worker_placement(self.worker_layout, 0)
+        
+        # Recent results retained for spatial queries by result id
+        self.result_store = ResultStore(
+            capacity=int(os.getenv("CACHE_SIZE", "100")),
+            ttl=float(os.getenv("CACHE_TTL", "3600"))
+        )
+        
+        # Very large images are OCR'd as overlapping tiles on a process pool
+        self.tiler = Tiler.from_config()
+        
+        # Engines per language, backend and profile, admitted against
+        # performance.max_memory_usage; idle engines are evicted under pressure
+        self.pipeline = OCRPipeline(
+            self.worker_layout,
+            memory_governor=MemoryGovernor.from_config(),
+            tiler=self.tiler,
+            language=self.default_language,
+            backend=self.default_backend
+        )
+        self.memory_governor = self.pipeline.memory_governor
+        self.memory_governor.register_evictor(self._evict_results)
+        
+        # Deadlines of in-flight tool calls, by MCP request id
+        self.default_timeout = float(get_setting("ocr.timeout", 30))
+        self._active_calls: Dict[Any, Deadline] = {}
+        
+        # Inference runs on scheduler threads, interactive calls ahead of batch
+        # images, keeping the event loop free to read cancellations and requests
+        self.scheduler = OCRScheduler.from_config()
+        
+        # Form templates, shared with the REST service through templates.directory
+        self.form_templates = TemplateRegistry.from_config()
         
         # Setup server handlers
         self._setup_handlers()
@@ -69,6 +119,12 @@ class PaddleOCRMCPServer:
                     name="Available OCR Models",
                     description="List of available OCR models and their configurations",
                     mimeType="application/json"
+                ),
+                Resource(
+                    uri="paddleocr://health",
+                    name="PaddleOCR Health",
+                    description="Readiness and memory headroom of this server",
+                    mimeType="application/json"
                 )
             ]
             
@@ -113,6 +169,18 @@ class PaddleOCRMCPServer:
                         }
                     ]
                 })
+            elif uri == "paddleocr://health":
+                memory = self.memory_governor.status()
+                return json.dumps({
+                    "ready": memory["ready"],
+                    "active_engines": list(self.pipeline.engines.keys()),
+                    "memory": memory,
+                    "scheduler": self.scheduler.metrics(),
+                    "batching": padding_stats.snapshot(),
+                    "cascade": cascade_stats.snapshot(),
+                    "prefilter": prefilter_stats.snapshot(),
+                    "profiles": profile_metrics.snapshot()
+                })
             else:
                 raise ValueError(f"Unknown resource: {uri}")
                 
@@ -135,10 +203,32 @@ class PaddleOCRMCPServer:
                                 "description": f"Language code for OCR. Supported: {', '.join(self.supported_languages)}",
                                 "default": self.default_language
                             },
+                            "backend": {
+                                "type": "string",
+                                "enum": list(BACKENDS),
+                                "description": "Inference backend for the engine",
+                                "default": self.default_backend
+                            },
+                            "tiling": {
+                                "type": "string",
+                                "enum": list(TILING_MODES),
+                                "description": "Overlapping-tile OCR: 'auto' tiles images larger than tiling.threshold_side",
+                                "default": "auto"
+                            },
+                            "profile": {
+                                "type": "string",
+                                "enum": list(available_profiles()),
+                                "description": "Speed/accuracy profile: detector input size, recognition batch size, angle classification and model variant",
+                                "default": default_profile()
+                            },
+                            "timeout": {
+                                "type": "number",
+                                "description": "Seconds before unfinished work is abandoned and partial results returned",
+                                "default": self.default_timeout
+                            },
                             "use_angle_cls": {
                                 "type": "boolean",
-                                "description": "Whether to use angle classification",
-                                "default": True
+                                "description": "Whether to use angle classification (default: the profile's policy)"
                             },
                             "use_gpu": {
                                 "type": "boolean",
@@ -173,6 +263,23 @@ class PaddleOCRMCPServer:
                                 "description": f"Language code for OCR. Supported: {', '.join(self.supported_languages)}",
                                 "default": self.default_language
                             },
+                            "backend": {
+                                "type": "string",
+                                "enum": list(BACKENDS),
+                                "description": "Inference backend for the engine",
+                                "default": self.default_backend
+                            },
+                            "profile": {
+                                "type": "string",
+                                "enum": list(available_profiles()),
+                                "description": "Speed/accuracy profile: detector input size, recognition batch size, angle classification and model variant",
+                                "default": default_profile()
+                            },
+                            "timeout": {
+                                "type": "number",
+                                "description": "Seconds before unfinished work is abandoned and partial results returned",
+                                "default": self.default_timeout
+                            },
                             "parallel": {
                                 "type": "boolean", 
                                 "description": "Whether to process images in parallel",
@@ -197,6 +304,29 @@ class PaddleOCRMCPServer:
                                 "description": f"Language code for OCR. Supported: {', '.join(self.supported_languages)}",
                                 "default": self.default_language
                             },
+                            "backend": {
+                                "type": "string",
+                                "enum": list(BACKENDS),
+                                "description": "Inference backend for the engine",
+                                "default": self.default_backend
+                            },
+                            "tiling": {
+                                "type": "string",
+                                "enum": list(TILING_MODES),
+                                "description": "Overlapping-tile OCR: 'auto' tiles images larger than tiling.threshold_side",
+                                "default": "auto"
+                            },
+                            "profile": {
+                                "type": "string",
+                                "enum": list(available_profiles()),
+                                "description": "Speed/accuracy profile: detector input size, recognition batch size, angle classification and model variant",
+                                "default": default_profile()
+                            },
+                            "timeout": {
+                                "type": "number",
+                                "description": "Seconds before unfinished work is abandoned and partial results returned",
+                                "default": self.default_timeout
+                            },
                             "include_tables": {
                                 "type": "boolean",
                                 "description": "Whether to recognize tables",
@@ -211,6 +341,141 @@ class PaddleOCRMCPServer:
                         "required": ["image_data"]
                     }
                 ),
+                Tool(
+                    name="register_form_template",
+                    description="Register a form layout: a reference image of the blank form and its named field regions",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "name": {
+                                "type": "string",
+                                "description": "Template name (letters, digits, '-' or '_')"
+                            },
+                            "image_data": {
+                                "type": "string",
+                                "description": "Base64 encoded reference image or file path"
+                            },
+                            "fields": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "name": {"type": "string"},
+                                        "box": {
+                                            "type": "array",
+                                            "items": {"type": "number"},
+                                            "description": "[x1, y1, x2, y2] in reference image pixels"
+                                        },
+                                        "multiline": {"type": "boolean", "default": False}
+                                    },
+                                    "required": ["name", "box"]
+                                },
+                                "description": "Variable field regions to read"
+                            }
+                        },
+                        "required": ["name", "image_data", "fields"]
+                    }
+                ),
+                Tool(
+                    name="extract_form_fields",
+                    description="Read only the variable fields of a form page by aligning it to a registered template; pages matching no template get full OCR",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "image_data": {
+                                "type": "string",
+                                "description": "Base64 encoded image data or file path"
+                            },
+                            "template": {
+                                "type": "string",
+                                "description": "Template to align to; all registered templates are tried if omitted"
+                            },
+                            "language": {
+                                "type": "string",
+                                "description": f"Language code for OCR. Supported: {', '.join(self.supported_languages)}",
+                                "default": self.default_language
+                            },
+                            "backend": {
+                                "type": "string",
+                                "enum": list(BACKENDS),
+                                "description": "Inference backend for the engine",
+                                "default": self.default_backend
+                            },
+                            "profile": {
+                                "type": "string",
+                                "enum": list(available_profiles()),
+                                "description": "Speed/accuracy profile: detector input size, recognition batch size, angle classification and model variant",
+                                "default": default_profile()
+                            },
+                            "timeout": {
+                                "type": "number",
+                                "description": "Seconds before unfinished work is abandoned",
+                                "default": self.default_timeout
+                            }
+                        },
+                        "required": ["image_data"]
+                    }
+                ),
+                Tool(
+                    name="query_ocr_result",
+                    description="Spatial query over a retained OCR result: text within a region, nearest text to a point, or the value next to a label",
+                    inputSchema={
+                        "type": "object",
+                        "properties": {
+                            "result_id": {
+                                "type": "string",
+                                "description": "result_id returned by a previous OCR tool call"
+                            },
+                            "query": {
+                                "type": "string",
+                                "enum": ["within", "nearest", "key_value"],
+                                "description": "Query type"
+                            },
+                            "region": {
+                                "type": "array",
+                                "items": {"type": "number"},
+                                "description": "[x0, y0, x1, y1] for 'within' queries"
+                            },
+                            "mode": {
+                                "type": "string",
+                                "enum": ["center", "contains", "intersects"],
+                                "description": "How regions are matched for 'within' queries",
+                                "default": "center"
+                            },
+                            "point": {
+                                "type": "array",
+                                "items": {"type": "number"},
+                                "description": "[x, y] for 'nearest' queries"
+                            },
+                            "k": {
+                                "type": "integer",
+                                "description": "Number of neighbours for 'nearest' queries",
+                                "default": 1
+                            },
+                            "label": {
+                                "type": "string",
+                                "description": "Label text for 'key_value' queries, e.g. 'Total'"
+                            },
+                            "direction": {
+                                "type": "string",
+                                "enum": ["right", "below"],
+                                "description": "Where to look for the value of a label",
+                                "default": "right"
+                            },
+                            "match": {
+                                "type": "string",
+                                "enum": ["contains", "exact", "regex"],
+                                "description": "How the label is matched",
+                                "default": "contains"
+                            },
+                            "max_distance": {
+                                "type": "number",
+                                "description": "Maximum search distance in pixels"
+                            }
+                        },
+                        "required": ["result_id", "query"]
+                    }
+                ),
                 Tool(
                     name="get_ocr_info",
                     description="Get information about PaddleOCR capabilities and configuration",
@@ -225,117 +490,179 @@ class PaddleOCRMCPServer:
         @self.server.call_tool()
         async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             """Handle tool calls."""
+            deadline = Deadline(float(arguments.get("timeout") or self.default_timeout))
+            context = request_ctx.get(None)
+            request_id = context.request_id if context else None
+            if request_id is not None:
+                self._active_calls[request_id] = deadline
             try:
                 if name == "extract_text_from_image":
-                    return await self._extract_text_from_image(arguments)
+                    return await self._extract_text_from_image(arguments, deadline)
                 elif name == "batch_extract_text":
-                    return await self._batch_extract_text(arguments)
+                    return await self._batch_extract_text(arguments, deadline)
                 elif name == "analyze_document_structure":
-                    return await self._analyze_document_structure(arguments)
+                    return await self._analyze_document_structure(arguments, deadline)
+                elif name == "register_form_template":
+                    return await self._register_form_template(arguments)
+                elif name == "extract_form_fields":
+                    return await self._extract_form_fields(arguments, deadline)
+                elif name == "query_ocr_result":
+                    return await self._query_ocr_result(arguments)
                 elif name == "get_ocr_info":
                     return await self._get_ocr_info(arguments)
                 else:
                     raise ValueError(f"Unknown tool: {name}")
+            except anyio.get_cancelled_exc_class():
+                # The SDK cancels this handler on notifications/cancelled; drop its queued OCR too
+                self._cancel_call(request_id)
+                raise
             except Exception as e:
                 logger.error(f"Tool execution error: {e}")
                 return [TextContent(
                     type="text",
                     text=f"Error executing tool {name}: {str(e)}"
                 )]
+            finally:
+                self._active_calls.pop(request_id, None)
     
-    async def _get_ocr_engine(self, language: str = "en", use_gpu: bool = False) -> PaddleOCR:
-        """Get or create OCR engine for specified language."""
-        engine_key = f"{language}_{use_gpu}"
-        
-        if engine_key not in self.ocr_engines:
-            try:
-                self.ocr_engines[engine_key] = PaddleOCR(
-                    use_angle_cls=True,
-                    lang=language,
-                    use_gpu=use_gpu,
-                    show_log=False
-                )
-                logger.info(f"Created OCR engine for language: {language}, GPU: {use_gpu}")
-            except Exception as e:
-                logger.error(f"Failed to create OCR engine: {e}")
-                raise
-                
-        return self.ocr_engines[engine_key]
+    def _cancel_call(self, request_id: Any, reason: Optional[str] = None) -> None:
+        """Stop an in-flight tool call after a client cancellation."""
+        deadline = self._active_calls.get(request_id)
+        if deadline:
+            deadline.cancel(reason or "cancelled by client")
+            logger.info(f"Request {request_id} cancelled: {deadline.cancel_reason}")
+    
+    async def _report_progress(self, done: int, total: int) -> None:
+        """Send an MCP progress notification if the caller asked for them."""
+        context = request_ctx.get(None)
+        token = getattr(context.meta, "progressToken", None) if context and context.meta else None
+        if token is None:
+            return
+        try:
+            await context.session.send_progress_notification(token, done, total,
+                                                             related_request_id=context.request_id)
+        except Exception as e:
+            logger.debug(f"Progress notification failed: {e}")
+    
+    async def _get_ocr_engine(self, language: str = "en", use_gpu: bool = False,
+                              backend: Optional[str] = None, profile: Optional[Profile] = None) -> OCRBackend:
+        """Get or create OCR engine for specified language, inference backend and profile."""
+        try:
+            return self.pipeline.engine(profile, language, use_gpu, backend)
+        except Exception as e:
+            logger.error(f"Failed to create OCR engine: {e}")
+            raise
+    
+    def _evict_results(self, needed: int) -> int:
+        """Drop the older half of retained results."""
+        return self.result_store.shrink(0.5)
+    
+    async def _run_ocr(self, ocr_engine: OCRBackend, image: np.ndarray, cls: bool = True,
+                       deadline: Optional[Deadline] = None, priority: str = INTERACTIVE,
+                       tiling: str = 'auto') -> OCRResult:
+        """Queue OCR of one image with the scheduler in the given priority class."""
+        deadline = deadline or Deadline()
+        deadline.check()
+        future = self.scheduler.submit(self._ocr_job, ocr_engine, image, cls, deadline, tiling,
+                                       priority=priority, deadline=deadline)
+        return await asyncio.wrap_future(future)
+    
+    def _ocr_job(self, ocr_engine: OCRBackend, image: np.ndarray, cls: bool, deadline: Deadline,
+                 tiling: str = 'auto') -> OCRResult:
+        """Scheduler job: OCR one image through the pipeline (admitted, tiled if very large)."""
+        return self.pipeline.run(image, tiling=tiling, cls=cls, deadline=deadline, engine=ocr_engine)
     
     def _decode_image(self, image_data: str) -> np.ndarray:
-        """Decode base64 image data or load from file path."""
+        """Decode base64 image data or load from file path, within the advertised limits."""
+        image_bytes, _ = self._load_image_bytes(image_data)
+        # Grayscale and alpha images are expanded to BGR
+        image = decode_image_bytes(image_bytes)
+        if image is None:
+            raise ValueError("Invalid image data: could not decode image")
+        self._check_image_side(image.shape[1], image.shape[0])
+        return image
+    
+    def _load_image_bytes(self, image_data: str) -> Tuple[bytes, Tuple[int, int, int]]:
+        """
+        Encoded bytes of base64 image data or a file path, and their width,
+        height and channels from the header, within the advertised limits.
+        """
+        if not image_data.startswith('data:image') and os.path.exists(image_data):
+            # Checked before reading, so an oversized file is never loaded
+            size = os.path.getsize(image_data)
+            if size > self.max_image_bytes:
+                raise ValueError(f"Image is {size} bytes, over the {self.max_image_bytes} byte limit")
+            with open(image_data, 'rb') as handle:
+                image_bytes = handle.read()
+        else:
+            try:
+                # Try to decode as base64
+                if image_data.startswith('data:image'):
+                    # Handle data URL format
+                    header, encoded = image_data.split(',', 1)
+                    image_bytes = base64.b64decode(encoded)
+                else:
+                    # Try direct base64 decode
+                    image_bytes = base64.b64decode(image_data)
+                if not image_bytes:
+                    raise ValueError("empty image data")
+            except Exception:
+                raise ValueError("Invalid image data: not valid base64 or file path")
+        
+        if len(image_bytes) > self.max_image_bytes:
+            raise ValueError(
+                f"Image is {len(image_bytes)} bytes, over the {self.max_image_bytes} byte limit"
+            )
+        # Checked on the header, so an oversized page is refused before its pixels are decoded
         try:
-            # Try to decode as base64
-            if image_data.startswith('data:image'):
-                # Handle data URL format
-                header, encoded = image_data.split(',', 1)
-                image_bytes = base64.b64decode(encoded)
-            else:
-                # Try direct base64 decode
-                image_bytes = base64.b64decode(image_data)
-            
-            # Convert to numpy array
-            image = Image.open(io.BytesIO(image_bytes))
-            return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
+            size = image_dimensions(image_bytes)
         except Exception:
-            # If base64 decode fails, treat as file path
-            if os.path.exists(image_data):
-                return cv2.imread(image_data)
-            else:
-                raise ValueError("Invalid image data: not valid base64 or file path")
+            size = (0, 0, 3)
+        self._check_image_side(size[0], size[1])
+        return image_bytes, size
+    
+    def _check_image_side(self, width: int, height: int) -> None:
+        if max(width, height) > self.max_image_side:
+            raise ValueError(
+                f"Image is {width}x{height} pixels, over the {self.max_image_side} pixel side limit"
+            )
     
-    async def _extract_text_from_image(self, arguments: Dict[str, Any]) -> List[TextContent]:
+    async def _extract_text_from_image(self, arguments: Dict[str, Any],
+                                       deadline: Optional[Deadline] = None) -> List[TextContent]:
         """Extract text from a single image."""
         image_data = arguments["image_data"]
         language = arguments.get("language", self.default_language)
-        use_angle_cls = arguments.get("use_angle_cls", True)
         use_gpu = arguments.get("use_gpu", False)
+        backend = arguments.get("backend")
         
         try:
             # Get OCR engine
-            ocr_engine = await self._get_ocr_engine(language, use_gpu)
+            profile = get_profile(arguments.get("profile"))
+            use_angle_cls = arguments.get("use_angle_cls", profile.use_angle_cls)
+            ocr_engine = await self._get_ocr_engine(language, use_gpu, backend, profile)
             
             # Decode image
-            image = self._decode_image(image_data)
+            image = await asyncio.to_thread(self._decode_image, image_data)
             
             # Perform OCR
-            result = ocr_engine.ocr(image, cls=use_angle_cls)
-            
-            # Process results
-            extracted_text = []
-            bounding_boxes = []
-            confidence_scores = []
-            
-            if result and result[0]:
-                for line in result[0]:
-                    if len(line) >= 2:
-                        bbox = line[0]
-                        text_info = line[1]
-                        
-                        if len(text_info) >= 2:
-                            text = text_info[0]
-                            confidence = float(text_info[1])
-                            
-                            extracted_text.append(text)
-                            confidence_scores.append(confidence)
-                            bounding_boxes.append({
-                                'text': text,
-                                'confidence': confidence,
-                                'bbox': bbox
-                            })
-            
-            # Calculate overall confidence
-            overall_confidence = sum(confidence_scores) / len(confidence_scores) if confidence_scores else 0
-            full_text = ' '.join(extracted_text)
+            result = await self._run_ocr(ocr_engine, image, cls=use_angle_cls, deadline=deadline,
+                                         tiling=arguments.get("tiling", "auto"))
             
             result_data = {
                 'success': True,
-                'text': full_text,
-                'confidence': overall_confidence,
+                'result_id': self._retain_result(result),
+                'text': result.text,
+                'confidence': result.confidence,
                 'language': language,
-                'bounding_boxes': bounding_boxes,
-                'word_count': len(extracted_text),
+                'backend': ocr_engine.name,
+                'profile': profile.name,
+                'skipped': result.skipped,
+                'bounding_boxes': [{
+                    'text': line.text,
+                    'confidence': line.confidence,
+                    'bbox': line.box.tolist()
+                } for line in result],
+                'word_count': len(result),
                 'processed_at': datetime.now().isoformat(),
                 'engine': 'PaddleOCR-MCP',
                 'version': '3.1.0'
@@ -358,34 +685,32 @@ class PaddleOCRMCPServer:
                 text=json.dumps(error_result, indent=2)
             )]
     
-    async def _batch_extract_text(self, arguments: Dict[str, Any]) -> List[TextContent]:
-        """Extract text from multiple images."""
+    async def _batch_extract_text(self, arguments: Dict[str, Any],
+                                  deadline: Optional[Deadline] = None) -> List[TextContent]:
+        """Extract text from multiple images, returning partial results if stopped early."""
         images = arguments["images"]
         language = arguments.get("language", self.default_language)
         parallel = arguments.get("parallel", True)
+        backend = arguments.get("backend")
+        deadline = deadline or Deadline()
         
         try:
-            ocr_engine = await self._get_ocr_engine(language)
-            results = []
-            
-            if parallel:
-                # Process images in parallel using asyncio
-                tasks = []
-                for img in images:
-                    task = self._process_single_image_async(ocr_engine, img, language)
-                    tasks.append(task)
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-            else:
-                # Process images sequentially
-                for img in images:
-                    result = await self._process_single_image_async(ocr_engine, img, language)
-                    results.append(result)
+            profile = get_profile(arguments.get("profile"))
+            ocr_engine = await self._get_ocr_engine(language, backend=backend, profile=profile)
+            results, padding = await self._run_batch(ocr_engine, images, language, parallel, deadline)
+            processed = sum(1 for result in results if not result.get('cancelled'))
             
             batch_result = {
                 'success': True,
                 'results': results,
-                'total_processed': len(images),
+                'total_processed': processed,
+                'total_requested': len(images),
+                'partial': processed < len(images),
+                'stopped_reason': deadline.stopped if processed < len(images) else None,
+                'elapsed_seconds': round(deadline.elapsed(), 3),
+                'padding_efficiency': padding_efficiency(padding['useful_width'], padding['padded_width']),
                 'language': language,
+                'profile': profile.name,
                 'processed_at': datetime.now().isoformat(),
                 'parallel': parallel
             }
@@ -407,83 +732,185 @@ class PaddleOCRMCPServer:
                 text=json.dumps(error_result, indent=2)
             )]
     
-    async def _process_single_image_async(self, ocr_engine: PaddleOCR, img_data: Dict[str, Any], language: str) -> Dict[str, Any]:
-        """Process a single image asynchronously."""
-        try:
-            image = self._decode_image(img_data["image_data"])
-            result = ocr_engine.ocr(image, cls=True)
-            
-            extracted_text = []
-            confidence_scores = []
-            
-            if result and result[0]:
-                for line in result[0]:
-                    if len(line) >= 2 and len(line[1]) >= 2:
-                        text = line[1][0]
-                        confidence = float(line[1][1])
-                        extracted_text.append(text)
-                        confidence_scores.append(confidence)
-            
-            overall_confidence = sum(confidence_scores) / len(confidence_scores) if confidence_scores else 0
-            
-            return {
-                'id': img_data.get('id', str(uuid.uuid4())),
-                'filename': img_data.get('filename', 'unknown'),
-                'success': True,
-                'text': ' '.join(extracted_text),
-                'confidence': overall_confidence,
-                'word_count': len(extracted_text)
-            }
-            
-        except Exception as e:
-            return {
-                'id': img_data.get('id', str(uuid.uuid4())),
-                'filename': img_data.get('filename', 'unknown'),
-                'success': False,
-                'error': str(e)
-            }
+    async def _run_batch(self, ocr_engine: OCRBackend, images: List[Dict[str, Any]], language: str,
+                         parallel: bool, deadline: Deadline) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        OCR images in shape-aware groups until all are done or the deadline
+        stops the batch, reporting progress as groups finish. Returns the
+        per-image results and the recognition padding totals.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        padding = {'useful_width': 0, 'padded_width': 0, 'unsorted_padded_width': 0}
+        done = 0
+        
+        # Only encoded bytes and header sizes up front; each group is decoded by the
+        # pipeline once the memory governor admits it
+        encoded: Dict[int, Tuple[bytes, Tuple[int, int, int]]] = {}
+        for index, img in enumerate(images):
+            try:
+                # Off the event loop, so other calls and cancellation are served meanwhile
+                encoded[index] = await asyncio.to_thread(self._load_image_bytes, img["image_data"])
+            except Exception as e:
+                results[index] = self._failed_item(img, str(e))
+                done += 1
+        indices = sorted(encoded)
+        groups = [
+            [indices[i] for i in group]
+            for group in size_batches([encoded[index][1][0] * encoded[index][1][1] for index in indices],
+                                      int(get_setting('performance.batching.max_images', 8)))
+        ]
+        
+        async def run_group(group: List[int]) -> None:
+            nonlocal done
+            try:
+                group_results, group_padding = await self._run_ocr_batch(
+                    ocr_engine, [encoded[index][0] for index in group], cls=ocr_engine.use_angle_cls,
+                    deadline=deadline
+                )
+                for key in padding:
+                    padding[key] += group_padding[key]
+                for index, result in zip(group, group_results):
+                    if isinstance(result, Exception):
+                        results[index] = self._failed_item(images[index], str(result))
+                    else:
+                        results[index] = self._batch_item(images[index], result)
+            except DeadlineExceeded as e:
+                for index in group:
+                    results[index] = self._cancelled_item(images[index], str(e))
+            except Exception as e:
+                for index in group:
+                    results[index] = self._failed_item(images[index], str(e))
+            done += len(group)
+            await self._report_progress(done, len(images))
+        
+        if parallel:
+            tasks = [asyncio.ensure_future(run_group(group)) for group in groups]
+            cancelled = asyncio.ensure_future(deadline.cancelled())
+            pending = set(tasks)
+            try:
+                while pending and not deadline.stopped:
+                    completed, _ = await asyncio.wait(
+                        pending | {cancelled}, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    pending -= completed
+            finally:
+                # Queued groups never reach the inference thread; one already running finishes there
+                for task in pending:
+                    task.cancel()
+                cancelled.cancel()
+        else:
+            for group in groups:
+                if deadline.stopped:
+                    break
+                await run_group(group)
+        
+        reason = deadline.stopped or "cancelled"
+        for index, img in enumerate(images):
+            if results[index] is None:
+                results[index] = self._cancelled_item(img, reason)
+        
+        elapsed = deadline.elapsed()
+        logger.info(
+            f"Batch: {done}/{len(images)} images in {len(groups)} groups in {elapsed:.1f}s "
+            f"({done / max(elapsed, 1e-9):.2f} images/s)" + (f", stopped: {reason}" if done < len(images) else "")
+        )
+        return results, padding
+    
+    async def _run_ocr_batch(self, ocr_engine: OCRBackend, images: List[ImageInput], cls: bool = True,
+                             deadline: Optional[Deadline] = None) -> Tuple[List[Union[OCRResult, Exception]], Dict[str, int]]:
+        """Queue shape-aware OCR of a group of images as one bulk scheduler job."""
+        deadline = deadline or Deadline()
+        deadline.check()
+        future = self.scheduler.submit(self._ocr_batch_job, ocr_engine, images, cls, deadline,
+                                       priority=BULK, deadline=deadline)
+        return await asyncio.wrap_future(future)
     
-    async def _analyze_document_structure(self, arguments: Dict[str, Any]) -> List[TextContent]:
-        """Analyze document structure using PP-StructureV3."""
+    def _ocr_batch_job(self, ocr_engine: OCRBackend, images: List[ImageInput], cls: bool,
+                       deadline: Deadline) -> Tuple[List[Union[OCRResult, Exception]], Dict[str, int]]:
+        """Scheduler job: decode and batch OCR through the pipeline once the whole group is admitted."""
+        return self.pipeline.run_batch(images, cls=cls, deadline=deadline, engine=ocr_engine)
+    
+    @staticmethod
+    def _cancelled_item(img_data: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        return {
+            'id': img_data.get('id', str(uuid.uuid4())),
+            'filename': img_data.get('filename', 'unknown'),
+            'success': False,
+            'cancelled': True,
+            'error': reason
+        }
+    
+    @staticmethod
+    def _failed_item(img_data: Dict[str, Any], error: str) -> Dict[str, Any]:
+        return {
+            'id': img_data.get('id', str(uuid.uuid4())),
+            'filename': img_data.get('filename', 'unknown'),
+            'success': False,
+            'error': error
+        }
+    
+    def _batch_item(self, img_data: Dict[str, Any], result: OCRResult) -> Dict[str, Any]:
+        """Batch entry for one image's OCR result."""
+        return {
+            'id': img_data.get('id', str(uuid.uuid4())),
+            'filename': img_data.get('filename', 'unknown'),
+            'success': True,
+            'result_id': self._retain_result(result),
+            'text': result.text,
+            'confidence': result.confidence,
+            'word_count': len(result),
+            'skipped': result.skipped
+        }
+    
+    async def _analyze_document_structure(self, arguments: Dict[str, Any],
+                                          deadline: Optional[Deadline] = None) -> List[TextContent]:
+        """Analyze document structure from the geometry of detected text regions."""
         image_data = arguments["image_data"]
         language = arguments.get("language", self.default_language)
         include_tables = arguments.get("include_tables", True)
         include_layout = arguments.get("include_layout", True)
+        backend = arguments.get("backend")
         
         try:
-            # For now, use basic OCR with structure analysis
-            # In a full implementation, this would use PP-StructureV3
-            ocr_engine = await self._get_ocr_engine(language)
-            image = self._decode_image(image_data)
+            profile = get_profile(arguments.get("profile"))
+            ocr_engine = await self._get_ocr_engine(language, backend=backend, profile=profile)
+            image = await asyncio.to_thread(self._decode_image, image_data)
             
             # Perform OCR
-            result = ocr_engine.ocr(image, cls=True)
+            result = await self._run_ocr(ocr_engine, image, cls=profile.use_angle_cls, deadline=deadline,
+                                         tiling=arguments.get("tiling", "auto"))
             
-            # Analyze structure (simplified implementation)
-            text_regions = []
-            if result and result[0]:
-                for line in result[0]:
-                    if len(line) >= 2:
-                        bbox = line[0]
-                        text_info = line[1]
-                        
-                        if len(text_info) >= 2:
-                            text_regions.append({
-                                'text': text_info[0],
-                                'confidence': float(text_info[1]),
-                                'bbox': bbox,
-                                'type': 'text'  # In full implementation, would classify as title, paragraph, table, etc.
-                            })
+            text_regions = [{
+                'text': line.text,
+                'confidence': line.confidence,
+                'bbox': line.box.tolist()
+            } for line in result]
+            
+            # Reconstruct columns, lines, paragraphs and tables from box geometry
+            layout = analyze_layout(result.boxes, result.texts, result.confidences, include_tables=include_tables)
+            for index, region in enumerate(text_regions):
+                region['type'] = layout['region_types'][index]
+                region['block'] = layout['region_blocks'][index]
+            
+            document_structure = {
+                'text_regions': text_regions,
+                'reading_order': layout['reading_order'],
+                'layout_analysis': include_layout,
+                'table_recognition': include_tables,
+                'total_regions': len(text_regions)
+            }
+            if include_layout:
+                document_structure['columns'] = layout['columns']
+                document_structure['blocks'] = layout['blocks']
             
             structure_result = {
                 'success': True,
-                'document_structure': {
-                    'text_regions': text_regions,
-                    'layout_analysis': include_layout,
-                    'table_recognition': include_tables,
-                    'total_regions': len(text_regions)
-                },
+                'result_id': self._retain_result(result),
+                'text': layout['text'],
+                'document_structure': document_structure,
                 'language': language,
+                'profile': profile.name,
+                'skipped': result.skipped,
                 'processed_at': datetime.now().isoformat(),
                 'engine': 'PaddleOCR-Structure-MCP'
             }
@@ -505,6 +932,100 @@ class PaddleOCRMCPServer:
                 text=json.dumps(error_result, indent=2)
             )]
     
+    async def _register_form_template(self, arguments: Dict[str, Any]) -> List[TextContent]:
+        """Register a form template from a reference image and field regions."""
+        try:
+            image = await asyncio.to_thread(self._decode_image, arguments["image_data"])
+            template = await asyncio.to_thread(
+                self.form_templates.register, arguments["name"], image, arguments["fields"]
+            )
+            result = {'success': True, 'template': template.describe()}
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        return [TextContent(
+            type="text",
+            text=json.dumps(result, indent=2)
+        )]
+    
+    async def _extract_form_fields(self, arguments: Dict[str, Any],
+                                   deadline: Optional[Deadline] = None) -> List[TextContent]:
+        """Read the fields of a form page via its template, or the whole page if none matches."""
+        language = arguments.get("language", self.default_language)
+        backend = arguments.get("backend")
+        deadline = deadline or Deadline()
+        
+        try:
+            profile = get_profile(arguments.get("profile"))
+            ocr_engine = await self._get_ocr_engine(language, backend=backend, profile=profile)
+            image = await asyncio.to_thread(self._decode_image, arguments["image_data"])
+            deadline.check()
+            future = self.scheduler.submit(self._read_form_job, ocr_engine, image, arguments.get("template"),
+                                           deadline, priority=INTERACTIVE, deadline=deadline)
+            result = await asyncio.wrap_future(future)
+            if not result['matched']:
+                page = result.pop('result')
+                result.update({'text': page.text, 'confidence': page.confidence, 'line_count': len(page)})
+            result = {
+                'success': True,
+                **result,
+                'language': language,
+                'backend': ocr_engine.name,
+                'profile': profile.name,
+                'processed_at': datetime.now().isoformat()
+            }
+        except Exception as e:
+            result = {
+                'success': False,
+                'error': str(e),
+                'language': language,
+                'processed_at': datetime.now().isoformat()
+            }
+        return [TextContent(
+            type="text",
+            text=json.dumps(result, indent=2)
+        )]
+    
+    def _read_form_job(self, ocr_engine: OCRBackend, image: np.ndarray, template: Optional[str],
+                       deadline: Deadline) -> Dict[str, Any]:
+        """Scheduler job: align and read a form page through the pipeline once it is admitted."""
+        return self.pipeline.read_form(image, self.form_templates, template, deadline=deadline, engine=ocr_engine)
+    
+    def _retain_result(self, result: OCRResult) -> str:
+        """Index an OCR result and keep it in the result store for later queries."""
+        return self.result_store.put(IndexedResult(result.boxes, result.texts, result.confidences))
+    
+    async def _query_ocr_result(self, arguments: Dict[str, Any]) -> List[TextContent]:
+        """Run a spatial query against a retained OCR result."""
+        result_id = arguments["result_id"]
+        query = arguments["query"]
+        
+        try:
+            indexed = self.result_store.get(result_id)
+            if indexed is None:
+                raise ValueError(f"Unknown or expired result_id: {result_id}")
+            
+            matches = run_query(indexed, query, arguments)
+            query_result = {
+                'success': True,
+                'result_id': result_id,
+                'query': query,
+                'matches': matches,
+                'total_matches': len(matches)
+            }
+            
+        except Exception as e:
+            query_result = {
+                'success': False,
+                'error': str(e),
+                'result_id': result_id,
+                'query': query
+            }
+        
+        return [TextContent(
+            type="text",
+            text=json.dumps(query_result, indent=2)
+        )]
+    
     async def _get_ocr_info(self, arguments: Dict[str, Any]) -> List[TextContent]:
         """Get OCR information and capabilities."""
         info = {
@@ -512,7 +1033,34 @@ class PaddleOCRMCPServer:
             'version': '3.1.0',
             'supported_languages': self.supported_languages,
             'default_language': self.default_language,
-            'active_engines': list(self.ocr_engines.keys()),
+            'active_engines': list(self.pipeline.engines.keys()),
+            'backends': list(BACKENDS),
+            'default_backend': self.default_backend,
+            'retained_results': len(self.result_store),
+            'memory': self.memory_governor.status(),
+            'scheduler': self.scheduler.metrics(),
+            'batching': padding_stats.snapshot(),
+            'cascade': cascade_stats.snapshot(),
+            'prefilter': prefilter_stats.snapshot(),
+            'form_templates': [template['name'] for template in self.form_templates.list_templates()],
+            'profiles': {
+                'default': default_profile(),
+                'available': [profile.describe(self.default_backend) for profile in available_profiles().values()],
+                'requests': profile_metrics.snapshot()
+            },
+            'tiling': {
+                'threshold_side': self.tiler.threshold_side,
+                'tile_size': self.tiler.tile_size,
+                'overlap': self.tiler.overlap,
+                'processes': self.tiler.processes
+            },
+            'limits': {
+                'max_image_bytes': self.max_image_bytes,
+                'max_image_side': self.max_image_side,
+                'max_batch_size': int(get_setting('ocr.max_batch_size', 10)),
+                'image_formats': sorted(allowed_image_types()),
+                'grayscale_input': True
+            },
             'capabilities': {
                 'text_detection': True,
                 'text_recognition': True,
@@ -520,6 +1068,8 @@ class PaddleOCRMCPServer:
                 'multilingual_support': True,
                 'batch_processing': True,
                 'document_structure_analysis': True,
+                'spatial_queries': True,
+                'form_templates': True,
                 'gpu_acceleration': True
             },
             'models': {
@@ -545,7 +1095,7 @@ async def main():
     mcp_server = PaddleOCRMCPServer()
     
     # Run the server
-    async with mcp_server.server.run_stdio() as (read_stream, write_stream):
+    async with stdio_server() as (read_stream, write_stream):
         await mcp_server.server.run(
             read_stream,
             write_stream,
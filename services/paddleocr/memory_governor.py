@@ -0,0 +1,272 @@
+"""
+Process memory governor enforcing ``performance.max_memory_usage``.
+
+Large images, many engines and big batches used to push the container past its
+memory limit and get it OOM-killed mid-request. The governor tracks resident
+memory, estimates what each request will need from the image dimensions and
+admits work only while it fits the budget: requests are held back briefly,
+then rejected. Under pressure it asks registered evictors (idle engines,
+result caches) to free memory, and it reports headroom for health/readiness
+checks so the orchestrator stops routing to a node before it dies.
+"""
+
+import asyncio
+import ctypes
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import get_setting, parse_size
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_UNLIMITED = 1 << 60
+
+
+class MemoryPressureError(RuntimeError):
+    """The request cannot be admitted within the memory budget right now."""
+
+
+class RequestTooLargeError(MemoryPressureError):
+    """The request would exceed the memory budget even on an idle process."""
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cgroup_memory_limit() -> Optional[int]:
+    """Container memory limit from cgroup v2 ``memory.max`` or v1 ``limit_in_bytes``."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as handle:
+                value = handle.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < _UNLIMITED:
+            return int(value)
+    return None
+
+
+def release_free_memory() -> None:
+    """Run the garbage collector and hand freed heap pages back to the OS."""
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class MemoryGovernor:
+    """Admission control of OCR work against a resident memory budget."""
+
+    def __init__(self, budget: int, hold_timeout: float = 10.0, ready_headroom: int = 256 << 20,
+                 base_request_bytes: int = 32 << 20, bytes_per_det_pixel: float = 200.0,
+                 det_limit_side_len: int = 960):
+        self.budget = budget
+        self.hold_timeout = hold_timeout
+        self.ready_headroom = ready_headroom
+        self.base_request_bytes = base_request_bytes
+        self.bytes_per_det_pixel = bytes_per_det_pixel
+        self.det_limit_side_len = det_limit_side_len
+        self.reserved = 0
+        # Resident memory once the default engine is loaded; 0 until measured
+        self.baseline = 0
+        self.active = 0
+        self.rejected = 0
+        self.evictions = 0
+        self._evictors: List[Callable[[int], int]] = []
+        self._last_relief = 0.0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, share: float = 1.0) -> 'MemoryGovernor':
+        """
+        Build a governor from config; ``share`` splits the budget between
+        worker processes. The budget never exceeds 90% of the cgroup limit.
+        Requests whose engine is not known are sized at the largest detector
+        input of any profile.
+        """
+        from profiles import available_profiles
+
+        budget = parse_size(get_setting('performance.max_memory_usage', '2GB'))
+        limit = cgroup_memory_limit()
+        if limit:
+            budget = min(budget, int(limit * 0.9))
+        return cls(
+            budget=int(budget * share),
+            hold_timeout=float(get_setting('performance.memory.hold_timeout', 10)),
+            ready_headroom=int(parse_size(get_setting('performance.memory.ready_headroom', '256MB')) * share),
+            base_request_bytes=parse_size(get_setting('performance.memory.base_request_bytes', '32MB')),
+            bytes_per_det_pixel=float(get_setting('performance.memory.bytes_per_det_pixel', 200)),
+            det_limit_side_len=max(profile.det_limit_side_len for profile in available_profiles().values()),
+        )
+
+    def set_baseline(self) -> int:
+        """
+        Record resident memory after the default engine has loaded and check
+        that the budget leaves room above it for a page at the largest
+        detection resolution. Raises ``ValueError`` at startup instead of rejecting every
+        request later.
+        """
+        self.baseline = current_rss()
+        needed = self.estimate_request(self.det_limit_side_len, self.det_limit_side_len)
+        if self.baseline + needed > self.budget:
+            raise ValueError(
+                f"Memory budget of {self.budget >> 20}MB per process leaves no room for requests: "
+                f"{self.baseline >> 20}MB is in use after loading the engine and a page needs "
+                f"~{needed >> 20}MB. Raise performance.max_memory_usage or run fewer workers."
+            )
+        logger.info(f"Memory baseline {self.baseline >> 20}MB, "
+                    f"{(self.budget - self.baseline) >> 20}MB of the budget left for requests")
+        return self.baseline
+
+    def register_evictor(self, evictor: Callable[[int], int]) -> None:
+        """Add a callback ``evictor(bytes_needed) -> bytes_freed_estimate`` used under pressure."""
+        self._evictors.append(evictor)
+
+    def estimate_request(self, width: int, height: int, channels: int = 3,
+                         det_limit_side_len: Optional[int] = None) -> int:
+        """
+        Estimated peak memory of one OCR pass over a ``width x height`` image:
+        decoded pixels and their working copies plus detector activations at
+        the (capped) detection resolution of the engine, ``det_limit_side_len``.
+        """
+        det_limit_side_len = det_limit_side_len or self.det_limit_side_len
+        pixels = int(width) * int(height)
+        scale = min(1.0, det_limit_side_len / max(int(width), int(height), 1))
+        det_pixels = pixels * scale * scale
+        return int(self.base_request_bytes + pixels * channels * 3 + det_pixels * self.bytes_per_det_pixel)
+
+    def estimate_batch(self, sizes: List[Tuple[int, int, int]], det_limit_side_len: Optional[int] = None) -> int:
+        """
+        Estimated peak memory of one shape-aware batch of ``(width, height,
+        channels)`` images: all decoded images stay resident, the detection
+        working memory is needed for one image at a time.
+        """
+        if not sizes:
+            return 0
+        pixel_bytes = [int(w) * int(h) * int(c) for w, h, c in sizes]
+        largest = max(range(len(sizes)), key=lambda i: pixel_bytes[i])
+        return (self.estimate_request(*sizes[largest], det_limit_side_len=det_limit_side_len) +
+                sum(pixel_bytes) - pixel_bytes[largest])
+
+    def headroom(self) -> int:
+        return self.budget - current_rss() - self.reserved
+
+    def _fits(self, estimate: int) -> bool:
+        # In-flight reservations may not be resident yet; counting both is deliberately conservative
+        return current_rss() + self.reserved + estimate <= self.budget
+
+    def relieve_pressure(self, needed: int) -> int:
+        """Ask evictors to free at least ``needed`` bytes; returns the freed estimate."""
+        freed = 0
+        for evictor in self._evictors:
+            if freed >= needed:
+                break
+            try:
+                freed += int(evictor(needed - freed) or 0)
+            except Exception as e:
+                logger.warning(f"Memory evictor failed: {e}")
+        release_free_memory()
+        if freed:
+            self.evictions += 1
+            logger.info(f"Memory pressure: evicted ~{freed >> 20}MB")
+        return freed
+
+    def _check_size(self, estimate: int) -> None:
+        if estimate > self.budget:
+            self.rejected += 1
+            raise RequestTooLargeError(
+                f"Request needs ~{estimate >> 20}MB, more than the {self.budget >> 20}MB memory budget"
+            )
+
+    def try_admit(self, estimate: int) -> bool:
+        """Reserve ``estimate`` bytes if they fit now, evicting caches first if needed."""
+        with self._cond:
+            if not self._fits(estimate):
+                now = time.monotonic()
+                if now - self._last_relief < 1.0:
+                    return False
+                self._last_relief = now
+                self.relieve_pressure(current_rss() + self.reserved + estimate - self.budget)
+                if not self._fits(estimate):
+                    return False
+            self.reserved += estimate
+            self.active += 1
+            return True
+
+    def release(self, estimate: int) -> None:
+        with self._cond:
+            self.reserved = max(0, self.reserved - estimate)
+            self.active = max(0, self.active - 1)
+            self._cond.notify_all()
+
+    def _reject(self, estimate: int) -> None:
+        self.rejected += 1
+        raise MemoryPressureError(
+            f"Insufficient memory: ~{estimate >> 20}MB needed, {max(self.headroom(), 0) >> 20}MB free"
+        )
+
+    @contextmanager
+    def reserve(self, estimate: int, timeout: Optional[float] = None):
+        """Hold ``estimate`` bytes for the duration of the block, waiting up to ``timeout``."""
+        self._check_size(estimate)
+        deadline = time.monotonic() + (self.hold_timeout if timeout is None else timeout)
+        while not self.try_admit(estimate):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._reject(estimate)
+            with self._cond:
+                self._cond.wait(min(remaining, 0.25))
+        try:
+            yield
+        finally:
+            self.release(estimate)
+
+    @asynccontextmanager
+    async def areserve(self, estimate: int, timeout: Optional[float] = None):
+        """Async variant of :meth:`reserve` that yields to the event loop while held back."""
+        self._check_size(estimate)
+        deadline = time.monotonic() + (self.hold_timeout if timeout is None else timeout)
+        while not self.try_admit(estimate):
+            if time.monotonic() >= deadline:
+                self._reject(estimate)
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            self.release(estimate)
+
+    def status(self) -> Dict[str, Any]:
+        """Memory figures for health and readiness reporting."""
+        rss = current_rss()
+        headroom = self.budget - rss - self.reserved
+        return {
+            'rss_bytes': rss,
+            'budget_bytes': self.budget,
+            'baseline_bytes': self.baseline,
+            'reserved_bytes': self.reserved,
+            'headroom_bytes': headroom,
+            'headroom_ratio': round(headroom / self.budget, 4) if self.budget else 0.0,
+            'active_requests': self.active,
+            'rejected_requests': self.rejected,
+            'evictions': self.evictions,
+            'ready': headroom >= self.ready_headroom,
+        }
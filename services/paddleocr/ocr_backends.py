@@ -0,0 +1,740 @@
+#!/usr/bin/env python3
+"""
+Pluggable inference backends for the OCR engines.
+
+Both front ends build engines through :func:`create_backend` instead of
+constructing ``paddleocr.PaddleOCR`` directly. Every backend exposes the
+PaddleOCR call shape (``ocr(image, cls=True)`` returning
+``[[[box, (text, confidence)], ...]]``) plus the individual detection,
+classification and recognition stages.
+
+* ``paddle`` (default): PaddleOCR on Paddle Inference.
+* ``onnxruntime``: PP-OCR det/cls/rec models exported to ONNX (optionally
+  INT8-quantized) run with ONNX Runtime; lower latency and a smaller memory
+  footprint on CPU-only nodes.
+* ``stub``: no models; fixed latency and canned lines, for load-testing the
+  serving layer on its own.
+
+``ocr_batch`` runs several images through the stages together: crops of all
+images are recognized in order of aspect ratio so recognition batches pad
+little, and the padding achieved is tallied in :data:`padding_stats`.
+
+An ``escalation`` option turns an engine into a :class:`CascadeBackend`: a
+light recognizer reads every line and only lines below a confidence
+threshold are re-read by a heavier one, reusing the detected boxes. The
+escalation rate is tallied in :data:`cascade_stats`.
+
+The ``OCR_BACKEND`` environment variable overrides ``ocr.backend``.
+
+Usage:
+    python ocr_backends.py quantize --model det.onnx --output det.int8.onnx --calibration-dir ./samples
+"""
+
+import argparse
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'paddle'
+
+
+class OCRBackend:
+    """Common interface of all inference backends."""
+
+    name = 'base'
+    # Name of the speed/accuracy profile a front end built this engine for
+    profile: Optional[str] = None
+    # Whether concurrent calls may share one instance; engines that lock them may not
+    thread_safe = True
+    # OCRPipeline.engine() arguments that built this engine, to build its interactive copy
+    spec: Optional[Dict[str, Any]] = None
+
+    def __init__(self, language: str = 'en', use_gpu: bool = False, use_angle_cls: bool = True,
+                 options: Optional[Dict[str, Any]] = None):
+        self.language = language
+        self.use_gpu = use_gpu
+        self.use_angle_cls = use_angle_cls
+        self.options = options or {}
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        """Text region quads ``(4, 2)`` in page coordinates, top-to-bottom."""
+        raise NotImplementedError
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Return crops with upside-down text rotated upright."""
+        return crops
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        """Text and confidence for each crop."""
+        raise NotImplementedError
+
+    def rec_shape(self) -> Tuple[int, int, int]:
+        """Recognition batch size, input height and minimum (padded) input width."""
+        return 6, 48, 320
+
+    def ocr(self, image: Any, cls: bool = True) -> List[Optional[List[Any]]]:
+        """Run the full pipeline with PaddleOCR's result layout."""
+        image = load_image(image)
+        boxes = self.detect(image)
+        if not boxes:
+            return [None]
+        crops = [crop_quad(image, box) for box in boxes]
+        if cls and self.use_angle_cls:
+            crops = self.classify(crops)
+        texts = self.recognize(crops)
+        return [self._lines(boxes, texts)]
+
+    def ocr_batch(self, images: Sequence[Any], cls: bool = True) -> Tuple[List[List[Optional[List[Any]]]], Dict[str, int]]:
+        """
+        Run the pipeline over several images with shape-aware ordering.
+
+        Detection goes largest image first. The crops of all images are then
+        classified and recognized together, sorted by aspect ratio, so each
+        recognition batch holds lines of similar width. Results come back in
+        input order, one ``ocr()`` result per image, with the padding totals
+        of the call (also added to :data:`padding_stats`).
+        """
+        images = [load_image(image) for image in images]
+        boxes: List[List[np.ndarray]] = [[] for _ in images]
+        for index in sorted(range(len(images)), key=lambda i: images[i].shape[0] * images[i].shape[1], reverse=True):
+            boxes[index] = self.detect(images[index])
+
+        owners = [(index, line) for index in range(len(images)) for line in range(len(boxes[index]))]
+        crops = [crop_quad(images[index], boxes[index][line]) for index, line in owners]
+        ratios = np.array([crop.shape[1] / max(crop.shape[0], 1) for crop in crops], dtype=np.float64)
+        by_shape = np.argsort(ratios, kind='stable')
+        sorted_crops = [crops[k] for k in by_shape]
+        if cls and self.use_angle_cls:
+            sorted_crops = self.classify(sorted_crops)
+        texts: List[Tuple[str, float]] = [('', 0.0)] * len(crops)
+        for k, text in zip(by_shape, self.recognize(sorted_crops)):
+            texts[k] = text
+
+        per_image: List[List[Tuple[str, float]]] = [[] for _ in images]
+        for (index, _), text in zip(owners, texts):
+            per_image[index].append(text)
+        results = [[self._lines(boxes[index], per_image[index])] if boxes[index] else [None]
+                   for index in range(len(images))]
+
+        batch_size, height, min_width = self.rec_shape()
+        owner_of = np.array([index for index, _ in owners], dtype=np.int64)
+        padding = {
+            'images': len(images),
+            'crops': len(crops),
+            'useful_width': int(np.ceil(height * ratios).sum()),
+            'padded_width': padded_width(ratios, batch_size, height, min_width),
+            # What recognizing each image on its own would have padded
+            'unsorted_padded_width': sum(padded_width(ratios[owner_of == index], batch_size, height, min_width)
+                                         for index in range(len(images))),
+        }
+        padding_stats.record(padding)
+        return results, padding
+
+    def read_regions(self, crops: Sequence[np.ndarray], multiline: Sequence[bool]) -> List[Tuple[str, float]]:
+        """
+        Text and confidence of pre-cut regions without page-level detection.
+        Single-line regions go straight to recognition; multi-line regions are
+        detected within the crop and their lines joined top to bottom.
+        """
+        texts: List[Tuple[str, float]] = [('', 0.0)] * len(crops)
+        single = [i for i in range(len(crops)) if not multiline[i]]
+        for i, text in zip(single, self.recognize([load_image(crops[i]) for i in single])):
+            texts[i] = (text[0], float(text[1]))
+        for i in range(len(crops)):
+            if not multiline[i]:
+                continue
+            region = load_image(crops[i])
+            boxes = self.detect(region)
+            lines = self.recognize([crop_quad(region, box) for box in boxes]) if boxes else []
+            if lines:
+                texts[i] = ('\n'.join(text for text, _ in lines),
+                            float(sum(score for _, score in lines) / len(lines)))
+        return texts
+
+    def _lines(self, boxes: List[np.ndarray], texts: List[Tuple[str, float]]) -> Optional[List[Any]]:
+        drop_score = float(self.options.get('drop_score', 0.5))
+        lines = [[box.tolist(), (text, float(score))]
+                 for box, (text, score) in zip(boxes, texts) if score >= drop_score]
+        return lines or None
+
+
+class PaddleBackend(OCRBackend):
+    """PaddleOCR on Paddle Inference."""
+
+    name = 'paddle'
+    thread_safe = False
+
+    def __init__(self, language: str = 'en', use_gpu: bool = False, use_angle_cls: bool = True,
+                 options: Optional[Dict[str, Any]] = None):
+        super().__init__(language, use_gpu, use_angle_cls, options)
+        from paddleocr import PaddleOCR
+
+        self.engine = PaddleOCR(
+            use_angle_cls=use_angle_cls,
+            lang=language,
+            use_gpu=use_gpu,
+            show_log=False,
+            **self.options
+        )
+        # Paddle predictors are not thread-safe; scheduler workers share engines
+        self._lock = threading.Lock()
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        boxes, _ = self.engine.text_detector(image)
+        if boxes is None:
+            return []
+        return [np.asarray(box, dtype=np.float32) for box in sort_boxes(list(boxes))]
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        if not crops or getattr(self.engine, 'text_classifier', None) is None:
+            return crops
+        crops, _, _ = self.engine.text_classifier(crops)
+        return crops
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        if not crops:
+            return []
+        results, _ = self.engine.text_recognizer(crops)
+        return [(text, float(score)) for text, score in results]
+
+    def rec_shape(self) -> Tuple[int, int, int]:
+        recognizer = self.engine.text_recognizer
+        _, height, width = getattr(recognizer, 'rec_image_shape', (3, 48, 320))
+        return int(getattr(recognizer, 'rec_batch_num', 6)), int(height), int(width)
+
+    def ocr(self, image: Any, cls: bool = True) -> List[Optional[List[Any]]]:
+        with self._lock:
+            return self.engine.ocr(image, cls=cls)
+
+    def ocr_batch(self, images: Sequence[Any], cls: bool = True) -> Tuple[List[List[Optional[List[Any]]]], Dict[str, int]]:
+        with self._lock:
+            return super().ocr_batch(images, cls=cls)
+
+    def read_regions(self, crops: Sequence[np.ndarray], multiline: Sequence[bool]) -> List[Tuple[str, float]]:
+        with self._lock:
+            return super().read_regions(crops, multiline)
+
+
+class ONNXRuntimeBackend(OCRBackend):
+    """
+    PP-OCR models exported to ONNX and run with ONNX Runtime.
+
+    Quantized INT8 models (QDQ or QOperator format) are used transparently;
+    see ``python ocr_backends.py quantize``. Model paths may contain ``{lang}``.
+    """
+
+    name = 'onnxruntime'
+
+    def __init__(self, language: str = 'en', use_gpu: bool = False, use_angle_cls: bool = True,
+                 options: Optional[Dict[str, Any]] = None):
+        super().__init__(language, use_gpu, use_angle_cls, options)
+        import onnxruntime as ort
+
+        settings = dict(get_setting('backends.onnxruntime', {}))
+        settings.update(self.options)
+        self.settings = settings
+        models_dir = Path(settings.get('models_dir', '/app/models/onnx'))
+
+        def model_path(key: str) -> Optional[Path]:
+            name = settings.get(key)
+            return models_dir / name.format(lang=language) if name else None
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = int(settings.get('cpu_threads', 0) or 0)
+        session_options.inter_op_num_threads = 1
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
+
+        def session(path: Optional[Path]):
+            if path is None:
+                return None
+            return ort.InferenceSession(str(path), sess_options=session_options, providers=providers)
+
+        self.det_session = session(model_path('det_model'))
+        self.rec_session = session(model_path('rec_model'))
+        self.cls_session = session(model_path('cls_model')) if use_angle_cls else None
+        if self.det_session is None or self.rec_session is None:
+            raise ValueError("onnxruntime backend requires det_model and rec_model")
+
+        self.det_limit_side_len = int(settings.get('det_limit_side_len', 960))
+        self.det_thresh = float(settings.get('det_db_thresh', 0.3))
+        self.det_box_thresh = float(settings.get('det_db_box_thresh', 0.6))
+        self.det_unclip_ratio = float(settings.get('det_db_unclip_ratio', 1.5))
+        self.rec_height = int(settings.get('rec_image_height', 48))
+        self.rec_width = int(settings.get('rec_image_width', 320))
+        self.rec_batch_num = int(settings.get('rec_batch_num', 6))
+        self.cls_thresh = float(settings.get('cls_thresh', 0.9))
+        self.characters = self._load_characters(model_path('rec_char_dict'))
+
+    @staticmethod
+    def _load_characters(path: Optional[Path]) -> List[str]:
+        if path is None:
+            raise ValueError("onnxruntime backend requires rec_char_dict")
+        with open(path, 'r', encoding='utf-8') as handle:
+            chars = [line.rstrip('\r\n') for line in handle]
+        # CTC blank first, then the dictionary and a trailing space symbol
+        return ['blank'] + chars + [' ']
+
+    # Detection (DB)
+
+    def _det_resize(self, image: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        h, w = image.shape[:2]
+        ratio = min(1.0, self.det_limit_side_len / max(h, w))
+        new_h = max(32, int(round(h * ratio / 32)) * 32)
+        new_w = max(32, int(round(w * ratio / 32)) * 32)
+        resized = cv2.resize(image, (new_w, new_h))
+        return resized, new_h / h, new_w / w
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        h, w = image.shape[:2]
+        resized, ratio_h, ratio_w = self._det_resize(image)
+        blob = normalize_det(resized)
+        pred = self.det_session.run(None, {self.det_session.get_inputs()[0].name: blob})[0][0, 0]
+        boxes = db_postprocess(pred, self.det_thresh, self.det_box_thresh, self.det_unclip_ratio)
+        boxes = [np.clip(box / [ratio_w, ratio_h], 0, [w - 1, h - 1]).astype(np.float32) for box in boxes]
+        boxes = [box for box in boxes
+                 if np.linalg.norm(box[0] - box[1]) > 3 and np.linalg.norm(box[0] - box[3]) > 3]
+        return sort_boxes(boxes)
+
+    # Angle classification
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        if self.cls_session is None or not crops:
+            return crops
+        name = self.cls_session.get_inputs()[0].name
+        crops = list(crops)
+        for start in range(0, len(crops), self.rec_batch_num):
+            batch = crops[start:start + self.rec_batch_num]
+            blob = np.stack([resize_norm(crop, 48, 192, 192) for crop in batch])
+            probs = self.cls_session.run(None, {name: blob})[0]
+            for offset, p in enumerate(probs):
+                if int(np.argmax(p)) == 1 and float(p[1]) > self.cls_thresh:
+                    crops[start + offset] = cv2.rotate(crops[start + offset], cv2.ROTATE_180)
+        return crops
+
+    # Recognition (CTC)
+
+    def rec_shape(self) -> Tuple[int, int, int]:
+        return self.rec_batch_num, self.rec_height, self.rec_width
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        if not crops:
+            return []
+        name = self.rec_session.get_inputs()[0].name
+        ratios = np.array([c.shape[1] / max(c.shape[0], 1) for c in crops])
+        order = np.argsort(ratios, kind='stable')
+        results: List[Tuple[str, float]] = [('', 0.0)] * len(crops)
+        base_ratio = self.rec_width / self.rec_height
+        for start in range(0, len(crops), self.rec_batch_num):
+            idx = order[start:start + self.rec_batch_num]
+            max_ratio = max(base_ratio, float(ratios[idx].max()))
+            width = int(math.ceil(self.rec_height * max_ratio))
+            blob = np.stack([resize_norm(crops[i], self.rec_height, width, width) for i in idx])
+            probs = self.rec_session.run(None, {name: blob})[0]
+            for i, (text, score) in zip(idx, ctc_decode(probs, self.characters)):
+                results[i] = (text, score)
+        return results
+
+
+class StubBackend(OCRBackend):
+    """Synthetic engine: sleeps for the configured latency and reports evenly spaced lines."""
+
+    name = 'stub'
+
+    def __init__(self, language: str = 'en', use_gpu: bool = False, use_angle_cls: bool = True,
+                 options: Optional[Dict[str, Any]] = None):
+        super().__init__(language, use_gpu, use_angle_cls, options)
+        self.latency = float(self.options.get('latency_ms', get_setting('backends.stub.latency_ms', 50))) / 1000
+        self.lines = int(self.options.get('lines', get_setting('backends.stub.lines', 12)))
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        # Sleeping releases the GIL like real inference does
+        time.sleep(self.latency * 0.6)
+        height, width = image.shape[:2]
+        step = height / (self.lines + 1)
+        return [np.array([[0.1 * width, (i + 0.6) * step], [0.9 * width, (i + 0.6) * step],
+                          [0.9 * width, (i + 1.4) * step], [0.1 * width, (i + 1.4) * step]], dtype=np.float32)
+                for i in range(self.lines)]
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        time.sleep(self.latency * 0.4)
+        return [(f'stub line {i + 1}', 0.99) for i in range(len(crops))]
+
+
+class CascadeBackend(OCRBackend):
+    """
+    Confidence cascade over two engines of one backend: ``primary`` detects,
+    classifies and recognizes every line; lines it reads with confidence
+    below ``threshold`` are recognized again by ``secondary`` and the more
+    confident reading is kept.
+    """
+
+    def __init__(self, primary: OCRBackend, secondary: OCRBackend, threshold: float,
+                 options: Optional[Dict[str, Any]] = None):
+        super().__init__(primary.language, primary.use_gpu, primary.use_angle_cls, options)
+        # Same name as the wrapped backend so the options recreate this cascade (tile workers)
+        self.name = primary.name
+        self.primary = primary
+        self.secondary = secondary
+        self.threshold = threshold
+        self.thread_safe = primary.thread_safe and secondary.thread_safe
+
+    @staticmethod
+    def _locked(engine: OCRBackend):
+        # Paddle predictors are not thread-safe; their stages run under the engine's lock
+        return getattr(engine, '_lock', None) or contextlib.nullcontext()
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        with self._locked(self.primary):
+            return self.primary.detect(image)
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        with self._locked(self.primary):
+            return self.primary.classify(crops)
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        with self._locked(self.primary):
+            texts = self.primary.recognize(crops)
+        low = [i for i, (_, score) in enumerate(texts) if score < self.threshold]
+        replaced = 0
+        if low:
+            with self._locked(self.secondary):
+                second = self.secondary.recognize([crops[i] for i in low])
+            for i, (text, score) in zip(low, second):
+                if score > texts[i][1]:
+                    texts[i] = (text, float(score))
+                    replaced += 1
+        cascade_stats.record(len(crops), len(low), replaced)
+        return texts
+
+    def rec_shape(self) -> Tuple[int, int, int]:
+        return self.primary.rec_shape()
+
+
+class CascadeStats:
+    """Running line counts of :class:`CascadeBackend` recognition."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lines = 0
+        self.escalated = 0
+        self.replaced = 0
+
+    def record(self, lines: int, escalated: int, replaced: int) -> None:
+        with self._lock:
+            self.lines += lines
+            self.escalated += escalated
+            self.replaced += replaced
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totals plus the share of lines escalated and the share of escalations that changed the reading."""
+        with self._lock:
+            return {
+                'lines': self.lines,
+                'escalated': self.escalated,
+                'replaced': self.replaced,
+                'escalation_rate': round(self.escalated / self.lines, 4) if self.lines else None,
+                'replacement_rate': round(self.replaced / self.escalated, 4) if self.escalated else None,
+            }
+
+
+cascade_stats = CascadeStats()
+
+
+class PaddingStats:
+    """Running recognition padding totals of :meth:`OCRBackend.ocr_batch` calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        self.crops = 0
+        self.useful_width = 0
+        self.padded_width = 0
+        self.unsorted_padded_width = 0
+
+    def record(self, padding: Dict[str, int]) -> None:
+        with self._lock:
+            self.batches += 1
+            self.images += padding['images']
+            self.crops += padding['crops']
+            self.useful_width += padding['useful_width']
+            self.padded_width += padding['padded_width']
+            self.unsorted_padded_width += padding['unsorted_padded_width']
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totals plus padding efficiency (share of recognizer input that is text) with and without sorting."""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'images': self.images,
+                'crops': self.crops,
+                'padding_efficiency': padding_efficiency(self.useful_width, self.padded_width),
+                'unsorted_padding_efficiency': padding_efficiency(self.useful_width, self.unsorted_padded_width),
+            }
+
+
+padding_stats = PaddingStats()
+
+
+BACKENDS = {
+    PaddleBackend.name: PaddleBackend,
+    ONNXRuntimeBackend.name: ONNXRuntimeBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def default_backend() -> str:
+    """Backend name from ``OCR_BACKEND`` or ``ocr.backend``."""
+    return os.getenv('OCR_BACKEND') or get_setting('ocr.backend', DEFAULT_BACKEND)
+
+
+def create_backend(name: Optional[str] = None, language: str = 'en', use_gpu: bool = False,
+                   use_angle_cls: bool = True, options: Optional[Dict[str, Any]] = None) -> OCRBackend:
+    """
+    Build an OCR engine on the named backend (:func:`default_backend` if not
+    given). An ``escalation`` option ``{'below': threshold, 'options': {...}}``
+    builds a :class:`CascadeBackend` whose second engine adds those options;
+    ``ValueError`` when they change nothing.
+    """
+    name = name or default_backend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}. Available: {', '.join(BACKENDS)}")
+    options = dict(options or {})
+    escalation = options.pop('escalation', None)
+    if escalation and all(options.get(key) == value for key, value in (escalation.get('options') or {}).items()):
+        # Same models twice would re-read lines with an identical recognizer
+        raise ValueError(f"Escalation variant adds no model options on the {name} backend")
+    if escalation:
+        primary = create_backend(name, language, use_gpu, use_angle_cls, options)
+        # Crops reach the second engine already upright
+        secondary = create_backend(name, language, use_gpu, False,
+                                   dict(options, **(escalation.get('options') or {})))
+        threshold = float(escalation.get('below', 0.85))
+        logger.info(f"Cascading {name} recognition below confidence {threshold}")
+        return CascadeBackend(primary, secondary, threshold, dict(options, escalation=escalation))
+    if name != PaddleBackend.name:
+        # Paddle-specific switches have no meaning for other runtimes
+        options.pop('enable_mkldnn', None)
+    backend = BACKENDS[name](language=language, use_gpu=use_gpu, use_angle_cls=use_angle_cls, options=options)
+    logger.info(f"Created {name} OCR backend for language: {language}, GPU: {use_gpu}")
+    return backend
+
+
+# Shared pre/post-processing
+
+
+def load_image(image: Any) -> np.ndarray:
+    """Read a path or pass through a decoded image, as 3-channel BGR."""
+    if isinstance(image, (str, Path)):
+        image = cv2.imread(str(image))
+    if image is None:
+        raise ValueError("Could not read image")
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def size_batches(areas: Sequence[int], max_images: int) -> List[List[int]]:
+    """Indices grouped into batches of up to ``max_images``, largest images first."""
+    order = sorted(range(len(areas)), key=lambda i: areas[i], reverse=True)
+    step = max(1, int(max_images))
+    return [order[start:start + step] for start in range(0, len(order), step)]
+
+
+def padded_width(ratios: np.ndarray, batch_size: int, height: int, min_width: int) -> int:
+    """
+    Total recognizer input width for crops of the given width/height ratios
+    recognized in one call: sorted by ratio, batched, each batch padded to
+    its widest crop (and at least ``min_width``).
+    """
+    ratios = np.sort(np.asarray(ratios, dtype=np.float64))
+    total = 0
+    for start in range(0, len(ratios), batch_size):
+        batch = ratios[start:start + batch_size]
+        total += len(batch) * max(min_width, int(math.ceil(height * batch[-1])))
+    return total
+
+
+def padding_efficiency(useful_width: int, padded_width: int) -> Optional[float]:
+    return round(useful_width / padded_width, 4) if padded_width else None
+
+
+def normalize_det(image: np.ndarray) -> np.ndarray:
+    """ImageNet normalization to an NCHW float32 blob, as PP-OCR detection expects."""
+    mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+    blob = (image.astype(np.float32) / 255.0 - mean) / std
+    return blob.transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+
+
+def resize_norm(crop: np.ndarray, height: int, width: int, max_width: int) -> np.ndarray:
+    """Resize a crop to ``height`` keeping aspect ratio, scale to [-1, 1] and right-pad to ``max_width``."""
+    h, w = crop.shape[:2]
+    target_w = min(width, int(math.ceil(height * w / max(h, 1))))
+    resized = cv2.resize(crop, (max(target_w, 1), height)).astype(np.float32)
+    resized = (resized / 255.0 - 0.5) / 0.5
+    padded = np.zeros((3, height, max_width), dtype=np.float32)
+    padded[:, :, :resized.shape[1]] = resized.transpose(2, 0, 1)
+    return padded
+
+
+def ctc_decode(probs: np.ndarray, characters: Sequence[str]) -> List[Tuple[str, float]]:
+    """Greedy CTC decoding: collapse repeats, drop blanks, average kept probabilities."""
+    indices = probs.argmax(axis=2)
+    scores = probs.max(axis=2)
+    keep = np.ones_like(indices, dtype=bool)
+    keep[:, 1:] = indices[:, 1:] != indices[:, :-1]
+    keep &= indices != 0
+    decoded = []
+    for row, mask, score in zip(indices, keep, scores):
+        chars = [characters[i] for i in row[mask] if i < len(characters)]
+        decoded.append((''.join(chars), float(score[mask].mean()) if mask.any() else 0.0))
+    return decoded
+
+
+def db_postprocess(pred: np.ndarray, thresh: float, box_thresh: float, unclip_ratio: float,
+                   max_candidates: int = 1000, min_size: int = 3) -> List[np.ndarray]:
+    """Turn a DB probability map into text quads in map coordinates."""
+    bitmap = (pred > thresh).astype(np.uint8) * 255
+    contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours[:max_candidates]:
+        (cx, cy), (bw, bh), angle = cv2.minAreaRect(contour)
+        if min(bw, bh) < min_size:
+            continue
+        points = cv2.boxPoints(((cx, cy), (bw, bh), angle))
+        if box_score(pred, points) < box_thresh:
+            continue
+        # Unclip: grow the shrunk kernel back by area * ratio / perimeter on every side
+        distance = bw * bh * unclip_ratio / (2 * (bw + bh))
+        grown = ((cx, cy), (bw + 2 * distance, bh + 2 * distance), angle)
+        if min(grown[1]) < min_size + 2:
+            continue
+        boxes.append(order_points(cv2.boxPoints(grown)))
+    return boxes
+
+
+def box_score(pred: np.ndarray, points: np.ndarray) -> float:
+    """Mean probability inside a quad, computed on its bounding window."""
+    h, w = pred.shape
+    xmin = int(np.clip(np.floor(points[:, 0].min()), 0, w - 1))
+    xmax = int(np.clip(np.ceil(points[:, 0].max()), 0, w - 1))
+    ymin = int(np.clip(np.floor(points[:, 1].min()), 0, h - 1))
+    ymax = int(np.clip(np.ceil(points[:, 1].max()), 0, h - 1))
+    mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
+    shifted = (points - [xmin, ymin]).astype(np.int32)
+    cv2.fillPoly(mask, [shifted], 1)
+    return float(cv2.mean(pred[ymin:ymax + 1, xmin:xmax + 1], mask)[0])
+
+
+def order_points(points: np.ndarray) -> np.ndarray:
+    """Order quad points clockwise starting top-left."""
+    points = points[np.argsort(points[:, 0], kind='stable')]
+    left, right = points[:2], points[2:]
+    tl, bl = left[np.argsort(left[:, 1])]
+    tr, br = right[np.argsort(right[:, 1])]
+    return np.array([tl, tr, br, bl], dtype=np.float32)
+
+
+def sort_boxes(boxes: List[np.ndarray]) -> List[np.ndarray]:
+    """Sort quads top-to-bottom, then left-to-right within a 10px band (PaddleOCR's convention)."""
+    boxes = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def crop_quad(image: np.ndarray, quad: np.ndarray) -> np.ndarray:
+    """Perspective-crop a quad to an upright rectangle; tall crops are rotated to horizontal."""
+    quad = np.asarray(quad, dtype=np.float32)
+    width = int(max(np.linalg.norm(quad[0] - quad[1]), np.linalg.norm(quad[2] - quad[3])))
+    height = int(max(np.linalg.norm(quad[0] - quad[3]), np.linalg.norm(quad[1] - quad[2])))
+    width, height = max(width, 1), max(height, 1)
+    target = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad, target)
+    crop = cv2.warpPerspective(image, matrix, (width, height),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if height / width >= 1.5:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+# INT8 quantization
+
+
+def quantize_model(model: str, output: str, calibration_dir: Optional[str] = None,
+                   max_samples: int = 32) -> None:
+    """
+    Quantize an ONNX model to INT8.
+
+    With ``calibration_dir`` the detector is statically quantized (QDQ,
+    per-channel) from real page images; without it weights are quantized
+    dynamically, which suits the MatMul-heavy recognizer.
+    """
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+
+    if not calibration_dir:
+        quantize_dynamic(model, output, weight_type=QuantType.QInt8)
+        logger.info(f"Dynamically quantized {model} -> {output}")
+        return
+
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(model, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    paths = sorted(p for p in Path(calibration_dir).iterdir()
+                   if p.suffix.lower() in {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'})[:max_samples]
+
+    class PageReader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for path in self._paths:
+                image = cv2.imread(str(path))
+                if image is None:
+                    continue
+                ratio = min(1.0, 960 / max(image.shape[:2]))
+                h = max(32, int(round(image.shape[0] * ratio / 32)) * 32)
+                w = max(32, int(round(image.shape[1] * ratio / 32)) * 32)
+                return {input_name: normalize_det(cv2.resize(image, (w, h)))}
+            return None
+
+    quantize_static(model, output, PageReader(), quant_format=QuantFormat.QDQ,
+                    per_channel=True, weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+    logger.info(f"Statically quantized {model} -> {output} using {len(paths)} calibration images")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR backend utilities")
+    sub = parser.add_subparsers(dest='command', required=True)
+    quant = sub.add_parser('quantize', help='Quantize an ONNX det/rec model to INT8')
+    quant.add_argument('--model', required=True)
+    quant.add_argument('--output', required=True)
+    quant.add_argument('--calibration-dir', help='Page images for static quantization (detector)')
+    quant.add_argument('--max-samples', type=int, default=32)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    quantize_model(args.model, args.output, args.calibration_dir, args.max_samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Embeddable in-process OCR.
+
+Python services can OCR without going through HTTP multipart or base64 MCP
+JSON: :class:`OCRPipeline` keeps engines per language, backend and profile,
+admits work against the memory governor, decodes bytes or paths, tiles very
+large pages, and returns :class:`OCRResult` objects whose boxes are NumPy
+arrays. Blank and duplicate pages are skipped before the engine
+(:mod:`prefilter`). The Flask app, the MCP server and the bulk-ingest CLI are
+adapters over it.
+
+Usage:
+    from pipeline import OCRPipeline
+
+    pipeline = OCRPipeline()
+    result = pipeline.run(image, profile='fast')   # ndarray, encoded bytes or a path
+    print(result.text, result.boxes.shape)
+"""
+
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from config import get_setting
+from deadlines import Deadline
+from layout import reading_order
+from memory_governor import MemoryGovernor, current_rss
+from ocr_backends import OCRBackend, create_backend, default_backend, load_image
+from prefilter import PageFilter
+from profiles import Profile, default_profile, get_profile, profile_metrics
+from scheduler import INTERACTIVE, interactive_waiting, on_reserved_worker
+from templates import TemplateRegistry
+from templates import read_form as read_form_page
+from tiling import Tiler
+from uploads import decode_image_bytes, image_dimensions
+from worker_layout import WorkerLayout, engine_options, plan_layout
+
+logger = logging.getLogger(__name__)
+
+# A decoded image, encoded image bytes or a file path
+ImageInput = Union[np.ndarray, bytes, str, Path]
+
+
+class TextLine:
+    """One recognized line: text, confidence and its quad as a ``(4, 2)`` array."""
+
+    __slots__ = ('text', 'confidence', 'box')
+
+    def __init__(self, text: str, confidence: float, box: np.ndarray):
+        self.text = text
+        self.confidence = confidence
+        self.box = box
+
+    def position(self) -> Dict[str, float]:
+        """Top-left corner and extent to the bottom-right corner of the quad."""
+        return {
+            'x': float(self.box[0, 0]),
+            'y': float(self.box[0, 1]),
+            'width': float(self.box[2, 0] - self.box[0, 0]),
+            'height': float(self.box[2, 1] - self.box[0, 1]),
+        }
+
+    def __repr__(self) -> str:
+        return f"TextLine({self.text!r}, {self.confidence:.3f})"
+
+
+class OCRResult:
+    """
+    Lines of one page in detection order: ``boxes`` ``(N, 4, 2)``, ``texts``
+    and ``confidences`` ``(N,)``. ``order`` is the reading order. ``skipped``
+    names the pre-filter's reason when the page never reached the engine.
+    """
+
+    __slots__ = ('boxes', 'texts', 'confidences', 'width', 'height', 'profile', 'backend', 'tiled', 'skipped',
+                 '_order')
+
+    def __init__(self, boxes: np.ndarray, texts: List[str], confidences: np.ndarray, width: int = 0,
+                 height: int = 0, profile: Optional[str] = None, backend: Optional[str] = None,
+                 tiled: bool = False, skipped: Optional[str] = None):
+        self.boxes = boxes
+        self.texts = texts
+        self.confidences = confidences
+        self.width = width
+        self.height = height
+        self.profile = profile
+        self.backend = backend
+        self.tiled = tiled
+        self.skipped = skipped
+        self._order: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_raw(cls, raw: Any, **meta: Any) -> 'OCRResult':
+        """Build from PaddleOCR's ``[[[box, (text, confidence)], ...]]`` layout."""
+        boxes, texts, confidences = [], [], []
+        for line in (raw[0] if raw else None) or []:
+            if len(line) >= 2 and len(line[1]) >= 2:
+                boxes.append(line[0])
+                texts.append(line[1][0])
+                confidences.append(float(line[1][1]))
+        return cls(np.asarray(boxes, dtype=np.float64).reshape(-1, 4, 2), texts,
+                   np.asarray(confidences, dtype=np.float64), **meta)
+
+    def to_raw(self) -> List[Optional[List[Any]]]:
+        """Back to PaddleOCR's result layout."""
+        lines = [[box.tolist(), (text, float(confidence))]
+                 for box, text, confidence in zip(self.boxes, self.texts, self.confidences)]
+        return [lines or None]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __iter__(self) -> Iterator[TextLine]:
+        for box, text, confidence in zip(self.boxes, self.texts, self.confidences):
+            yield TextLine(text, float(confidence), box)
+
+    @property
+    def order(self) -> np.ndarray:
+        if self._order is None:
+            self._order = reading_order(self.boxes)
+        return self._order
+
+    @property
+    def text(self) -> str:
+        """All text in reading order."""
+        return ' '.join(self.texts[i] for i in self.order)
+
+    @property
+    def confidence(self) -> float:
+        """Mean line confidence (0 without lines)."""
+        return float(self.confidences.mean()) if len(self.confidences) else 0
+
+    @classmethod
+    def empty(cls, **meta: Any) -> 'OCRResult':
+        """A page without lines."""
+        return cls(np.zeros((0, 4, 2)), [], np.zeros(0), **meta)
+
+    def __repr__(self) -> str:
+        skipped = f", skipped={self.skipped}" if self.skipped else ''
+        return f"OCRResult({len(self)} lines, {self.width}x{self.height}, profile={self.profile}{skipped})"
+
+
+def read_image_bytes(image: ImageInput) -> Union[np.ndarray, bytes]:
+    """Read a path into bytes; bytes and arrays pass through."""
+    if isinstance(image, (str, Path)):
+        with open(image, 'rb') as handle:
+            return handle.read()
+    return image
+
+
+def image_size(image: Union[np.ndarray, bytes]) -> Tuple[int, int, int]:
+    """Width, height and channels, from the header for encoded bytes (no decoding)."""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0], image.shape[2] if image.ndim == 3 else 1
+    try:
+        return image_dimensions(image)
+    except Exception:
+        raise ValueError('Could not read image file')
+
+
+def det_side(engine: OCRBackend) -> Optional[int]:
+    """Detector input side the engine was built with (its profile's), if known."""
+    side = engine.options.get('det_limit_side_len')
+    return int(side) if side else None
+
+
+def decode_image(image: ImageInput) -> np.ndarray:
+    """Decode bytes or a path, or normalize an array, to a 3-channel BGR image."""
+    image = read_image_bytes(image)
+    if isinstance(image, np.ndarray):
+        return load_image(image)
+    decoded = decode_image_bytes(image)
+    if decoded is None:
+        raise ValueError('Could not read image file')
+    return decoded
+
+
+class OCRPipeline:
+    """Engines, memory admission and execution of OCR within this process."""
+
+    def __init__(self, layout: Optional[WorkerLayout] = None, memory_governor: Optional[MemoryGovernor] = None,
+                 tiler: Optional[Tiler] = None, language: str = 'en', backend: Optional[str] = None,
+                 use_gpu: bool = False, prefilter: Optional[PageFilter] = None):
+        self.layout = layout or plan_layout(workers=1)
+        # Each worker process gets an equal share of the memory budget
+        self.memory_governor = memory_governor or MemoryGovernor.from_config(share=1.0 / self.layout.workers)
+        self.tiler = tiler or Tiler.from_config()
+        self.prefilter = prefilter or PageFilter.from_config()
+        self.language = language
+        self.backend = backend or default_backend()
+        self.use_gpu = use_gpu
+        self.engines: Dict[str, OCRBackend] = {}
+        self.engine_idle_seconds = float(get_setting('performance.memory.engine_idle_seconds', 60))
+        self.interactive_engines = bool(get_setting('performance.scheduler.interactive_engines', True))
+        self._engine_last_used: Dict[str, float] = {}
+        self._engine_sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.memory_governor.register_evictor(self.evict_idle_engines)
+
+    # Engines
+
+    def _key(self, language: str, use_gpu: bool, backend: str, profile: str, lane: Optional[str] = None) -> str:
+        return f"{language}_{use_gpu}_{backend}_{profile}" + (f"_{lane}" if lane else '')
+
+    def engine(self, profile: Union[Profile, str, None] = None, language: Optional[str] = None,
+               use_gpu: Optional[bool] = None, backend: Optional[str] = None,
+               lane: Optional[str] = None) -> OCRBackend:
+        """
+        Engine for a profile, language and backend, created on first use.
+        ``lane='interactive'`` is a separate copy for reserved scheduler
+        workers, so they never wait on the lock of an engine bulk jobs use.
+        """
+        profile = profile if isinstance(profile, Profile) else get_profile(profile)
+        language = language or self.language
+        use_gpu = self.use_gpu if use_gpu is None else use_gpu
+        backend = backend or self.backend
+        reason = profile.unavailable_reason(backend)
+        if reason:
+            raise ValueError(reason)
+        key = self._key(language, use_gpu, backend, profile.name, lane)
+        engine = self.engines.get(key)
+        if engine is None:
+            with self._lock:
+                engine = self.engines.get(key)
+                if engine is None:
+                    rss_before = current_rss()
+                    options = engine_options(self.layout)
+                    options.update(profile.engine_options(backend))
+                    engine = create_backend(backend, language=language, use_gpu=use_gpu,
+                                            use_angle_cls=profile.use_angle_cls, options=options)
+                    engine.profile = profile.name
+                    engine.spec = {'profile': profile, 'language': language, 'use_gpu': use_gpu, 'backend': backend}
+                    self.engines[key] = engine
+                    self._engine_sizes[key] = max(current_rss() - rss_before, 0)
+                    logger.info(f"Created OCR engine for language: {language}, GPU: {use_gpu}, "
+                                f"backend: {backend}, profile: {profile.name}")
+        self._engine_last_used[key] = time.monotonic()
+        return engine
+
+    def lane_engine(self, engine: OCRBackend) -> OCRBackend:
+        """The interactive copy of ``engine`` on a reserved worker when ``engine`` locks its calls."""
+        if engine.thread_safe or engine.spec is None or not self.interactive_engines or not on_reserved_worker():
+            return engine
+        return self.engine(lane=INTERACTIVE, **engine.spec)
+
+    def evict_idle_engines(self, needed: int) -> int:
+        """Drop engines idle longer than engine_idle_seconds, least recently used first."""
+        default_key = self._key(self.language, self.use_gpu, self.backend, default_profile())
+        now = time.monotonic()
+        idle = sorted(
+            (last_used, key) for key, last_used in list(self._engine_last_used.items())
+            if key != default_key and now - last_used > self.engine_idle_seconds
+        )
+        freed = 0
+        with self._lock:
+            for _, key in idle:
+                if freed >= needed:
+                    break
+                self.engines.pop(key, None)
+                self._engine_last_used.pop(key, None)
+                freed += self._engine_sizes.pop(key, 0)
+                logger.info(f"Evicted idle OCR engine {key} under memory pressure")
+        return freed
+
+    # Execution
+
+    def _reserve(self, estimate: int, deadline: Optional[Deadline]):
+        timeout = deadline.wait_timeout(self.memory_governor.hold_timeout) if deadline else None
+        return self.memory_governor.reserve(estimate, timeout=timeout)
+
+    def run(self, image: ImageInput, profile: Union[Profile, str, None] = None, tiling: Optional[str] = 'auto',
+            cls: Optional[bool] = None, deadline: Optional[Deadline] = None, engine: Optional[OCRBackend] = None,
+            **engine_args: Any) -> OCRResult:
+        """
+        OCR one image once the memory governor admits it. Encoded images are
+        sized from their header and decoded only after admission; pages
+        larger than ``tiling.threshold_side`` are tiled (``tiling`` 'on'/'off'
+        forces it). Pages the pre-filter skips come back empty, with ``skipped`` set.
+        """
+        engine = self.lane_engine(engine or self.engine(profile, **engine_args))
+        cls = engine.use_angle_cls if cls is None else cls
+        image = read_image_bytes(image)
+        width, height, channels = image_size(image)
+        tiled = self.tiler.should_tile(width, height, tiling)
+        if tiled:
+            estimate = self.tiler.estimate(self.memory_governor, width, height, channels, det_side(engine))
+        else:
+            estimate = self.memory_governor.estimate_request(width, height, channels, det_side(engine))
+        with self._reserve(estimate, deadline):
+            if deadline:
+                deadline.check()
+            with profile_metrics.track(engine.profile):
+                image = decode_image(image)
+                skipped, _ = self.prefilter.check_batch([image])[0]
+                if skipped:
+                    return OCRResult.empty(width=width, height=height, profile=engine.profile,
+                                           backend=engine.name, skipped=skipped)
+                if tiled:
+                    raw = self.tiler.ocr(engine, image, cls=cls, deadline=deadline)
+                else:
+                    raw = engine.ocr(image, cls=cls)
+        return OCRResult.from_raw(raw, width=width, height=height, profile=engine.profile,
+                                  backend=engine.name, tiled=tiled)
+
+    def run_batch(self, images: Sequence[ImageInput], profile: Union[Profile, str, None] = None,
+                  cls: Optional[bool] = None, deadline: Optional[Deadline] = None,
+                  engine: Optional[OCRBackend] = None,
+                  **engine_args: Any) -> Tuple[List[Union[OCRResult, Exception]], Dict[str, int]]:
+        """
+        OCR a group of images as one shape-aware batch admitted as a whole.
+        Returns one result, or the ``ValueError`` of an unreadable image, per
+        input, plus the recognition padding totals. Pre-filtered pages skip
+        the engine; a duplicate shares the result of its first copy.
+        """
+        engine = self.lane_engine(engine or self.engine(profile, **engine_args))
+        cls = engine.use_angle_cls if cls is None else cls
+        outcomes: List[Union[OCRResult, Exception, None]] = [None] * len(images)
+        padding = {'images': 0, 'crops': 0, 'useful_width': 0, 'padded_width': 0, 'unsorted_padded_width': 0}
+        sizes, readable = [], []
+        for index, image in enumerate(images):
+            try:
+                image = read_image_bytes(image)
+                sizes.append(image_size(image))
+                readable.append((index, image))
+            except (OSError, ValueError) as e:
+                outcomes[index] = e if isinstance(e, ValueError) else ValueError(str(e))
+        if not readable:
+            return outcomes, padding
+
+        with self._reserve(self.memory_governor.estimate_batch(sizes, det_side(engine)), deadline):
+            if deadline:
+                deadline.check()
+            with profile_metrics.track(engine.profile):
+                decoded, owners = [], []
+                for (index, image), size in zip(readable, sizes):
+                    try:
+                        decoded.append(decode_image(image))
+                        owners.append((index, size))
+                    except ValueError as e:
+                        outcomes[index] = e
+                decisions = self.prefilter.check_batch(decoded)
+                pending = [i for i, (skipped, _) in enumerate(decisions) if not skipped]
+                start = 0
+                while start < len(pending):
+                    # While interactive work waits, one image per engine call frees the engine between images
+                    chunk = pending[start:start + 1] if interactive_waiting() else pending[start:]
+                    start += len(chunk)
+                    raws, chunk_padding = engine.ocr_batch([decoded[i] for i in chunk], cls=cls)
+                    for key, value in chunk_padding.items():
+                        padding[key] = padding.get(key, 0) + value
+                    for i, raw in zip(chunk, raws):
+                        index, (width, height, _) = owners[i]
+                        outcomes[index] = OCRResult.from_raw(raw, width=width, height=height,
+                                                             profile=engine.profile, backend=engine.name)
+                for (index, (width, height, _)), (skipped, original) in zip(owners, decisions):
+                    if not skipped:
+                        continue
+                    if original is not None:
+                        first = outcomes[owners[original][0]]
+                        outcomes[index] = OCRResult(first.boxes, first.texts, first.confidences, width=width,
+                                                    height=height, profile=engine.profile,
+                                                    backend=engine.name, skipped=skipped)
+                    else:
+                        outcomes[index] = OCRResult.empty(width=width, height=height, profile=engine.profile,
+                                                          backend=engine.name, skipped=skipped)
+        return outcomes, padding
+
+    def read_form(self, image: ImageInput, registry: TemplateRegistry, template: Optional[str] = None,
+                  profile: Union[Profile, str, None] = None, deadline: Optional[Deadline] = None,
+                  engine: Optional[OCRBackend] = None, **engine_args: Any) -> Dict[str, Any]:
+        """
+        Read a form page against ``registry`` (see :func:`templates.read_form`);
+        a page matching no template comes back as an :class:`OCRResult` under ``'result'``.
+        """
+        engine = self.lane_engine(engine or self.engine(profile, **engine_args))
+        image = read_image_bytes(image)
+        width, height, channels = image_size(image)
+        with self._reserve(self.memory_governor.estimate_request(width, height, channels, det_side(engine)),
+                           deadline):
+            if deadline:
+                deadline.check()
+            with profile_metrics.track(engine.profile):
+                result = read_form_page(engine, registry, decode_image(image), template, cls=engine.use_angle_cls)
+        if not result['matched']:
+            result['result'] = OCRResult.from_raw(result['result'], width=width, height=height,
+                                                  profile=engine.profile, backend=engine.name)
+        return result
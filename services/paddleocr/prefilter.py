@@ -0,0 +1,174 @@
+"""
+Cheap pre-filter that keeps pages without text away from the engines.
+
+Blank separators, backsides and photos still pay for full detection, and
+often for spurious recognition. :class:`PageFilter` runs before the engine
+on a small grayscale thumbnail:
+
+* ``blank``: almost no pixels darker (or, on inverted pages, lighter) than
+  the page background. The thumbnails are min- and max-pooled, so thin
+  strokes survive the downscaling.
+* ``duplicate``: the same pixels as an earlier page of the batch (hash of the
+  decoded image); the copy reuses the earlier page's result.
+* ``no_text``: an optional tiny ONNX text-presence classifier on the
+  thumbnail scores the page below its threshold.
+
+Skipped pages get an empty result flagged with the reason, and skips are
+counted in :data:`prefilter_stats`.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+BLANK = 'blank'
+DUPLICATE = 'duplicate'
+NO_TEXT = 'no_text'
+
+
+def ink_ratio(image: np.ndarray, side: int = 256, ink_delta: int = 48) -> float:
+    """
+    Share of blocks (of a grid at most ``side`` blocks across) holding a
+    pixel darker or lighter than the page background by ``ink_delta``.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if not gray.size:
+        return 0.0
+    factor = max(1, min(int(np.ceil(max(gray.shape) / side)), *gray.shape))
+    # Whole blocks only: a remainder strip narrower than one block at the edge is ignored
+    height, width = gray.shape[0] // factor, gray.shape[1] // factor
+    blocks = gray[:height * factor, :width * factor].reshape(height, factor, width, factor)
+    background = float(np.median(gray[::factor, ::factor]))
+    ink = ((blocks.min(axis=(1, 3)) < background - ink_delta) |
+           (blocks.max(axis=(1, 3)) > background + ink_delta)).astype(np.uint8)
+    # Strokes span neighbouring blocks; an isolated block is dust or scanner noise
+    neighbours = cv2.boxFilter(ink, -1, (3, 3), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    return float(np.count_nonzero(ink & (neighbours > 1))) / ink.size
+
+
+def image_hash(image: np.ndarray) -> str:
+    """Digest of the decoded pixels and their shape."""
+    digest = hashlib.blake2b(repr(image.shape).encode(), digest_size=16)
+    digest.update(memoryview(np.ascontiguousarray(image)).cast('B'))
+    return digest.hexdigest()
+
+
+class TextPresenceClassifier:
+    """Tiny ONNX model scoring whether a thumbnail contains text (``[no text, text]`` output)."""
+
+    def __init__(self, model: str, side: int = 128, threshold: float = 0.2):
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(model, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.side = side
+        self.threshold = threshold
+
+    def score(self, image: np.ndarray) -> float:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, (self.side, self.side), interpolation=cv2.INTER_AREA)
+        blob = (thumbnail.astype(np.float32) / 255.0 - 0.5) / 0.5
+        output = self.session.run(None, {self.input_name: blob[np.newaxis, np.newaxis]})[0]
+        return float(np.ravel(output)[-1])
+
+
+class PageFilter:
+    """Decides which pages skip the engine, and why."""
+
+    def __init__(self, enabled: bool = True, thumbnail_side: int = 256, ink_delta: int = 48,
+                 max_ink_ratio: float = 0.0001, duplicates: bool = True,
+                 classifier: Optional[TextPresenceClassifier] = None):
+        self.enabled = enabled
+        self.thumbnail_side = thumbnail_side
+        self.ink_delta = ink_delta
+        self.max_ink_ratio = max_ink_ratio
+        self.duplicates = duplicates
+        self.classifier = classifier
+
+    @classmethod
+    def from_config(cls) -> 'PageFilter':
+        classifier = None
+        model = get_setting('prefilter.text_classifier.model', None)
+        if model:
+            try:
+                classifier = TextPresenceClassifier(
+                    model,
+                    side=int(get_setting('prefilter.text_classifier.side', 128)),
+                    threshold=float(get_setting('prefilter.text_classifier.threshold', 0.2)),
+                )
+            except Exception as e:
+                logger.warning(f"Text-presence classifier disabled: {e}")
+        return cls(
+            enabled=bool(get_setting('prefilter.enabled', True)),
+            thumbnail_side=int(get_setting('prefilter.thumbnail_side', 256)),
+            ink_delta=int(get_setting('prefilter.ink_delta', 48)),
+            max_ink_ratio=float(get_setting('prefilter.max_ink_ratio', 0.0001)),
+            duplicates=bool(get_setting('prefilter.duplicates', True)),
+            classifier=classifier,
+        )
+
+    def check(self, image: np.ndarray) -> Optional[str]:
+        """Reason to skip one page (``blank`` or ``no_text``), or ``None`` to OCR it."""
+        if not self.enabled:
+            return None
+        if ink_ratio(image, self.thumbnail_side, self.ink_delta) < self.max_ink_ratio:
+            return BLANK
+        if self.classifier is not None and self.classifier.score(image) < self.classifier.threshold:
+            return NO_TEXT
+        return None
+
+    def check_batch(self, images: Sequence[np.ndarray]) -> List[Tuple[Optional[str], Optional[int]]]:
+        """
+        Per image, the reason to skip it and, for duplicates, the index of the
+        earlier copy whose result it shares.
+        """
+        if not self.enabled:
+            return [(None, None)] * len(images)
+        first: Dict[str, int] = {}
+        decisions: List[Tuple[Optional[str], Optional[int]]] = []
+        for index, image in enumerate(images):
+            if self.duplicates:
+                digest = image_hash(image)
+                if digest in first:
+                    decisions.append((DUPLICATE, first[digest]))
+                    continue
+                first[digest] = index
+            decisions.append((self.check(image), None))
+        for reason, _ in decisions:
+            prefilter_stats.record(reason)
+        return decisions
+
+
+class PrefilterStats:
+    """Running counts of pages checked and skipped, by reason."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.skipped: Dict[str, int] = {BLANK: 0, DUPLICATE: 0, NO_TEXT: 0}
+
+    def record(self, reason: Optional[str]) -> None:
+        with self._lock:
+            self.pages += 1
+            if reason:
+                self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            skipped = sum(self.skipped.values())
+            return {
+                'pages': self.pages,
+                'skipped': dict(self.skipped),
+                'skip_rate': round(skipped / self.pages, 4) if self.pages else None,
+            }
+
+
+prefilter_stats = PrefilterStats()
@@ -0,0 +1,209 @@
+"""
+Named speed/accuracy profiles for OCR requests.
+
+Bulk archival jobs and interactive lookups have very different latency
+budgets, so every endpoint and tool takes a ``profile`` (``fast``,
+``balanced``, ``accurate`` or any profile defined under ``profiles`` in the
+config). A profile sets the detector input size, the recognition batch size,
+whether angle classification runs and which model variant is loaded; a
+profile may also escalate low-confidence lines to a second variant
+(a recognition cascade). Engines are cached per profile by the front ends. Requests and latency are counted
+per profile for health reporting.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from config import get_setting
+
+DEFAULT_PROFILE = 'balanced'
+
+# Models a backend loads when a variant adds no model options
+DEFAULT_VARIANT = 'mobile'
+
+# Used when the config defines no profiles
+BUILTIN_PROFILES = {
+    'fast': {
+        'description': 'Low latency: small detector input, no angle classification',
+        'det_limit_side_len': 640,
+        'rec_batch_num': 16,
+        'use_angle_cls': False,
+        'model_variant': 'mobile',
+    },
+    'balanced': {
+        'description': 'Default trade-off',
+        'det_limit_side_len': 960,
+        'rec_batch_num': 6,
+        'use_angle_cls': True,
+        'model_variant': 'mobile',
+    },
+    'accurate': {
+        'description': 'Small text and dense pages: large detector input, server models where configured',
+        'det_limit_side_len': 1536,
+        'rec_batch_num': 6,
+        'use_angle_cls': True,
+        'model_variant': 'server',
+    },
+    'cascade': {
+        'description': 'Mobile models, low-confidence lines re-read by server models where configured',
+        'det_limit_side_len': 960,
+        'rec_batch_num': 6,
+        'use_angle_cls': True,
+        'model_variant': 'mobile',
+        'escalate_variant': 'server',
+        'escalate_below': 0.85,
+    },
+}
+
+
+@dataclass(frozen=True)
+class Profile:
+    """Engine settings of one named profile."""
+    name: str
+    det_limit_side_len: int = 960
+    rec_batch_num: int = 6
+    use_angle_cls: bool = True
+    model_variant: str = 'mobile'
+    description: str = ''
+    escalate_variant: Optional[str] = None
+    escalate_below: float = 0.85
+
+    def engine_options(self, backend: str) -> Dict[str, Any]:
+        """Constructor options for ``backend``: input sizes plus the variant's model settings."""
+        options: Dict[str, Any] = {
+            'det_limit_side_len': self.det_limit_side_len,
+            'rec_batch_num': self.rec_batch_num,
+        }
+        options.update(self._variant_options(backend, self.model_variant))
+        if self.escalate_variant:
+            options['escalation'] = {
+                'below': self.escalate_below,
+                'options': self._variant_options(backend, self.escalate_variant),
+            }
+        return options
+
+    @staticmethod
+    def _variant_options(backend: str, variant: str) -> Dict[str, Any]:
+        return dict(get_setting(f'profiles.model_variants.{backend}.{variant}', {}) or {})
+
+    def loaded_variant(self, backend: str, variant: str) -> str:
+        """The variant ``backend`` actually loads for ``variant``: the default one if it adds no options."""
+        return variant if self._variant_options(backend, variant) else DEFAULT_VARIANT
+
+    def unavailable_reason(self, backend: str) -> Optional[str]:
+        """Why ``backend`` cannot serve the profile: a cascade whose second variant adds no models there."""
+        if not self.escalate_variant:
+            return None
+        primary = self._variant_options(backend, self.model_variant)
+        escalation = self._variant_options(backend, self.escalate_variant)
+        if all(primary.get(key) == value for key, value in escalation.items()):
+            return (f"Profile '{self.name}' re-reads lines with the '{self.escalate_variant}' models, which the "
+                    f"{backend} backend does not have (set profiles.model_variants.{backend}.{self.escalate_variant})")
+        return None
+
+    def describe(self, backend: Optional[str] = None) -> Dict[str, Any]:
+        """Settings of the profile; with ``backend``, the models it really loads there and whether it can run."""
+        description = {
+            'name': self.name,
+            'description': self.description,
+            'det_limit_side_len': self.det_limit_side_len,
+            'rec_batch_num': self.rec_batch_num,
+            'use_angle_cls': self.use_angle_cls,
+            'model_variant': self.loaded_variant(backend, self.model_variant) if backend else self.model_variant,
+            'escalate_variant': self.escalate_variant,
+            'escalate_below': self.escalate_below if self.escalate_variant else None,
+        }
+        if backend:
+            reason = self.unavailable_reason(backend)
+            description.update({'available': reason is None, 'unavailable_reason': reason})
+        return description
+
+
+def available_profiles() -> Dict[str, Profile]:
+    """Profiles from ``profiles.definitions``, or the built-in ``fast``/``balanced``/``accurate``."""
+    definitions = get_setting('profiles.definitions', None) or BUILTIN_PROFILES
+    return {
+        name: Profile(
+            name=name,
+            det_limit_side_len=int(spec.get('det_limit_side_len', 960)),
+            rec_batch_num=int(spec.get('rec_batch_num', 6)),
+            use_angle_cls=bool(spec.get('use_angle_cls', True)),
+            model_variant=str(spec.get('model_variant', 'mobile')),
+            description=str(spec.get('description', '')),
+            escalate_variant=spec.get('escalate_variant') or None,
+            escalate_below=float(spec.get('escalate_below', 0.85)),
+        )
+        for name, spec in definitions.items()
+    }
+
+
+def default_profile() -> str:
+    return get_setting('profiles.default', DEFAULT_PROFILE)
+
+
+def get_profile(name: Optional[str] = None, backend: Optional[str] = None) -> Profile:
+    """
+    The named profile (the default if ``name`` is empty); ``ValueError`` if
+    unknown, or if ``backend`` is given and cannot serve it.
+    """
+    profiles = available_profiles()
+    name = name or default_profile()
+    if name not in profiles:
+        raise ValueError(f"Unknown profile: {name}. Available: {', '.join(profiles)}")
+    reason = profiles[name].unavailable_reason(backend) if backend else None
+    if reason:
+        raise ValueError(reason)
+    return profiles[name]
+
+
+class ProfileMetrics:
+    """Requests, failures and latency percentiles per profile."""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, profile: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(profile, {'requests': 0, 'failed': 0,
+                                                     'latencies': deque(maxlen=self.window)})
+            stats['requests'] += 1
+            if ok:
+                stats['latencies'].append(seconds)
+            else:
+                stats['failed'] += 1
+
+    @contextmanager
+    def track(self, profile: str):
+        """Record the duration of the block for ``profile``, as failed if it raises."""
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(profile, time.monotonic() - started, ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {}
+            for profile, stats in self._stats.items():
+                latencies = sorted(stats['latencies'])
+
+                def percentile(q: float, values=latencies) -> float:
+                    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1) if values else 0.0
+
+                snapshot[profile] = {
+                    'requests': stats['requests'],
+                    'failed': stats['failed'],
+                    'latency_ms': {'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99)},
+                }
+            return snapshot
+
+
+profile_metrics = ProfileMetrics()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Cache-affine router in front of several PaddleOCR REST instances.
+
+Requests are placed on a consistent-hash ring by ``language`` and the hash of
+the image bytes, so the same document (and the same language's engine) keeps
+landing on the same instance. Each instance's ``/health`` is polled for
+readiness, memory headroom and scheduler queue depth. When the preferred
+instance is down or saturated the request spills over to the next instance
+on the ring, and adding or removing an instance only moves the keys that
+hash to it. Batches are split per instance and merged back in order.
+
+Usage:
+    python router.py --port 8880 --instance http://127.0.0.1:8891 --instance http://127.0.0.1:8892
+    OCR_INSTANCES=http://ocr-1:8888,http://ocr-2:8888 gunicorn -b 0.0.0.0:8880 --threads 16 'router:create_app()'
+"""
+
+import argparse
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from flask import Flask, Response, jsonify, request
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def request_key(data: bytes, language: str) -> str:
+    """Routing key of one image: language plus content hash."""
+    return f"{language}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, virtual_nodes: int = 160):
+        self.virtual_nodes = virtual_nodes
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def walk(self, key: str) -> Iterator[str]:
+        """Distinct nodes in ring order starting at ``key``'s position."""
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, _hash(key))
+        seen = set()
+        for offset in range(len(self._points)):
+            owner = self._owners[(start + offset) % len(self._points)]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class Instance:
+    """Health and load of one upstream OCR instance."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.ready = True  # optimistic until the first health check
+        self.queued = 0
+        self.inflight = 0
+        self.requests = 0
+        self.spilled_in = 0
+        self.failures = 0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'ready': self.ready,
+            'queued': self.queued,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'spilled_in': self.spilled_in,
+            'failures': self.failures,
+            'last_check_age': round(time.monotonic() - self.last_check, 1) if self.last_check else None,
+            'last_error': self.last_error,
+        }
+
+
+class Router:
+    """Chooses an instance per image and forwards requests to it."""
+
+    def __init__(self, instances: List[str], virtual_nodes: int = 160, max_inflight: int = 16,
+                 max_queue: int = 32, health_interval: float = 2.0, timeout: float = 120.0):
+        self.ring = HashRing(virtual_nodes)
+        self.instances: Dict[str, Instance] = {}
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='route')
+        self._health_thread: Optional[threading.Thread] = None
+        for url in instances:
+            self.add_instance(url)
+
+    @classmethod
+    def from_config(cls, instances: Optional[List[str]] = None) -> 'Router':
+        env = [url for url in os.getenv('OCR_INSTANCES', '').split(',') if url.strip()]
+        return cls(
+            instances=instances or env or list(get_setting('router.instances', [])),
+            virtual_nodes=int(get_setting('router.virtual_nodes', 160)),
+            max_inflight=int(get_setting('router.max_inflight_per_instance', 16)),
+            max_queue=int(get_setting('router.max_queue_per_instance', 32)),
+            health_interval=float(get_setting('router.health_interval', 2)),
+            timeout=float(get_setting('router.timeout', 120)),
+        )
+
+    def add_instance(self, url: str) -> Instance:
+        with self._lock:
+            url = url.rstrip('/')
+            if url not in self.instances:
+                self.instances[url] = Instance(url)
+                self.ring.add(url)
+                logger.info(f"Instance joined: {url}")
+            return self.instances[url]
+
+    def remove_instance(self, url: str) -> bool:
+        with self._lock:
+            url = url.rstrip('/')
+            if url not in self.instances:
+                return False
+            self.ring.remove(url)
+            del self.instances[url]
+            logger.info(f"Instance left: {url}")
+            return True
+
+    def _saturated(self, instance: Instance) -> bool:
+        return instance.inflight >= self.max_inflight or instance.queued >= self.max_queue
+
+    def candidates(self, key: str) -> List[Instance]:
+        """
+        Instances to try for ``key``: the first ready, unsaturated instance in
+        ring order, then the remaining ready ones (least loaded first) as
+        fallbacks. Unready instances are skipped without changing the ring.
+        """
+        with self._lock:
+            ordered = [self.instances[url] for url in self.ring.walk(key)]
+        ready = [instance for instance in ordered if instance.ready]
+        preferred = next((instance for instance in ready if not self._saturated(instance)), None)
+        rest = sorted((instance for instance in ready if instance is not preferred),
+                      key=lambda instance: instance.inflight + instance.queued)
+        return ([preferred] if preferred else []) + rest
+
+    def home(self, key: str) -> Optional[Instance]:
+        """The instance owning ``key`` on the ring, ready or not."""
+        with self._lock:
+            return next((self.instances[url] for url in self.ring.walk(key)), None)
+
+    def forward(self, candidates: List[Instance], endpoint: str, files: List[Tuple[str, Tuple[str, bytes, str]]],
+                form: Dict[str, str], params: Optional[Dict[str, str]] = None, home: Optional[Instance] = None
+                ) -> Tuple[Optional[Instance], Optional[requests.Response], Optional[str]]:
+        """
+        POST to the first of ``candidates``, moving on to the next after
+        failures or 503. The instance that answers counts a spill-in when it
+        is not ``home``, the ring owner of the request.
+        """
+        error = 'No healthy OCR instances'
+        for instance in candidates[:3]:
+            with self._lock:
+                instance.inflight += 1
+                instance.requests += 1
+            try:
+                response = self._session.post(instance.url + endpoint, files=files, data=form, params=params,
+                                              timeout=self.timeout)
+            except requests.RequestException as e:
+                instance.failures += 1
+                instance.ready = False
+                instance.last_error = str(e)
+                error = f"{instance.url}: {e}"
+                continue
+            finally:
+                with self._lock:
+                    instance.inflight -= 1
+            if response.status_code == 503:
+                # Low on memory or not ready; the next health check re-admits it
+                instance.ready = False
+                error = f"{instance.url}: 503"
+                continue
+            if home is not None and instance is not home:
+                with self._lock:
+                    instance.spilled_in += 1
+            return instance, response, None
+        return None, None, error
+
+    def check_health(self) -> None:
+        """Refresh readiness and queue depth of every instance."""
+        for instance in list(self.instances.values()):
+            try:
+                response = self._session.get(instance.url + '/health', timeout=min(self.health_interval * 2, 5))
+                body = response.json()
+                memory = body.get('memory') or {}
+                scheduler = body.get('scheduler') or {}
+                instance.ready = (response.status_code == 200 and body.get('status') == 'healthy'
+                                  and memory.get('ready', True))
+                instance.queued = sum(stats.get('queued', 0) + stats.get('running', 0)
+                                      for stats in scheduler.values() if isinstance(stats, dict))
+                instance.last_error = None
+            except (requests.RequestException, ValueError) as e:
+                instance.ready = False
+                instance.last_error = str(e)
+            instance.last_check = time.monotonic()
+
+    def start(self) -> None:
+        """Start background health checks (idempotent)."""
+        if self._health_thread and self._health_thread.is_alive():
+            return
+
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+
+        self._health_thread = threading.Thread(target=loop, name='router-health', daemon=True)
+        self._health_thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'instances': [instance.status() for instance in self.instances.values()],
+            'ring_points': len(self.ring),
+            'max_inflight_per_instance': self.max_inflight,
+            'max_queue_per_instance': self.max_queue,
+        }
+
+
+def _proxy(response: requests.Response, instance: Instance) -> Response:
+    proxied = Response(response.content, status=response.status_code,
+                       content_type=response.headers.get('Content-Type', 'application/json'))
+    proxied.headers['X-OCR-Instance'] = instance.url
+    return proxied
+
+
+def create_app(router: Optional[Router] = None) -> Flask:
+    """Flask app exposing the OCR endpoints through ``router``."""
+    router = router or Router.from_config()
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = int(get_setting(
+        'security.max_request_size',
+        int(get_setting('security.max_file_size', 10485760)) * int(get_setting('ocr.max_batch_size', 10))
+    ))
+    app.config['router'] = router
+    router.start()
+
+    def language() -> str:
+        return request.form.get('language') or request.args.get('language') or 'en'
+
+    def forward_file(endpoint: str) -> Response:
+        """Route the request's one 'file' upload to its affine instance."""
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'success': False, 'error': 'No file provided'}), 400
+        data = upload.read()
+        files = [('file', (upload.filename, data, upload.mimetype or 'application/octet-stream'))]
+        key = request_key(data, language())
+        instance, response, error = router.forward(router.candidates(key), endpoint, files, request.form.to_dict(),
+                                                   request.args.to_dict(), home=router.home(key))
+        if response is None:
+            return jsonify({'success': False, 'error': 'OCR instances unavailable', 'details': error}), 503
+        return _proxy(response, instance)
+
+    @app.route('/ocr/extract', methods=['POST'])
+    def extract_text():
+        return forward_file('/ocr/extract')
+
+    @app.route('/ocr/form', methods=['POST'])
+    def extract_form():
+        return forward_file('/ocr/form')
+
+    @app.route('/ocr/batch', methods=['POST'])
+    def batch_extract_text():
+        uploads = request.files.getlist('files')
+        if not uploads:
+            return jsonify({'success': False, 'error': 'No files provided'}), 400
+
+        # Each image goes to its own affine instance; results are merged in request order
+        lang = language()
+        form = request.form.to_dict()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(uploads)
+        groups: Dict[str, List[Tuple[int, Tuple[str, bytes, str]]]] = {}
+        fallbacks: Dict[str, List[Instance]] = {}
+        homes: Dict[str, Optional[Instance]] = {}
+        for index, upload in enumerate(uploads):
+            if not upload.filename:
+                results[index] = {'filename': '', 'success': False, 'error': 'No file selected'}
+                continue
+            data = upload.read()
+            key = request_key(data, lang)
+            candidates = router.candidates(key)
+            target = candidates[0].url if candidates else ''
+            groups.setdefault(target, []).append((index, (upload.filename, data, upload.mimetype or '')))
+            fallbacks.setdefault(target, candidates)
+            homes.setdefault(target, router.home(key))
+
+        def send(target: str):
+            files = [('files', item) for _, item in groups[target]]
+            return target, router.forward(fallbacks[target], '/ocr/batch', files, form, request.args.to_dict(),
+                                          home=homes[target])
+
+        for target, (instance, response, error) in router._pool.map(send, list(groups)):
+            ok = response is not None and response.status_code == 200
+            data = response.json().get('data', []) if ok else []
+            for position, (index, item) in enumerate(groups[target]):
+                if position < len(data):
+                    results[index] = {**data[position], 'instance': instance.url}
+                else:
+                    results[index] = {'filename': item[0], 'success': False,
+                                      'error': error or f"Instance returned {response.status_code}"}
+
+        return jsonify({'success': True, 'data': results})
+
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        ready = [instance for instance in router.instances.values() if instance.ready]
+        return jsonify({
+            'status': 'healthy' if ready else 'unhealthy',
+            'timestamp': datetime.now().isoformat(),
+            'service': 'paddleocr-router',
+            'ready_instances': len(ready),
+            'instances': len(router.instances)
+        }), 200 if ready else 503
+
+    @app.route('/router/status', methods=['GET'])
+    def router_status():
+        return jsonify({'success': True, 'data': router.status()})
+
+    @app.route('/router/instances', methods=['POST', 'DELETE'])
+    def manage_instances():
+        url = (request.get_json(silent=True) or {}).get('url') or request.args.get('url')
+        if not url:
+            return jsonify({'success': False, 'error': 'Instance url required'}), 400
+        if request.method == 'POST':
+            router.add_instance(url)
+        elif not router.remove_instance(url):
+            return jsonify({'success': False, 'error': f'Unknown instance: {url}'}), 404
+        return jsonify({'success': True, 'data': router.status()})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache-affine router for PaddleOCR instances")
+    parser.add_argument('--instance', action='append', default=[], help='Upstream base URL (repeatable)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(get_setting('router.port', 8880)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(Router.from_config(args.instance))
+    app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Two-class priority scheduler in front of the OCR engines.
+
+Interactive requests (single images from the UI) and bulk work (batch
+images) wait in separate queues. Workers always take interactive jobs first,
+and a share of the workers only ever serves interactive jobs. Bulk batches
+run in small groups of images (``performance.batching.max_images``), either
+submitted as groups or queued image by image with
+:meth:`OCRScheduler.submit_batched` and grouped when a worker takes them.
+While interactive work is queued or running, a group goes to the engine one
+image at a time, so an interactive request waits behind at most the images
+already running, never behind the rest of a batch. Reserved workers use
+their own copies of engines that serialize calls (see
+:meth:`pipeline.OCRPipeline.engine`). Queue-wait times are tracked per class
+for health reporting.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+from config import get_setting
+from deadlines import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Scheduler and role of the worker thread running the current job
+_worker = threading.local()
+
+
+def on_reserved_worker() -> bool:
+    """Whether the calling thread is a scheduler worker that only serves interactive jobs."""
+    return getattr(_worker, 'reserved', False)
+
+
+def interactive_waiting() -> bool:
+    """Whether interactive jobs are queued or running on the calling worker's scheduler."""
+    scheduler = getattr(_worker, 'scheduler', None)
+    return scheduler is not None and scheduler.interactive_waiting()
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'priority', 'deadline', 'queued_at', 'batch_key', 'batch_size')
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, priority: str, deadline: Optional[Deadline],
+                 batch_key: Optional[Hashable] = None, batch_size: int = 1):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.priority = priority
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        # Queued jobs with the same key run together as one fn([items]) call
+        self.batch_key = batch_key
+        self.batch_size = batch_size
+
+
+class _ClassStats:
+    def __init__(self, window: int):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.running = 0
+        self.waits: Deque[float] = deque(maxlen=window)
+
+    def snapshot(self, queued: int) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def percentile(q: float) -> float:
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            'queued': queued,
+            'running': self.running,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'expired': self.expired,
+            'queue_wait_ms': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(waits[-1] * 1000, 1) if waits else 0.0,
+            },
+        }
+
+
+class OCRScheduler:
+    """Worker threads serving an interactive and a bulk queue with strict priority."""
+
+    def __init__(self, workers: int = 1, interactive_share: float = 0.5, wait_window: int = 2048):
+        # With an interactive share, at least one interactive-only worker besides the bulk one
+        self.workers = max(2 if interactive_share > 0 else 1, int(workers))
+        # Bulk work always keeps at least one worker
+        self.reserved = min(max(int(self.workers * interactive_share), 1 if interactive_share > 0 else 0),
+                            self.workers - 1)
+        self._queues: Dict[str, Deque[_Job]] = {priority: deque() for priority in PRIORITIES}
+        self._stats = {priority: _ClassStats(wait_window) for priority in PRIORITIES}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls) -> 'OCRScheduler':
+        return cls(
+            workers=int(get_setting('performance.scheduler.workers', 2)),
+            interactive_share=float(get_setting('performance.scheduler.interactive_share', 0.5)),
+        )
+
+    def _start(self) -> None:
+        for index in range(len(self._threads), self.workers):
+            thread = threading.Thread(target=self._work, args=(index < self.reserved,),
+                                      name=f'ocr-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn: Callable, *args: Any, priority: str = INTERACTIVE,
+               deadline: Optional[Deadline] = None, **kwargs: Any) -> Future:
+        """
+        Queue ``fn(*args, **kwargs)`` in the ``priority`` class. Jobs whose
+        deadline has passed by the time a worker picks them up are dropped
+        with :class:`~deadlines.DeadlineExceeded`; cancelling the returned
+        future before it starts removes the job.
+        """
+        return self._enqueue(_Job(fn, args, kwargs, priority, deadline))
+
+    def submit_batched(self, fn: Callable[[List[Any]], List[Any]], item: Any, key: Hashable, max_batch: int,
+                       priority: str = BULK, deadline: Optional[Deadline] = None) -> Future:
+        """
+        Queue one ``item`` for ``fn(items) -> results``. The worker that takes
+        it also takes the items with the same ``key`` queued behind it, up to
+        ``max_batch``, and runs them as one call; each future gets its item's
+        result. Items are queued as soon as they exist and grouped only when
+        a worker is free, so nothing waits for a group to fill.
+        """
+        return self._enqueue(_Job(fn, (item,), {}, priority, deadline, key, max(1, int(max_batch))))
+
+    def _enqueue(self, job: _Job) -> Future:
+        if job.priority not in self._queues:
+            raise ValueError(f"Unknown priority: {job.priority}")
+        priority = job.priority
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Scheduler is shut down")
+            if len(self._threads) < self.workers:
+                self._start()
+            self._queues[priority].append(job)
+            self._stats[priority].submitted += 1
+            self._cond.notify_all()
+        return job.future
+
+    def _next_jobs(self, interactive_only: bool) -> List[_Job]:
+        """The next job, with the queued jobs of its batch; empty when stopping."""
+        with self._cond:
+            while True:
+                for priority in PRIORITIES:
+                    if priority == BULK and interactive_only:
+                        continue
+                    queue = self._queues[priority]
+                    if queue:
+                        jobs = [queue.popleft()]
+                        if jobs[0].batch_key is not None:
+                            self._take_batch(queue, jobs)
+                        return jobs
+                if self._stopping:
+                    return []
+                self._cond.wait()
+
+    @staticmethod
+    def _take_batch(queue: Deque[_Job], jobs: List[_Job]) -> None:
+        key, size = jobs[0].batch_key, jobs[0].batch_size
+        rest: Deque[_Job] = deque()
+        while queue:
+            job = queue.popleft()
+            if len(jobs) < size and job.batch_key == key:
+                jobs.append(job)
+            else:
+                rest.append(job)
+        queue.extend(rest)
+
+    def interactive_waiting(self) -> bool:
+        # Unlocked read: a momentarily stale answer only shifts one engine call
+        return bool(self._queues[INTERACTIVE]) or self._stats[INTERACTIVE].running > 0
+
+    def _work(self, interactive_only: bool) -> None:
+        _worker.scheduler = self
+        _worker.reserved = interactive_only
+        while True:
+            jobs = self._next_jobs(interactive_only)
+            if not jobs:
+                return
+            live = []
+            for job in jobs:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                expired = bool(job.deadline and job.deadline.stopped)
+                with self._cond:
+                    stats = self._stats[job.priority]
+                    stats.waits.append(time.monotonic() - job.queued_at)
+                    if expired:
+                        stats.expired += 1
+                    else:
+                        stats.running += 1
+                if expired:
+                    job.future.set_exception(DeadlineExceeded(job.deadline.stopped))
+                else:
+                    live.append(job)
+            if not live:
+                continue
+
+            try:
+                if live[0].batch_key is None:
+                    results = [live[0].fn(*live[0].args, **live[0].kwargs)]
+                else:
+                    results = list(live[0].fn([job.args[0] for job in live]))
+                failed = False
+            except BaseException as e:
+                failed = True
+                for job in live:
+                    job.future.set_exception(e)
+            else:
+                for job, result in zip(live, results):
+                    job.future.set_result(result)
+            with self._cond:
+                for job in live:
+                    stats = self._stats[job.priority]
+                    stats.running -= 1
+                    if failed:
+                        stats.failed += 1
+                    else:
+                        stats.completed += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, throughput counters and queue-wait percentiles per class."""
+        with self._cond:
+            classes = {priority: self._stats[priority].snapshot(len(self._queues[priority]))
+                       for priority in PRIORITIES}
+        return {'workers': self.workers, 'reserved_interactive': self.reserved, **classes}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Cancel queued jobs and stop the workers after their current job."""
+        with self._cond:
+            self._stopping = True
+            for queue in self._queues.values():
+                while queue:
+                    queue.popleft().future.cancel()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
@@ -0,0 +1,312 @@
+"""
+Spatial index and query API over OCR results.
+
+OCR regions are kept as NumPy box arrays with a uniform grid index so that
+"what is inside this rectangle", "what is nearest to this point" and "what is
+to the right of the label 'Total'" can be answered without re-running OCR or
+walking the ``bounding_boxes`` list in Python. :class:`ResultStore` retains
+recent results by id so front ends can answer queries against them later.
+"""
+
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from layout import boxes_to_array
+
+_EPS = 1e-6
+
+
+def _normalize_rect(rect: Sequence[float]) -> tuple:
+    """``(x0, y0, x1, y1)`` with the corners in order, whichever two were given."""
+    x0, y0, x1, y1 = (float(v) for v in rect)
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+class SpatialIndex:
+    """Uniform grid over axis-aligned boxes stored as an ``(N, 4)`` array."""
+
+    def __init__(self, rects: np.ndarray, cell_size: Optional[float] = None):
+        self.rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        n = len(self.rects)
+        if n == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.grid_shape = (1, 1)
+            self._cell_keys = np.zeros(0, dtype=np.int64)
+            self._cell_boxes = np.zeros(0, dtype=np.int64)
+            return
+
+        sizes = np.maximum(self.rects[:, 2:] - self.rects[:, :2], _EPS)
+        self.cell_size = float(cell_size or max(np.median(sizes) * 2, _EPS))
+        self.origin = self.rects[:, :2].min(axis=0)
+        extent = self.rects[:, 2:].max(axis=0) - self.origin
+        # Bound the grid so degenerate inputs cannot allocate huge tables
+        self.cell_size = max(self.cell_size, float(extent.max()) / 1024)
+        ncols = int(extent[0] // self.cell_size) + 1
+        nrows = int(extent[1] // self.cell_size) + 1
+        self.grid_shape = (nrows, ncols)
+
+        g0 = self._cell_of(self.rects[:, :2])
+        g1 = self._cell_of(self.rects[:, 2:])
+        span = g1 - g0 + 1
+        counts = span[:, 0] * span[:, 1]
+        box_ids = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = np.repeat(span[:, 0], counts)
+        cx = np.repeat(g0[:, 0], counts) + offsets % width
+        cy = np.repeat(g0[:, 1], counts) + offsets // width
+        keys = cy * ncols + cx
+        order = np.argsort(keys, kind='stable')
+        self._cell_keys = keys[order]
+        self._cell_boxes = box_ids[order]
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    def _cell_of(self, points: np.ndarray) -> np.ndarray:
+        cells = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        nrows, ncols = self.grid_shape
+        return np.clip(cells, 0, [ncols - 1, nrows - 1])
+
+    def candidates(self, rect: Sequence[float]) -> np.ndarray:
+        """Ids of boxes whose grid cells touch ``rect``; a superset of intersecting boxes."""
+        if len(self.rects) == 0:
+            return np.zeros(0, dtype=np.int64)
+        x0, y0, x1, y1 = _normalize_rect(rect)
+        g0 = self._cell_of(np.array([x0, y0]))
+        g1 = self._cell_of(np.array([x1, y1]))
+        ncols = self.grid_shape[1]
+        rows = np.arange(g0[1], g1[1] + 1)
+        lo = np.searchsorted(self._cell_keys, rows * ncols + g0[0], side='left')
+        hi = np.searchsorted(self._cell_keys, rows * ncols + g1[0], side='right')
+        if len(lo) == 0:
+            return np.zeros(0, dtype=np.int64)
+        counts = hi - lo
+        positions = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        return np.unique(self._cell_boxes[positions])
+
+    def query(self, rect: Sequence[float], mode: str = 'center') -> np.ndarray:
+        """
+        Ids of boxes selected by ``rect``.
+
+        ``mode`` is ``'center'`` (box centre inside), ``'contains'`` (box fully
+        inside) or ``'intersects'`` (any overlap).
+        """
+        x0, y0, x1, y1 = _normalize_rect(rect)
+        ids = self.candidates((x0, y0, x1, y1))
+        r = self.rects[ids]
+        if mode == 'center':
+            cx = (r[:, 0] + r[:, 2]) / 2
+            cy = (r[:, 1] + r[:, 3]) / 2
+            hit = (cx >= x0) & (cx <= x1) & (cy >= y0) & (cy <= y1)
+        elif mode == 'contains':
+            hit = (r[:, 0] >= x0) & (r[:, 1] >= y0) & (r[:, 2] <= x1) & (r[:, 3] <= y1)
+        elif mode == 'intersects':
+            hit = (r[:, 0] <= x1) & (r[:, 2] >= x0) & (r[:, 1] <= y1) & (r[:, 3] >= y0)
+        else:
+            raise ValueError(f"Unknown region mode: {mode}")
+        return ids[hit]
+
+    def distances(self, ids: np.ndarray, x: float, y: float) -> np.ndarray:
+        """Euclidean distance from a point to each box (zero when inside)."""
+        r = self.rects[ids]
+        dx = np.maximum(np.maximum(r[:, 0] - x, x - r[:, 2]), 0)
+        dy = np.maximum(np.maximum(r[:, 1] - y, y - r[:, 3]), 0)
+        return np.hypot(dx, dy)
+
+    def nearest(self, x: float, y: float, k: int = 1, max_distance: Optional[float] = None) -> np.ndarray:
+        """Ids of the ``k`` boxes nearest to a point, closest first."""
+        n = len(self.rects)
+        if n == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        k = min(k, n)
+        radius = self.cell_size
+        full = float(np.hypot(*(self.rects[:, 2:].max(axis=0) - self.rects[:, :2].min(axis=0)))) + \
+            float(np.hypot(x - self.origin[0], y - self.origin[1]))
+        limit = full if max_distance is None else min(full, max_distance)
+        while True:
+            radius = min(radius, limit)
+            ids = self.candidates((x - radius, y - radius, x + radius, y + radius))
+            dist = self.distances(ids, x, y)
+            inside = dist <= radius
+            if inside.sum() >= k or radius >= limit:
+                ids, dist = ids[inside], dist[inside]
+                order = np.argsort(dist, kind='stable')[:k]
+                return ids[order]
+            radius *= 2
+
+
+class IndexedResult:
+    """OCR regions of one image held as NumPy arrays plus a :class:`SpatialIndex`."""
+
+    def __init__(self, boxes: Any, texts: Sequence[str], confidences: Sequence[float],
+                 metadata: Optional[Dict[str, Any]] = None):
+        self.rects = boxes_to_array(boxes)
+        self.texts = np.asarray(list(texts), dtype=object)
+        self.confidences = np.asarray(confidences, dtype=np.float64)
+        self.metadata = metadata or {}
+        self.index = SpatialIndex(self.rects)
+        self._lower = np.char.lower(self.texts.astype(str)) if len(self.texts) else np.zeros(0, dtype=str)
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    def region(self, i: int, distance: Optional[float] = None) -> Dict[str, Any]:
+        entry = {
+            'index': int(i),
+            'text': str(self.texts[i]),
+            'confidence': float(self.confidences[i]),
+            'bbox': [round(float(v), 2) for v in self.rects[i]],
+        }
+        if distance is not None:
+            entry['distance'] = round(float(distance), 2)
+        return entry
+
+    def within(self, region: Sequence[float], mode: str = 'center') -> List[Dict[str, Any]]:
+        """Regions inside ``region`` ([x0, y0, x1, y1]) in top-to-bottom, left-to-right order."""
+        ids = self.index.query(region, mode)
+        ids = ids[np.lexsort((self.rects[ids, 0], self.rects[ids, 1]))]
+        return [self.region(i) for i in ids]
+
+    def nearest(self, point: Sequence[float], k: int = 1,
+                max_distance: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The ``k`` regions closest to ``point`` ([x, y])."""
+        x, y = float(point[0]), float(point[1])
+        ids = self.index.nearest(x, y, k, max_distance)
+        dist = self.index.distances(ids, x, y)
+        return [self.region(i, d) for i, d in zip(ids, dist)]
+
+    def find_label(self, label: str, match: str = 'contains') -> np.ndarray:
+        """Ids of regions whose text matches ``label`` (``contains``, ``exact`` or ``regex``)."""
+        if len(self.texts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if match == 'contains':
+            hit = np.char.find(self._lower, label.lower()) >= 0
+        elif match == 'exact':
+            hit = np.char.strip(self._lower, ' :') == label.lower().strip(' :')
+        elif match == 'regex':
+            pattern = re.compile(label, re.IGNORECASE)
+            hit = np.fromiter((bool(pattern.search(t)) for t in self.texts), dtype=bool, count=len(self.texts))
+        else:
+            raise ValueError(f"Unknown label match mode: {match}")
+        return np.flatnonzero(hit)
+
+    def key_value(self, label: str, direction: str = 'right', match: str = 'contains',
+                  max_distance: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Pair each region matching ``label`` with the value next to it.
+
+        ``direction`` is ``'right'`` (same line) or ``'below'`` (same column).
+        When the label region already carries the value (``"Total: 12.50"``),
+        the remainder after the label is returned as an inline value.
+        """
+        pairs = []
+        for key in self.find_label(label, match):
+            kx0, ky0, kx1, ky1 = self.rects[key]
+            kh = max(ky1 - ky0, _EPS)
+            reach = max_distance if max_distance is not None else 25 * kh
+            entry: Dict[str, Any] = {'key': self.region(key), 'value': None}
+
+            text = str(self.texts[key])
+            pos = text.lower().find(label.lower()) if match != 'regex' else -1
+            if pos >= 0:
+                inline = text[pos + len(label):].strip(' :\t')
+                if inline:
+                    entry['value'] = {'text': inline, 'inline': True, 'bbox': entry['key']['bbox']}
+                    pairs.append(entry)
+                    continue
+
+            if direction == 'right':
+                search = (kx1, ky0, kx1 + reach, ky1)
+            elif direction == 'below':
+                search = (kx0 - kh, ky1, kx1 + kh, ky1 + reach)
+            else:
+                raise ValueError(f"Unknown direction: {direction}")
+
+            ids = self.index.query(search, 'intersects')
+            ids = ids[ids != key]
+            r = self.rects[ids]
+            if direction == 'right':
+                overlap = np.minimum(r[:, 3], ky1) - np.maximum(r[:, 1], ky0)
+                ok = (overlap >= 0.5 * np.minimum(r[:, 3] - r[:, 1], kh)) & (r[:, 0] >= kx0 + (kx1 - kx0) / 2)
+                gap = r[:, 0] - kx1
+            else:
+                overlap = np.minimum(r[:, 2], kx1) - np.maximum(r[:, 0], kx0)
+                ok = (overlap > 0) & (r[:, 1] >= ky0 + kh / 2)
+                gap = r[:, 1] - ky1
+            ids, gap = ids[ok], np.maximum(gap[ok], 0)
+            if len(ids):
+                best = int(np.argmin(gap))
+                entry['value'] = self.region(ids[best], gap[best])
+            pairs.append(entry)
+        return pairs
+
+
+class ResultStore:
+    """Thread-safe LRU of recent :class:`IndexedResult` objects keyed by result id."""
+
+    def __init__(self, capacity: int = 100, ttl: float = 3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._items: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def put(self, result: IndexedResult, result_id: Optional[str] = None) -> str:
+        result_id = result_id or str(uuid.uuid4())
+        with self._lock:
+            self._items[result_id] = (time.monotonic(), result)
+            self._items.move_to_end(result_id)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[IndexedResult]:
+        with self._lock:
+            item = self._items.get(result_id)
+            if item is None:
+                return None
+            stored_at, result = item
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._items[result_id]
+                return None
+            self._items.move_to_end(result_id)
+            return result
+
+    def shrink(self, fraction: float = 0.5) -> int:
+        """Drop the least recently used ``fraction`` of entries; returns an estimate of bytes freed."""
+        freed = 0
+        with self._lock:
+            for _ in range(int(len(self._items) * fraction)):
+                _, (_, result) = self._items.popitem(last=False)
+                freed += result.rects.nbytes + result.confidences.nbytes + sum(len(t) for t in result.texts) * 2
+        return freed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+def run_query(result: IndexedResult, query: str, arguments: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Dispatch a named query (``within``, ``nearest`` or ``key_value``) with tool-style arguments."""
+    if query == 'within':
+        return result.within(arguments['region'], arguments.get('mode', 'center'))
+    if query == 'nearest':
+        return result.nearest(arguments['point'], int(arguments.get('k', 1)), arguments.get('max_distance'))
+    if query == 'key_value':
+        return result.key_value(
+            arguments['label'],
+            arguments.get('direction', 'right'),
+            arguments.get('match', 'contains'),
+            arguments.get('max_distance'),
+        )
+    raise ValueError(f"Unknown query: {query}")
@@ -0,0 +1,308 @@
+"""
+Template-based form OCR.
+
+Most traffic is a handful of fixed form layouts, and the full pipeline
+re-reads their static labels and boilerplate on every page. A
+:class:`TemplateRegistry` keeps, per layout, a reference image and named
+field regions. Incoming pages are aligned to the best-matching reference
+with ORB features and a RANSAC homography, warped into the reference frame,
+and only the field regions are recognized. Pages that match no template go
+through the full pipeline instead.
+
+Templates are stored as ``<name>.json`` plus ``<name>.png`` under
+``templates.directory`` so every process and front end sees the same set.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from config import get_setting
+from ocr_backends import OCRBackend
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class TemplateError(ValueError):
+    """Invalid template definition or unknown template."""
+
+
+@dataclass
+class TemplateField:
+    """Named region ``[x1, y1, x2, y2]`` in reference image pixels."""
+    name: str
+    box: List[float]
+    multiline: bool = False
+
+
+@dataclass
+class FormTemplate:
+    """Reference layout: image size, field regions and cached ORB features."""
+    name: str
+    width: int
+    height: int
+    fields: List[TemplateField]
+    created_at: str = ''
+    keypoints: Optional[np.ndarray] = field(default=None, repr=False)
+    descriptors: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'width': self.width,
+            'height': self.height,
+            'fields': [asdict(f) for f in self.fields],
+            'created_at': self.created_at,
+        }
+
+
+@dataclass
+class TemplateMatch:
+    """A page aligned to a template: page-to-reference homography and RANSAC support."""
+    template: FormTemplate
+    homography: np.ndarray
+    inliers: int
+    inlier_ratio: float
+
+    def describe(self) -> Dict[str, Any]:
+        return {'inliers': self.inliers, 'inlier_ratio': round(self.inlier_ratio, 3)}
+
+
+def parse_fields(fields: Any, width: int, height: int) -> List[TemplateField]:
+    """Validate field definitions (JSON text or a list of dicts) against the reference size."""
+    if isinstance(fields, str):
+        try:
+            fields = json.loads(fields)
+        except json.JSONDecodeError as e:
+            raise TemplateError(f"Fields are not valid JSON: {e}")
+    if isinstance(fields, dict):
+        fields = fields.get('fields', [])
+    if not isinstance(fields, list) or not fields:
+        raise TemplateError("At least one field is required")
+
+    parsed = []
+    for spec in fields:
+        try:
+            name = str(spec['name'])
+            x1, y1, x2, y2 = (float(v) for v in spec['box'])
+        except (KeyError, TypeError, ValueError):
+            raise TemplateError(f"Field needs a name and a box [x1, y1, x2, y2]: {spec}")
+        if not (0 <= x1 < x2 <= width and 0 <= y1 < y2 <= height):
+            raise TemplateError(f"Field '{name}' box {spec['box']} is outside the {width}x{height} reference")
+        parsed.append(TemplateField(name=name, box=[x1, y1, x2, y2], multiline=bool(spec.get('multiline', False))))
+    names = [f.name for f in parsed]
+    if len(set(names)) != len(names):
+        raise TemplateError("Field names must be unique")
+    return parsed
+
+
+class TemplateRegistry:
+    """Form templates on disk, with in-memory reference features for matching."""
+
+    def __init__(self, directory: str, max_features: int = 1500, match_side: int = 1000,
+                 min_inliers: int = 25, min_inlier_ratio: float = 0.25, field_margin: int = 4):
+        self.directory = Path(directory)
+        self.max_features = max_features
+        self.match_side = match_side
+        self.min_inliers = min_inliers
+        self.min_inlier_ratio = min_inlier_ratio
+        self.field_margin = field_margin
+        self._templates: Dict[str, FormTemplate] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._stamp: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'TemplateRegistry':
+        return cls(
+            directory=get_setting('templates.directory', '/app/templates'),
+            max_features=int(get_setting('templates.max_features', 1500)),
+            match_side=int(get_setting('templates.match_side', 1000)),
+            min_inliers=int(get_setting('templates.min_inliers', 25)),
+            min_inlier_ratio=float(get_setting('templates.min_inlier_ratio', 0.25)),
+            field_margin=int(get_setting('templates.field_margin', 4)),
+        )
+
+    # Features
+
+    def _features(self, image: np.ndarray):
+        """ORB keypoints (in full-resolution pixels) and descriptors of a downscaled grayscale copy."""
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        scale = min(1.0, self.match_side / max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        orb = cv2.ORB_create(nfeatures=self.max_features)
+        keypoints, descriptors = orb.detectAndCompute(gray, None)
+        points = np.array([kp.pt for kp in keypoints], dtype=np.float32).reshape(-1, 2) / scale
+        return points, descriptors
+
+    # Registry
+
+    def _load(self) -> None:
+        """Sync the in-memory set with the directory; other processes may have changed it."""
+        try:
+            stamp = self.directory.stat().st_mtime_ns
+        except OSError:
+            return
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        on_disk = {}
+        for meta_path in self.directory.glob('*.json'):
+            on_disk[meta_path.stem] = meta_path.stat().st_mtime_ns
+        for name in set(self._templates) - set(on_disk):
+            del self._templates[name]
+        for name, mtime in sorted(on_disk.items()):
+            if name in self._templates and self._mtimes.get(name) == mtime:
+                continue
+            meta_path = self.directory / f'{name}.json'
+            try:
+                with open(meta_path, 'r') as handle:
+                    meta = json.load(handle)
+                image = cv2.imread(str(meta_path.with_suffix('.png')))
+                if image is None:
+                    raise TemplateError("reference image missing")
+                template = FormTemplate(
+                    name=meta['name'], width=int(meta['width']), height=int(meta['height']),
+                    fields=[TemplateField(**f) for f in meta['fields']], created_at=meta.get('created_at', ''),
+                )
+                template.keypoints, template.descriptors = self._features(image)
+                self._templates[name] = template
+                self._mtimes[name] = mtime
+            except Exception as e:
+                logger.warning(f"Skipping form template {meta_path.name}: {e}")
+        logger.info(f"Loaded {len(self._templates)} form templates from {self.directory}")
+
+    def register(self, name: str, image: np.ndarray, fields: Any) -> FormTemplate:
+        """Store ``image`` as the reference of template ``name`` with its field regions (replacing any)."""
+        if not _NAME.match(name or ''):
+            raise TemplateError("Template name must be 1-64 letters, digits, '-' or '_'")
+        height, width = image.shape[:2]
+        template = FormTemplate(name=name, width=width, height=height,
+                                fields=parse_fields(fields, width, height),
+                                created_at=datetime.now().isoformat())
+        template.keypoints, template.descriptors = self._features(image)
+        if template.descriptors is None or len(template.keypoints) < self.min_inliers:
+            raise TemplateError("Reference image has too little structure to align pages against")
+
+        with self._lock:
+            self._load()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Image first, metadata renamed into place last: readers never see half a template
+            cv2.imwrite(str(self.directory / f'{name}.png'), image)
+            meta_path = self.directory / f'{name}.json'
+            staging = self.directory / f'.{name}.json.tmp'
+            with open(staging, 'w') as handle:
+                json.dump(template.describe(), handle, indent=2)
+            os.replace(staging, meta_path)
+            self._templates[name] = template
+            self._mtimes[name] = meta_path.stat().st_mtime_ns
+        logger.info(f"Registered form template {name} with {len(template.fields)} fields")
+        return template
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            self._load()
+            if self._templates.pop(name, None) is None:
+                return False
+            for suffix in ('.json', '.png'):
+                (self.directory / f'{name}{suffix}').unlink(missing_ok=True)
+        return True
+
+    def get(self, name: str) -> FormTemplate:
+        with self._lock:
+            self._load()
+            if name not in self._templates:
+                raise TemplateError(f"Unknown form template: {name}")
+            return self._templates[name]
+
+    def list_templates(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._load()
+            return [template.describe() for template in self._templates.values()]
+
+    # Alignment
+
+    def match(self, image: np.ndarray, names: Optional[Sequence[str]] = None) -> Optional[TemplateMatch]:
+        """Best template for a page (among ``names`` if given), or ``None`` if none aligns well enough."""
+        if names:
+            candidates = [self.get(name) for name in names]
+        else:
+            with self._lock:
+                self._load()
+                candidates = list(self._templates.values())
+        if not candidates:
+            return None
+
+        points, descriptors = self._features(image)
+        if descriptors is None or len(points) < self.min_inliers:
+            return None
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        best: Optional[TemplateMatch] = None
+        for template in candidates:
+            pairs = matcher.knnMatch(descriptors, template.descriptors, k=2)
+            # Lowe's ratio test drops ambiguous matches from repeated boilerplate
+            good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < 0.75 * p[1].distance]
+            if len(good) < self.min_inliers:
+                continue
+            src = points[[m.queryIdx for m in good]]
+            dst = template.keypoints[[m.trainIdx for m in good]]
+            homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+            if homography is None:
+                continue
+            inliers = int(mask.sum())
+            ratio = inliers / len(good)
+            if inliers < self.min_inliers or ratio < self.min_inlier_ratio:
+                continue
+            if best is None or inliers > best.inliers:
+                best = TemplateMatch(template, homography, inliers, ratio)
+        return best
+
+    def field_crops(self, image: np.ndarray, match: TemplateMatch) -> List[np.ndarray]:
+        """Warp the page into the reference frame and cut out each field (with a small margin)."""
+        template = match.template
+        aligned = cv2.warpPerspective(image, match.homography, (template.width, template.height),
+                                      flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        crops = []
+        for f in template.fields:
+            x1, y1, x2, y2 = f.box
+            x1 = max(0, int(x1) - self.field_margin)
+            y1 = max(0, int(y1) - self.field_margin)
+            x2 = min(template.width, int(np.ceil(x2)) + self.field_margin)
+            y2 = min(template.height, int(np.ceil(y2)) + self.field_margin)
+            crops.append(aligned[y1:y2, x1:x2])
+        return crops
+
+
+def read_form(engine: OCRBackend, registry: TemplateRegistry, image: np.ndarray,
+              template: Optional[str] = None, cls: bool = True) -> Dict[str, Any]:
+    """
+    Read a form page: recognize only the fields of the matching template, or
+    run the full pipeline (``'result'`` in PaddleOCR's layout) if no template
+    matches.
+    """
+    match = registry.match(image, [template] if template else None)
+    if match is None:
+        return {'template': None, 'matched': False, 'result': engine.ocr(image, cls=cls)}
+
+    fields = match.template.fields
+    texts = engine.read_regions(registry.field_crops(image, match), [f.multiline for f in fields])
+    return {
+        'template': match.template.name,
+        'matched': True,
+        'alignment': match.describe(),
+        'fields': {f.name: {'text': text, 'confidence': round(confidence, 4)}
+                   for f, (text, confidence) in zip(fields, texts)},
+    }
+
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Services import each other as top-level modules; tests run on the model-free stub engine
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OCR_BACKEND', 'stub')
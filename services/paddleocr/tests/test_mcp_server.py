@@ -0,0 +1,108 @@
+"""MCP server driven over in-memory streams: progress and cancellation of a running batch."""
+
+import base64
+import time
+
+import anyio
+import cv2
+import mcp.types as types
+import numpy as np
+import pytest
+from mcp.server import NotificationOptions
+from mcp.server.models import InitializationOptions
+from mcp.shared.message import SessionMessage
+
+from mcp_server import PaddleOCRMCPServer
+
+IMAGES = 24
+
+
+def _image_data(index: int) -> str:
+    image = np.full((200, 300, 3), 255, np.uint8)
+    cv2.putText(image, f'page {index}', (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    return base64.b64encode(cv2.imencode('.png', image)[1].tobytes()).decode()
+
+
+def _request(request_id: int, method: str, params: dict) -> SessionMessage:
+    return SessionMessage(types.JSONRPCMessage(
+        types.JSONRPCRequest(jsonrpc='2.0', id=request_id, method=method, params=params)))
+
+
+def _notification(method: str, params: dict = None) -> SessionMessage:
+    return SessionMessage(types.JSONRPCMessage(
+        types.JSONRPCNotification(jsonrpc='2.0', method=method, params=params)))
+
+
+@pytest.fixture
+def server():
+    server = PaddleOCRMCPServer()
+    engine = server.pipeline.engine()
+    engine.latency = 0.2
+    detected = []
+    detect = engine.detect
+
+    def counting_detect(image):
+        detected.append(image.shape)
+        return detect(image)
+
+    engine.detect = counting_detect
+    server.detected = detected
+    yield server
+    server.scheduler.shutdown(wait=False)
+
+
+def test_cancel_running_batch(server):
+    received = []
+
+    async def scenario():
+        client_send, server_read = anyio.create_memory_object_stream(32)
+        server_write, client_read = anyio.create_memory_object_stream(32)
+        options = InitializationOptions(
+            server_name='paddleocr-mcp',
+            server_version='test',
+            capabilities=server.server.get_capabilities(NotificationOptions(), {}),
+        )
+
+        async def receive(match):
+            while True:
+                message = (await client_read.receive()).message.root
+                received.append(message)
+                if match(message):
+                    return message
+
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(server.server.run, server_read, server_write, options)
+            with anyio.fail_after(30):
+                await client_send.send(_request(1, 'initialize', {
+                    'protocolVersion': types.LATEST_PROTOCOL_VERSION,
+                    'capabilities': {},
+                    'clientInfo': {'name': 'test', 'version': '0'},
+                }))
+                await receive(lambda m: getattr(m, 'id', None) == 1)
+                await client_send.send(_notification('notifications/initialized'))
+
+                await client_send.send(_request(2, 'tools/call', {
+                    'name': 'batch_extract_text',
+                    'arguments': {'images': [{'image_data': _image_data(i)} for i in range(IMAGES)], 'timeout': 60},
+                    '_meta': {'progressToken': 'batch'},
+                }))
+                progress = await receive(lambda m: getattr(m, 'method', None) == 'notifications/progress')
+                assert progress.params['progressToken'] == 'batch'
+                assert 0 < progress.params['progress'] < IMAGES
+
+                await client_send.send(_notification('notifications/cancelled', {'requestId': 2, 'reason': 'test'}))
+                cancelled = await receive(lambda m: getattr(m, 'id', None) == 2)
+                assert isinstance(cancelled, types.JSONRPCError)
+
+                # The session survives the cancellation
+                await client_send.send(_request(3, 'tools/call', {'name': 'get_ocr_info', 'arguments': {}}))
+                info = await receive(lambda m: getattr(m, 'id', None) == 3)
+                assert isinstance(info, types.JSONRPCResponse)
+                assert not info.result.get('isError')
+            await client_send.aclose()
+
+    anyio.run(scenario)
+
+    # At most the group already running when the cancellation arrived finishes
+    time.sleep(1.0)
+    assert len(server.detected) < IMAGES
@@ -0,0 +1,211 @@
+"""
+Overlapping-tile OCR for very large images.
+
+Engineering drawings and large-format scans lose small text when the whole
+page is downscaled to the detector's input size, and a full-resolution pass
+needs memory proportional to the page and runs on one core. In tiling mode
+the page is cut into overlapping tiles about the detector's input size, each
+tile is OCR'd in a small pool of worker processes (each with its own engine,
+so tiles run in parallel and a worker never holds more than one tile), and
+the lines are shifted back to page coordinates. Lines found twice in a seam
+overlap are de-duplicated NMS-style, preferring the copy that was not cut by
+a tile edge. Lines longer than the overlap can still appear in two pieces.
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_setting
+from deadlines import Deadline
+
+logger = logging.getLogger(__name__)
+
+TILING_MODES = ('auto', 'on', 'off')
+
+# Engines of a tile worker process, by engine spec
+_worker_engines: Dict[Tuple, Any] = {}
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """Tiles ``(x0, y0, x1, y1)`` of at most ``tile`` pixels covering the page with ``overlap`` between neighbours."""
+    step = max(1, tile - overlap)
+
+    def starts(length: int) -> List[int]:
+        if length <= tile:
+            return [0]
+        positions = list(range(0, length - tile, step))
+        return positions + [length - tile]
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def _engine_spec(engine, **overrides) -> Tuple:
+    # Options as JSON: hashable even with nested values (cascade escalation)
+    options = json.dumps(dict(engine.options, **overrides), sort_keys=True, default=str)
+    return (engine.name, engine.language, engine.use_gpu, engine.use_angle_cls, options)
+
+
+def _ocr_tile(spec: Tuple, tile: np.ndarray, cls: bool) -> List[Any]:
+    """Worker process: OCR one tile with this process's engine for ``spec``."""
+    engine = _worker_engines.get(spec)
+    if engine is None:
+        from ocr_backends import create_backend
+        name, language, use_gpu, use_angle_cls, options = spec
+        engine = create_backend(name, language=language, use_gpu=use_gpu,
+                                use_angle_cls=use_angle_cls, options=json.loads(options))
+        _worker_engines[spec] = engine
+    result = engine.ocr(tile, cls=cls)
+    return (result[0] if result else None) or []
+
+
+def merge_tiles(tile_lines: List[Tuple[Tuple[int, int, int, int], List[Any]]], width: int, height: int,
+                overlap_threshold: float = 0.5, edge_margin: int = 4) -> List[Any]:
+    """
+    Shift tile lines to page coordinates and drop duplicates from seam
+    overlaps: a line is suppressed when most of its area lies inside an
+    already kept line. Lines not cut by an interior tile edge are kept first,
+    then larger ones.
+    """
+    lines, rects, cut = [], [], []
+    for (x0, y0, x1, y1), found in tile_lines:
+        for box, (text, confidence) in found:
+            quad = np.asarray(box, dtype=np.float64) + [x0, y0]
+            left, top = quad.min(axis=0)
+            right, bottom = quad.max(axis=0)
+            # Edges shared with a neighbouring tile (not the page border) may have cut the line
+            touches = ((x0 > 0 and left - x0 < edge_margin) or (y0 > 0 and top - y0 < edge_margin) or
+                       (x1 < width and x1 - right < edge_margin) or (y1 < height and y1 - bottom < edge_margin))
+            lines.append([quad.tolist(), (text, float(confidence))])
+            rects.append((left, top, right, bottom))
+            cut.append(touches)
+    if not lines:
+        return []
+
+    rects = np.asarray(rects)
+    areas = np.maximum(rects[:, 2] - rects[:, 0], 1e-6) * np.maximum(rects[:, 3] - rects[:, 1], 1e-6)
+    order = sorted(range(len(lines)), key=lambda i: (cut[i], -areas[i]))
+    kept: List[int] = []
+    for i in order:
+        if kept:
+            k = np.asarray(kept)
+            iw = np.minimum(rects[k, 2], rects[i, 2]) - np.maximum(rects[k, 0], rects[i, 0])
+            ih = np.minimum(rects[k, 3], rects[i, 3]) - np.maximum(rects[k, 1], rects[i, 1])
+            inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+            if (inter / areas[i]).max() >= overlap_threshold:
+                continue
+        kept.append(i)
+    kept.sort(key=lambda i: (rects[i, 1], rects[i, 0]))
+    return [lines[i] for i in kept]
+
+
+class Tiler:
+    """Decides when to tile and runs tiles on a lazily started process pool."""
+
+    def __init__(self, threshold_side: int = 4000, tile_size: int = 960, overlap: int = 160,
+                 processes: int = 2, threads_per_process: int = 1, overlap_threshold: float = 0.5):
+        self.threshold_side = threshold_side
+        self.tile_size = tile_size
+        self.overlap = min(overlap, tile_size // 2)
+        self.processes = max(0, int(processes))
+        self.threads_per_process = threads_per_process
+        self.overlap_threshold = overlap_threshold
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'Tiler':
+        return cls(
+            threshold_side=int(get_setting('tiling.threshold_side', 4000)),
+            tile_size=int(get_setting('tiling.tile_size', 960)),
+            overlap=int(get_setting('tiling.overlap', 160)),
+            processes=int(get_setting('tiling.processes', 2)),
+            threads_per_process=int(get_setting('tiling.threads_per_process', 1)),
+            overlap_threshold=float(get_setting('tiling.overlap_threshold', 0.5)),
+        )
+
+    def should_tile(self, width: int, height: int, mode: Optional[str] = 'auto') -> bool:
+        mode = mode or 'auto'
+        if mode not in TILING_MODES:
+            raise ValueError(f"Unknown tiling mode: {mode}. Use one of: {', '.join(TILING_MODES)}")
+        if mode == 'auto':
+            return max(width, height) > self.threshold_side
+        return mode == 'on'
+
+    def estimate(self, memory_governor, width: int, height: int, channels: int = 3,
+                 det_limit_side_len: Optional[int] = None) -> int:
+        """Memory this process needs for a tiled pass: the decoded page plus the tiles in flight."""
+        if self.processes == 0:
+            tile = memory_governor.estimate_request(self.tile_size, self.tile_size, channels, det_limit_side_len)
+        else:
+            tile = self.tile_size * self.tile_size * int(channels) * self.processes * 2
+        return int(width) * int(height) * int(channels) + tile
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the parent's inference runtime is not fork-safe
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Started {self.processes} tile worker processes")
+            return self._pool
+
+    def ocr(self, engine, image: np.ndarray, cls: bool = True,
+            deadline: Optional[Deadline] = None) -> List[Optional[List[Any]]]:
+        """OCR ``image`` tile by tile, in PaddleOCR's result layout and page coordinates."""
+        height, width = image.shape[:2]
+        tiles = tile_grid(width, height, self.tile_size, self.overlap)
+        tile_lines: List[Tuple[Tuple[int, int, int, int], List[Any]]] = []
+
+        if self.processes == 0:
+            for rect in tiles:
+                if deadline:
+                    deadline.check()
+                x0, y0, x1, y1 = rect
+                result = engine.ocr(np.ascontiguousarray(image[y0:y1, x0:x1]), cls=cls)
+                tile_lines.append((rect, (result[0] if result else None) or []))
+        else:
+            overrides = {'cpu_threads': self.threads_per_process} if self.threads_per_process else {}
+            spec = _engine_spec(engine, **overrides)
+            executor = self._executor()
+            # A bounded window of tiles in flight keeps the parent's tile copies small too
+            queued = iter(tiles)
+            futures: Dict[Future, Tuple[int, int, int, int]] = {}
+
+            def submit_next() -> None:
+                rect = next(queued, None)
+                if rect is not None:
+                    x0, y0, x1, y1 = rect
+                    tile = np.ascontiguousarray(image[y0:y1, x0:x1])
+                    futures[executor.submit(_ocr_tile, spec, tile, cls)] = rect
+
+            try:
+                for _ in range(self.processes * 2):
+                    submit_next()
+                while futures:
+                    if deadline:
+                        deadline.check()
+                    done, _ = wait(list(futures), timeout=deadline.wait_timeout(1.0) if deadline else None,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        tile_lines.append((futures.pop(future), future.result()))
+                        submit_next()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        lines = merge_tiles(tile_lines, width, height, self.overlap_threshold)
+        logger.info(f"Tiled OCR: {width}x{height} in {len(tiles)} tiles, {len(lines)} lines")
+        return [lines or None]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
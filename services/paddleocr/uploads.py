@@ -0,0 +1,193 @@
+"""
+Streaming, size-capped multipart upload handling for the Flask endpoints.
+
+The request body is read incrementally with Werkzeug's sans-IO multipart
+decoder instead of letting Flask buffer or spool the whole form. Per-file and
+per-request byte limits are enforced while reading, each file's type is
+sniffed from its magic bytes as soon as its first bytes arrive, and files are
+yielded one by one the moment they are complete so OCR can start while the
+rest of the body is still arriving.
+"""
+
+import io
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+import cv2
+import numpy as np
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from config import get_setting
+
+# Magic-byte signatures of the image formats the OCR pipeline can decode
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+SNIFF_BYTES = 12
+MAX_FORM_VALUE = 1 << 20
+
+
+class UploadError(Exception):
+    """Request-level upload failure mapped to an HTTP status."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class UploadedFile:
+    """One file part of a multipart request, held in memory."""
+    field: str
+    filename: str
+    data: bytes = b''
+    image_type: Optional[str] = None
+    error: Optional[str] = None
+    status: int = 400
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Identify an image format from its first bytes; ``None`` if unrecognized."""
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def allowed_image_types() -> Set[str]:
+    """Image types permitted by ``security.allowed_extensions``."""
+    extensions = get_setting('security.allowed_extensions',
+                             ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'])
+    aliases = {'jpg': 'jpeg', 'tif': 'tiff'}
+    return {aliases.get(ext.lstrip('.').lower(), ext.lstrip('.').lower()) for ext in extensions}
+
+
+def upload_limits() -> dict:
+    """Per-file and per-request byte limits from the ``security`` config section."""
+    max_file_size = int(get_setting('security.max_file_size', 10485760))
+    return {
+        'max_file_size': max_file_size,
+        'max_request_size': int(get_setting('security.max_request_size',
+                                            max_file_size * int(get_setting('ocr.max_batch_size', 10)))),
+        'chunk_size': int(get_setting('security.upload_chunk_size', 65536)),
+    }
+
+
+def decode_image_bytes(data: bytes) -> Optional[np.ndarray]:
+    """Decode image bytes to a BGR array, falling back to PIL for formats OpenCV lacks (GIF)."""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is not None:
+        return image
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return cv2.cvtColor(np.array(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+    except Exception:
+        return None
+
+
+def image_dimensions(data: bytes) -> tuple:
+    """Width, height and channel count from the image header without decoding pixels."""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size[0], img.size[1], max(len(img.getbands()), 3)
+
+
+def iter_uploaded_files(stream, content_type: str, fields: Iterable[str], max_file_size: int,
+                        max_request_size: int, chunk_size: int = 65536,
+                        allowed_types: Optional[Set[str]] = None,
+                        form: Optional[Dict[str, str]] = None) -> Iterator[UploadedFile]:
+    """
+    Parse a multipart body from ``stream`` and yield file parts of ``fields``
+    as soon as each one has fully arrived. Plain form values are collected
+    into ``form`` when given (up to ``MAX_FORM_VALUE`` bytes each); a value is
+    there once the parser has passed it.
+
+    A file that exceeds ``max_file_size`` or whose magic bytes are not an
+    allowed image type is yielded with ``error`` set as soon as that is known,
+    and the rest of its bytes are discarded instead of buffered. Exceeding ``max_request_size`` raises
+    :class:`UploadError` (413) immediately.
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    boundary = options.get('boundary', '').encode('latin-1')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('Expected a multipart/form-data request', 400)
+
+    fields = set(fields)
+    # Same read granularity as Werkzeug's own form parser; tiny reads only add overhead
+    chunk_size = max(chunk_size, 4096)
+    allowed_types = allowed_types if allowed_types is not None else allowed_image_types()
+    decoder = MultipartDecoder(boundary, max_form_memory_size=max(chunk_size * 2, 1 << 20))
+    received = 0
+    current: Optional[UploadedFile] = None
+    value_name: Optional[str] = None
+    buffer = bytearray()
+
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as e:
+            raise UploadError(f'Malformed multipart body: {e}', 400)
+        if isinstance(event, NeedData):
+            try:
+                chunk = stream.read(chunk_size)
+            except RequestEntityTooLarge:
+                # Werkzeug's stream enforces MAX_CONTENT_LENGTH (a declared Content-Length) on read
+                raise UploadError(f'Request body exceeds {max_request_size} bytes', 413)
+            if chunk:
+                received += len(chunk)
+                if received > max_request_size:
+                    raise UploadError(f'Request body exceeds {max_request_size} bytes', 413)
+                decoder.receive_data(chunk)
+            else:
+                decoder.receive_data(None)
+        elif isinstance(event, File):
+            value_name = None
+            current = UploadedFile(field=event.name, filename=event.filename or '') if event.name in fields else None
+            buffer = bytearray()
+            if current is not None and not current.filename:
+                current.error = 'No file selected'
+        elif isinstance(event, Field):
+            current, buffer = None, bytearray()
+            value_name = event.name if form is not None else None
+        elif isinstance(event, Data) and value_name is not None:
+            buffer.extend(event.data)
+            if len(buffer) > MAX_FORM_VALUE:
+                raise UploadError(f"Form field '{value_name}' exceeds {MAX_FORM_VALUE} bytes", 413)
+            if not event.more_data:
+                form[value_name] = buffer.decode('utf-8', errors='replace')
+                value_name, buffer = None, bytearray()
+        elif isinstance(event, Data):
+            if current is not None and current.error is None:
+                buffer.extend(event.data)
+                if current.image_type is None and (len(buffer) >= SNIFF_BYTES or not event.more_data):
+                    current.image_type = sniff_image_type(bytes(buffer[:SNIFF_BYTES]))
+                    if current.image_type is None or current.image_type not in allowed_types:
+                        current.error = ('Invalid file type. Supported: ' +
+                                         ', '.join(sorted(t.upper() for t in allowed_types)))
+                if len(buffer) > max_file_size:
+                    current.error = f'File exceeds {max_file_size} bytes'
+                    current.status = 413
+            if current is not None and current.error is not None:
+                # Report the rejection now; the rest of this part is read and dropped
+                yield current
+                current, buffer = None, bytearray()
+            elif not event.more_data:
+                if current is not None:
+                    if buffer:
+                        current.data = bytes(buffer)
+                    else:
+                        current.error = 'Empty file'
+                    yield current
+                current, buffer = None, bytearray()
+        elif isinstance(event, Epilogue):
+            return
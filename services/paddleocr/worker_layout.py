@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+CPU-topology-aware worker placement and inference thread tuning.
+
+Running N workers that each use Paddle's default thread count oversubscribes
+the cores and collapses throughput. This module derives a layout of
+``workers x threads_per_worker`` from the CPUs actually available to the
+process (affinity mask and cgroup quota), optionally pins each worker to its
+own set of physical cores, and builds the matching PaddleOCR engine options.
+
+Usage:
+    python worker_layout.py show
+    python worker_layout.py sweep --images ./samples --seconds 20
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+@dataclass
+class CPUTopology:
+    """CPUs usable by this process, grouped by physical core."""
+    allowed_cpus: List[int]
+    cgroup_limit: Optional[float]
+    cores: List[List[int]] = field(default_factory=list)  # sibling CPU ids per physical core
+
+    @property
+    def usable_cpus(self) -> int:
+        """CPUs worth of compute: affinity mask capped by the cgroup quota."""
+        count = len(self.allowed_cpus)
+        if self.cgroup_limit:
+            count = min(count, max(1, int(math.floor(self.cgroup_limit))))
+        return max(1, count)
+
+    def placement_order(self) -> List[int]:
+        """Allowed CPUs ordered so that consecutive slices fill distinct physical cores first."""
+        first = [siblings[0] for siblings in self.cores]
+        rest = [cpu for siblings in self.cores for cpu in siblings[1:]]
+        return first + rest
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """CPU quota from cgroup v2 ``cpu.max`` or v1 ``cfs_quota_us``; ``None`` when unlimited."""
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and period:
+            return int(quota) / int(period)
+        return None
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def detect_topology() -> CPUTopology:
+    """Inspect affinity, cgroup quota and sysfs core ids for the current process."""
+    try:
+        allowed = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        allowed = list(range(os.cpu_count() or 1))
+
+    by_core: Dict[Tuple[int, int], List[int]] = {}
+    for cpu in allowed:
+        base = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        package = _read(f'{base}/physical_package_id')
+        core = _read(f'{base}/core_id')
+        key = (int(package), int(core)) if package is not None and core is not None else (0, cpu)
+        by_core.setdefault(key, []).append(cpu)
+
+    cores = [sorted(cpus) for _, cpus in sorted(by_core.items())]
+    return CPUTopology(allowed_cpus=allowed, cgroup_limit=cgroup_cpu_limit(), cores=cores)
+
+
+@dataclass
+class WorkerLayout:
+    """How many workers to run, how many inference threads each gets and where they run."""
+    workers: int
+    threads_per_worker: int
+    pin_cores: bool
+    cpu_sets: List[List[int]] = field(default_factory=list)
+
+    def cpus_for(self, worker_index: int) -> Optional[List[int]]:
+        if not self.pin_cores or not self.cpu_sets:
+            return None
+        return self.cpu_sets[worker_index % len(self.cpu_sets)]
+
+
+def _auto(value: Any) -> Optional[int]:
+    if value in (None, 'auto', 0):
+        return None
+    return int(value)
+
+
+def plan_layout(workers: Any = None, threads_per_worker: Any = None, pin_cores: Optional[bool] = None,
+                max_workers: Optional[int] = None, topology: Optional[CPUTopology] = None) -> WorkerLayout:
+    """
+    Derive a worker layout from the usable CPUs.
+
+    Unset values come from ``performance.inference`` in the config. With both
+    ``workers`` and ``threads_per_worker`` on ``auto`` the layout favours
+    several two-thread workers, which is where Paddle CPU inference gets the
+    best throughput per core; ``performance.max_workers`` caps the count to
+    bound model memory.
+    """
+    topology = topology or detect_topology()
+    cpus = topology.usable_cpus
+    workers = _auto(workers if workers is not None else get_setting('performance.inference.workers'))
+    threads = _auto(threads_per_worker if threads_per_worker is not None
+                    else get_setting('performance.inference.threads_per_worker'))
+    if pin_cores is None:
+        pin_cores = bool(get_setting('performance.inference.pin_cores', False))
+    if max_workers is None:
+        max_workers = int(get_setting('performance.max_workers', 4))
+
+    if workers and threads:
+        if workers * threads > cpus:
+            logger.warning(f"Worker layout {workers}x{threads} oversubscribes {cpus} usable CPUs")
+    elif workers:
+        threads = max(1, cpus // workers)
+    elif threads:
+        workers = max(1, min(max_workers, cpus // threads))
+    else:
+        threads = 2 if cpus >= 4 else 1
+        workers = max(1, min(max_workers, cpus // threads))
+        threads = max(threads, cpus // workers)
+
+    cpu_sets: List[List[int]] = []
+    if pin_cores:
+        if len(topology.cores) >= workers:
+            # Give each worker whole physical cores so workers never share a core's siblings
+            per_worker = len(topology.cores) // workers
+            for index in range(workers):
+                group = CPUTopology([], None, topology.cores[index * per_worker:(index + 1) * per_worker])
+                order = group.placement_order()
+                cpu_sets.append(order[:threads] if len(order) >= threads else order)
+        else:
+            order = topology.placement_order()
+            for index in range(workers):
+                chunk = order[index * threads:(index + 1) * threads]
+                cpu_sets.append(chunk or order)
+
+    return WorkerLayout(workers=workers, threads_per_worker=threads, pin_cores=pin_cores, cpu_sets=cpu_sets)
+
+
+def apply_worker_placement(layout: WorkerLayout, worker_index: int = 0) -> None:
+    """
+    Pin the current process and cap its math-library thread pools.
+
+    Call in each worker before Paddle is imported so OpenMP/MKL pick up the
+    thread counts.
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(layout.threads_per_worker)
+    cpus = layout.cpus_for(worker_index)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not pin worker {worker_index} to CPUs {cpus}: {e}")
+    logger.info(f"Worker {worker_index}: {layout.threads_per_worker} threads, CPUs {cpus or 'unpinned'}")
+
+
+def engine_options(layout: Optional[WorkerLayout] = None) -> Dict[str, Any]:
+    """PaddleOCR constructor options for MKLDNN and intra-op threading."""
+    layout = layout or plan_layout()
+    return {
+        'enable_mkldnn': bool(get_setting('performance.inference.enable_mkldnn', True)),
+        'cpu_threads': layout.threads_per_worker,
+    }
+
+
+def _candidate_layouts(cpus: int) -> List[Tuple[int, int]]:
+    threads_options = sorted({t for t in (1, 2, 3, 4, 6, 8, 12, 16) if t <= cpus} | {cpus})
+    return [(max(1, cpus // t), t) for t in threads_options]
+
+
+def _sweep_worker(index: int, layout: Dict[str, Any], images: List[str], seconds: float,
+                  start_barrier, setup_timeout: float, results) -> None:
+    """
+    Worker process body for the sweep: pin, build the engine, run until time
+    is up. Puts ``(latencies, None)`` or, on failure, ``(None, error)``.
+    """
+    try:
+        plan = WorkerLayout(**layout)
+        apply_worker_placement(plan, index)
+
+        import cv2
+        from paddleocr import PaddleOCR
+
+        engine = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False, show_log=False, **engine_options(plan))
+        decoded = [cv2.imread(path) for path in images]
+        decoded = [image for image in decoded if image is not None]
+        engine.ocr(decoded[0], cls=True)  # warm-up
+
+        start_barrier.wait(setup_timeout)
+        latencies = []
+        deadline = time.perf_counter() + seconds
+        position = index
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            engine.ocr(decoded[position % len(decoded)], cls=True)
+            latencies.append(time.perf_counter() - started)
+            position += 1
+    except Exception as e:
+        results.put((None, f"worker {index}: {type(e).__name__}: {e}"))
+        # Release the others waiting at the barrier instead of leaving them to time out
+        start_barrier.abort()
+        return
+    results.put((latencies, None))
+
+
+def _run_sweep_layout(context, plan: WorkerLayout, paths: List[str], seconds: float) -> Tuple[List[float], float]:
+    """
+    Run one layout's sweep workers; returns all latencies and the measured
+    seconds. Raises ``RuntimeError`` when a worker fails, crashes or stalls.
+    """
+    import queue
+    import threading
+
+    # Engine load and warm-up, then the run itself plus one slow last image
+    setup_timeout = max(120.0, 3 * seconds)
+    run_timeout = seconds + max(30.0, seconds)
+    barrier = context.Barrier(plan.workers + 1)
+    results = context.Queue()
+    procs = [context.Process(target=_sweep_worker,
+                             args=(i, asdict(plan), paths, seconds, barrier, setup_timeout, results))
+             for i in range(plan.workers)]
+    for proc in procs:
+        proc.start()
+    starting = threading.Event()
+    starting.set()
+
+    def watch_setup() -> None:
+        # A worker killed outright (OOM, segfault) never reaches the barrier or aborts it
+        while starting.is_set():
+            if any(proc.exitcode is not None for proc in procs):
+                barrier.abort()
+                return
+            time.sleep(0.5)
+
+    threading.Thread(target=watch_setup, daemon=True).start()
+    try:
+        try:
+            barrier.wait(setup_timeout)
+        except threading.BrokenBarrierError:
+            # A failing worker breaks the barrier after queueing its error
+            try:
+                _, error = results.get(timeout=5)
+            except queue.Empty:
+                dead = [proc.exitcode for proc in procs if proc.exitcode is not None]
+                error = (f"worker exited during setup (exit codes {dead})" if dead
+                         else f"workers did not start within {setup_timeout:.0f}s")
+            raise RuntimeError(error)
+        finally:
+            starting.clear()
+        started = time.perf_counter()
+        latencies: List[float] = []
+        pending = len(procs)
+        while pending:
+            try:
+                measured, error = results.get(timeout=1.0)
+            except queue.Empty:
+                if time.perf_counter() - started > run_timeout:
+                    raise RuntimeError(f"workers still running after {run_timeout:.0f}s")
+                if not any(proc.is_alive() for proc in procs):
+                    codes = [proc.exitcode for proc in procs]
+                    raise RuntimeError(f"workers exited without reporting (exit codes {codes})")
+                continue
+            if error:
+                raise RuntimeError(error)
+            latencies.extend(measured)
+            pending -= 1
+        return latencies, time.perf_counter() - started
+    finally:
+        barrier.abort()
+        for proc in procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+
+def sweep(image_dir: str, seconds: float = 20.0, pin_cores: bool = True,
+          max_images: int = 50) -> List[Dict[str, Any]]:
+    """
+    Measure throughput of each candidate layout on sample images; best layout
+    first. A layout whose workers fail, crash or stall is reported with its
+    ``error`` and no throughput.
+    """
+    import multiprocessing
+
+    paths = sorted(str(p) for p in Path(image_dir).iterdir()
+                   if p.suffix.lower() in {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'})[:max_images]
+    if not paths:
+        raise ValueError(f"No images found in {image_dir}")
+
+    topology = detect_topology()
+    context = multiprocessing.get_context('spawn')
+    report = []
+    for workers, threads in _candidate_layouts(topology.usable_cpus):
+        plan = plan_layout(workers, threads, pin_cores, max_workers=workers, topology=topology)
+        try:
+            latencies, elapsed = _run_sweep_layout(context, plan, paths, seconds)
+        except RuntimeError as e:
+            logger.error(f"Layout {workers}x{threads} failed: {e}")
+            report.append({'workers': workers, 'threads_per_worker': threads, 'images': 0,
+                           'throughput': 0.0, 'error': str(e)})
+            continue
+
+        latencies.sort()
+        entry = {
+            'workers': workers,
+            'threads_per_worker': threads,
+            'images': len(latencies),
+            'throughput': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+        }
+        logger.info(f"Layout {workers}x{threads}: {entry['throughput']} img/s, p95 {entry['p95_ms']} ms")
+        report.append(entry)
+
+    report.sort(key=lambda item: item['throughput'], reverse=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker layout tools for PaddleOCR")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('show', help='Show detected CPU topology and the planned layout')
+    sweep_parser = sub.add_parser('sweep', help='Benchmark candidate layouts and report the best one')
+    sweep_parser.add_argument('--images', required=True, help='Directory of sample images')
+    sweep_parser.add_argument('--seconds', type=float, default=20.0, help='Measurement time per layout')
+    sweep_parser.add_argument('--max-images', type=int, default=50)
+    sweep_parser.add_argument('--no-pin', action='store_true', help='Do not pin workers to cores')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'show':
+        topology = detect_topology()
+        print(json.dumps({
+            'allowed_cpus': topology.allowed_cpus,
+            'cgroup_limit': topology.cgroup_limit,
+            'physical_cores': len(topology.cores),
+            'usable_cpus': topology.usable_cpus,
+            'layout': asdict(plan_layout(topology=topology)),
+            'engine_options': engine_options(),
+        }, indent=2))
+    else:
+        report = sweep(args.images, args.seconds, not args.no_pin, args.max_images)
+        print(json.dumps(report, indent=2))
+        best = report[0]
+        if best.get('error'):
+            raise SystemExit("Every layout failed; no settings to suggest")
+        print("\n# Suggested config.yaml settings")
+        print("performance:")
+        print(f"  max_workers: {best['workers']}")
+        print("  inference:")
+        print(f"    workers: {best['workers']}")
+        print(f"    threads_per_worker: {best['threads_per_worker']}")
+
+
+if __name__ == '__main__':
+    main()